@@ -0,0 +1,270 @@
+"""Load and throughput benchmark of the webservice.
+
+The app is created by 'flask.create_app()' with a temporary data directory. For
+every pocket size, a pocket is filled with entries, and requests of each
+operation (add, list, get, update, copy) are sent by one or more concurrent
+clients, either through the flask test client, or over HTTP to a local
+threaded WSGI server. Throughput and latency percentiles are written as JSON
+such that results of different releases can be compared.
+
+Run from the repository root, e.g.
+
+    python benchmarks/bench_service.py --sizes 1000,10000 --output results.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+from financeager_flask import version
+from financeager_flask.flask import create_app
+
+POCKET = "bench"
+COPY_POCKET = "bench-copy"
+OPERATIONS = ("add", "list", "get", "update", "copy")
+TRANSPORTS = ("test-client", "wsgi")
+FILL_CHUNK_SIZE = 5000
+# Number of distinct categories of entries; 'list' filters for one of them
+CATEGORIES = 100
+
+
+def fill(server, size):
+    """Add 'size' standard entries to the benchmark pocket."""
+    for start in range(0, size, FILL_CHUNK_SIZE):
+        operations = [
+            {
+                "command": "add",
+                "name": f"entry {i}",
+                "value": random.randint(-1000, 1000) / 10,
+                "category": f"category {i % CATEGORIES}",
+                "date": "2020-{:02d}-{:02d}".format(i % 12 + 1, i % 28 + 1),
+            }
+            for i in range(start, min(start + FILL_CHUNK_SIZE, size))
+        ]
+        server.run("batch", pocket=POCKET, operations=operations)
+
+
+def request_args(operation, size):
+    """Return method, URL path, and JSON body of a request of the operation."""
+    eid = random.randint(1, size)
+    if operation == "add":
+        return "POST", f"/pockets/{POCKET}", {"name": "bench", "value": 1}
+    if operation == "list":
+        category = random.randrange(CATEGORIES)
+        return "GET", f"/pockets/{POCKET}?filter_category=^category {category}$", None
+    if operation == "get":
+        return "GET", f"/pockets/{POCKET}/standard/{eid}", None
+    if operation == "update":
+        return "PATCH", f"/pockets/{POCKET}/standard/{eid}", {"value": 2}
+    return (
+        "POST",
+        "/copy",
+        {"source_pocket": POCKET, "destination_pocket": COPY_POCKET, "eid": eid},
+    )
+
+
+class TestClientTransport:
+    """Send requests through the flask test client (one per thread)."""
+
+    def __init__(self, app):
+        self._app = app
+        self._local = threading.local()
+
+    def send(self, method, path, body):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        return client.open(path, method=method, json=body).status_code
+
+    def close(self):
+        pass
+
+
+class WsgiTransport:
+    """Send requests over HTTP to a threaded WSGI server serving the app (one
+    keep-alive session per thread)."""
+
+    def __init__(self, app):
+        self._server = make_server("127.0.0.1", 0, app, threaded=True)
+        self._url = "http://127.0.0.1:{}".format(self._server.server_port)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        self._local = threading.local()
+
+    def send(self, method, path, body):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session.request(method, self._url + path, json=body).status_code
+
+    def close(self):
+        self._server.shutdown()
+        self._thread.join()
+
+
+def percentile(sorted_values, fraction):
+    """Return the percentile of the sorted values (nearest-rank method)."""
+    index = max(
+        0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def measure(transport, operation, size, count, concurrency):
+    """Send 'count' requests of the operation by 'concurrency' clients.
+
+    :return: dict with throughput (requests per second), latencies (in
+        milliseconds), and number of errors
+    """
+
+    def send(_):
+        method, path, body = request_args(operation, size)
+        start = time.perf_counter()
+        status = transport.send(method, path, body)
+        return time.perf_counter() - start, status >= 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        "requests": count,
+        "errors": sum(error for _, error in results),
+        "throughput": round(count / elapsed, 1),
+        "mean_ms": round(sum(latencies) / count, 3),
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+    }
+
+
+def run(args):
+    results = []
+    for transport_name in args.transports:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory(prefix="financeager-bench-") as data_dir:
+                app = create_app(
+                    data_dir=data_dir,
+                    config={"POCKET_STORAGE_ENGINE": args.storage_engine},
+                )
+                fill(app._server, size)
+
+                transport = (
+                    WsgiTransport(app)
+                    if transport_name == "wsgi"
+                    else TestClientTransport(app)
+                )
+                try:
+                    for concurrency in args.concurrency:
+                        for operation in args.operations:
+                            count = args.requests
+                            if operation == "list":
+                                count = max(1, count // args.list_divisor)
+                            result = measure(
+                                transport, operation, size, count, concurrency
+                            )
+                            result.update(
+                                transport=transport_name,
+                                size=size,
+                                concurrency=concurrency,
+                                operation=operation,
+                            )
+                            print(json.dumps(result), file=sys.stderr)
+                            results.append(result)
+                finally:
+                    transport.close()
+                    app._server.run("stop")
+
+    return results
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def _choice_list(choices):
+    def parse(value):
+        values = value.split(",")
+        invalid = set(values) - set(choices)
+        if invalid:
+            raise argparse.ArgumentTypeError(f"invalid choice(s): {invalid}")
+        return values
+
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=_int_list,
+        default=[1000, 10000, 100000],
+        help="comma-separated pocket sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=_int_list,
+        default=[1, 8],
+        help="comma-separated numbers of concurrent clients (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--operations",
+        type=_choice_list(OPERATIONS),
+        default=list(OPERATIONS),
+        help="comma-separated operations (default: all)",
+    )
+    parser.add_argument(
+        "--transports",
+        type=_choice_list(TRANSPORTS),
+        default=list(TRANSPORTS),
+        help="comma-separated transports (default: all)",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="number of requests per operation (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--list-divisor",
+        type=int,
+        default=10,
+        help="send fewer 'list' requests by this factor (default: %(default)s)",
+    )
+    parser.add_argument("--storage-engine", default="json", choices=["json", "sqlite"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write (default: stdout)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = {
+        "metadata": {
+            "version": version(),
+            "financeager_version": version("financeager"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "arguments": vars(args),
+        },
+        "results": run(args),
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
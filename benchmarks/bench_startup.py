@@ -0,0 +1,198 @@
+"""Start-up time benchmark of the command line client.
+
+Two quantities are measured in fresh interpreters, repeatedly: the time to
+import the plugin and create the client (the part of every 'fina' invocation
+that this package contributes to), and the end-to-end time of 'fina list'
+against a local threaded WSGI server serving the app. The modules with highest
+cumulative import time (as reported by 'python -X importtime') are listed to
+show what dominates the start-up. Results are written as JSON.
+
+Run from the repository root, e.g.
+
+    python benchmarks/bench_startup.py --runs 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from financeager_flask import version
+from financeager_flask.flask import create_app
+
+POCKET = "bench"
+
+IMPORT_CODE = """\
+from financeager import clients, config
+from financeager_flask import main
+plugin = main.main()
+client = main._Client(
+    configuration=config.Configuration(plugins=[plugin]),
+    sinks=clients.Client.Sinks(print, print),
+)
+client.shutdown()
+"""
+
+CLI_CODE = "from financeager.cli import main; main()"
+
+
+def percentile(sorted_values, fraction):
+    """Return the percentile of the sorted values (nearest-rank method)."""
+    index = max(
+        0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def timed_runs(args, runs, env):
+    """Run the command 'runs' times and return statistics of the wall time."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, check=True, stdout=subprocess.DEVNULL)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    durations.sort()
+    return {
+        "runs": runs,
+        "mean_ms": round(sum(durations) / runs, 1),
+        "p50_ms": round(percentile(durations, 0.5), 1),
+        "min_ms": round(durations[0], 1),
+    }
+
+
+def slowest_imports(env, top):
+    """Return the 'top' modules with highest cumulative import time when
+    running IMPORT_CODE.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_CODE],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in process.stderr.splitlines():
+        # Lines are formatted as 'import time: self | cumulative | module'
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        imports.append((int(fields[1]), fields[2].strip()))
+
+    imports.sort(reverse=True)
+    return [
+        {"module": module, "cumulative_ms": round(us / 1000, 1)}
+        for us, module in imports[:top]
+    ]
+
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="financeager-bench-") as tmp_dir:
+        # Isolate data and configuration directories of the client
+        env = dict(
+            os.environ,
+            XDG_DATA_HOME=os.path.join(tmp_dir, "data"),
+            XDG_CONFIG_HOME=os.path.join(tmp_dir, "config"),
+        )
+
+        app = create_app(data_dir=os.path.join(tmp_dir, "server"))
+        app._server.run(
+            "batch",
+            pocket=POCKET,
+            operations=[
+                {"command": "add", "name": f"entry {i}", "value": i}
+                for i in range(args.entries)
+            ],
+        )
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        config_filepath = os.path.join(tmp_dir, "config.ini")
+        with open(config_filepath, "w") as file:
+            file.write(
+                "[SERVICE]\nname = flask\n\n[SERVICE:FLASK]\n"
+                f"host = http://127.0.0.1:{server.server_port}\n"
+                f"cache_dir = {os.path.join(tmp_dir, 'cache')}\n"
+            )
+
+        try:
+            return {
+                "import": timed_runs(
+                    [sys.executable, "-c", IMPORT_CODE], args.runs, env
+                ),
+                "list": timed_runs(
+                    [
+                        sys.executable,
+                        "-c",
+                        CLI_CODE,
+                        "list",
+                        "--pocket",
+                        POCKET,
+                        "--config-filepath",
+                        config_filepath,
+                    ],
+                    args.runs,
+                    env,
+                ),
+                "slowest_imports": slowest_imports(env, args.top),
+            }
+        finally:
+            server.shutdown()
+            thread.join()
+            app._server.run("stop")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=10,
+        help="number of runs per measurement (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=100,
+        help="number of entries in the listed pocket (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=15,
+        help="number of slowest imports to report (default: %(default)s)",
+    )
+    parser.add_argument("--output", help="JSON file to write (default: stdout)")
+    args = parser.parse_args()
+
+    report = {
+        "metadata": {
+            "version": version(),
+            "financeager_version": version("financeager"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "arguments": vars(args),
+        },
+        "results": run(args),
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Micro-benchmark comparing the request validation of the resources (see the
+'validation' module) with equivalent flask_restful reqparse parsers.
+
+Run from the repository root:
+
+    python benchmarks/bench_validation.py [--number N]
+"""
+import argparse
+import timeit
+
+from flask import Flask
+from flask_restful import reqparse
+
+from financeager_flask import resources
+
+PAYLOADS = {
+    "add": (
+        resources.put_parser,
+        {"name": "bread", "value": -2.5, "category": "food", "date": "2020-01-01"},
+    ),
+    "update": (resources.update_parser, {"value": "-3", "category": "groceries"}),
+    "copy": (
+        resources.copy_parser,
+        {"source_pocket": "2020", "destination_pocket": "2021", "eid": 1},
+    ),
+}
+
+
+def reqparse_equivalent(schema):
+    """Create a reqparse parser with the same arguments as the schema."""
+    parser = reqparse.RequestParser()
+    for name, type_, required in schema._fields:
+        parser.add_argument(name, type=type_, required=required)
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    print(f"{'payload':<8} {'reqparse [us]':>14} {'schema [us]':>12} {'speedup':>8}")
+    for name, (schema, payload) in PAYLOADS.items():
+        timings = []
+        for p in [reqparse_equivalent(schema), schema]:
+            with app.test_request_context("/", method="POST", json=payload):
+                assert dict(p.parse_args()) == dict(schema.parse_args())
+                seconds = min(timeit.repeat(p.parse_args, number=args.number, repeat=3))
+            timings.append(seconds / args.number * 1e6)
+
+        print(
+            f"{name:<8} {timings[0]:>14.2f} {timings[1]:>12.2f} "
+            f"{timings[0] / timings[1]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
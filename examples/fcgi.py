@@ -28,7 +28,8 @@ You can prettify the URL format by adding a file ~/html/.htaccess with content
     RewriteEngine On
     RewriteRule ^financeager/(.*)$ /fcgi-bin/financeager.fcgi/$1 [QSA,L]
 
-Force a restart of the FCGI app by killing the existing one.
+Force a restart of the FCGI app by killing the existing one. Snapshots (see
+below) let the restarted app resume with the pockets loaded before.
 This allows you to access via
     http://USER.STAR.uberspace.de/financeager
 
@@ -46,6 +47,10 @@ if __name__ == "__main__":
     # Configure to your liking
     app = flask.create_app(
         data_dir=DATA_DIR,
-        # config={"DEBUG": True},
+        config={
+            # Restore pockets from snapshots saved when the app was killed
+            "POCKET_SNAPSHOTS": True,
+            # "DEBUG": True,
+        },
     )
     WSGIServer(app).run()
@@ -8,15 +8,39 @@ except ImportError:
     import importlib_metadata
 
 OFFLINE_FILEPATH = os.path.join(DATA_DIR, "offline.json")
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
 
 # URL endpoints
 POCKETS_TAIL = "/pockets"
+BATCH_TAIL = "/batch"
+IMPORT_TAIL = "/import"
+EXPORT_TAIL = "/export"
+SUMMARY_TAIL = "/summary"
 COPY_TAIL = "/copy"
+AGGREGATE_TAIL = "/aggregate"
+STATS_TAIL = "/stats"
+METRICS_TAIL = "/metrics"
 VERSION_TAIL = "/version"
 
+# Query parameters holding filters of the 'list' command are prefixed, e.g.
+# 'filter_name=beer'. An empty value of a nullable field means None
+FILTER_PREFIX = "filter_"
+NULLABLE_FILTER_FIELDS = ("category", "end")
+
+# Media type of streamed responses (one JSON document per line)
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Media type of imported and exported CSV files
+CSV_MIMETYPE = "text/csv"
+
 # HTTP communication defaults
 DEFAULT_HOST = "http://127.0.0.1:5000"
 DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.1
+# Maximum number of responses in the client cache
+DEFAULT_CACHE_SIZE = 100
 
 
 def version(package_name=__package__):
@@ -0,0 +1,589 @@
+"""Asyncio-native webservice as ASGI application.
+
+'create_app()' returns an ASGI application serving the pockets, pocket, entry,
+copy, and version resources of the flask webservice (see the 'flask' and
+'resources' modules) with identical URLs, request arguments, responses, and
+error codes. It doesn't require any packages beyond those of the flask
+webservice; serve it by an ASGI server, e.g.
+
+    FINANCEAGER_FLASK_DATA_DIR=<data_dir> \\
+        uvicorn --factory financeager_flask.asgi:create_app
+
+Requests are received, parsed, and answered on the event loop, hence slow
+clients don't occupy a thread. Server commands are run in a bounded pool of
+worker threads. If too many commands are waiting for a free worker, requests
+are rejected with 503 (Service Unavailable) and a 'Retry-After' header.
+"""
+import asyncio
+import collections
+import itertools
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from financeager import exceptions, init_logger, setup_log_file_handler
+from flask_restful import inputs
+from werkzeug.datastructures import CombinedMultiDict, Headers, MIMEAccept, MultiDict
+from werkzeug.exceptions import (
+    BadRequest,
+    HTTPException,
+    MethodNotAllowed,
+    NotFound,
+    RequestEntityTooLarge,
+)
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from . import (
+    COPY_TAIL,
+    NDJSON_MIMETYPE,
+    POCKETS_TAIL,
+    VERSION_TAIL,
+    compression,
+    jsonlib,
+    validation,
+    version,
+)
+from .flask import DEFAULT_SERVER_CONFIG, create_server, prepare_data_dir
+from .resources import (
+    _error_code,
+    _parse_filters,
+    copy_parser,
+    put_parser,
+    run_command,
+    update_parser,
+)
+
+logger = init_logger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_QUEUE_DEPTH = 32
+DEFAULT_RETRY_AFTER = 1
+
+# Defaults of the app configuration
+DEFAULT_CONFIG = dict(
+    DEFAULT_SERVER_CONFIG,
+    COMPRESS_MIN_SIZE=compression.DEFAULT_COMPRESS_MIN_SIZE,
+    COMPRESS_LEVEL=compression.DEFAULT_COMPRESS_LEVEL,
+    MAX_CONTENT_LENGTH=None,
+    MAX_DECOMPRESSED_SIZE=compression.DEFAULT_MAX_DECOMPRESSED_SIZE,
+    MAX_WORKERS=DEFAULT_MAX_WORKERS,
+    MAX_QUEUE_DEPTH=DEFAULT_MAX_QUEUE_DEPTH,
+    RETRY_AFTER=DEFAULT_RETRY_AFTER,
+)
+
+# Number of entries per chunk of a streamed response
+STREAM_CHUNK_SIZE = 100
+
+list_parser = validation.RequestSchema()
+list_parser.add_argument("limit", type=lambda v: inputs.positive(v, "limit"))
+list_parser.add_argument("cursor")
+list_parser.add_argument("recurrent_only", type=inputs.boolean)
+
+# Request whose arguments are only looked up in the query string
+_QueryRequest = collections.namedtuple("_QueryRequest", ["json", "values"])
+
+
+class Saturated(Exception):
+    """Raised if the queue of the executor is full."""
+
+
+class BoundedExecutor:
+    """Pool of worker threads to run functions from asyncio code. At most
+    'max_queue_depth' functions wait for a free worker; running further
+    functions is rejected.
+    """
+
+    def __init__(
+        self, max_workers=DEFAULT_MAX_WORKERS, max_queue_depth=DEFAULT_MAX_QUEUE_DEPTH
+    ):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="financeager-flask"
+        )
+        # Number of functions that are running or waiting for a worker
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        """Number of functions waiting for a free worker."""
+        with self._lock:
+            return max(0, self._pending - self.max_workers)
+
+    async def run(self, function, *args, bounded=True):
+        """Run the function with the given args in a worker thread, and return
+        its result. If 'bounded' is false, the function is queued regardless of
+        the queue depth (e.g. to continue work that was accepted before).
+
+        :raise: Saturated if the queue is full
+        """
+        with self._lock:
+            if bounded and self._pending >= self.max_workers + self.max_queue_depth:
+                raise Saturated()
+            self._pending += 1
+
+        future = self._executor.submit(function, *args)
+        # A function keeps its worker even if the awaiting task is cancelled
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, _):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        """Wait for pending functions, and stop the workers."""
+        self._executor.shutdown(wait=True)
+
+
+class _Disconnected(Exception):
+    """Raised if the client disconnected before sending the request body."""
+
+
+class _Request:
+    """HTTP request providing the attributes used by 'validation.RequestSchema'.
+    The JSON body and form data are parsed on first access, like flask does.
+    """
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = Headers(
+            [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+        )
+        self.args = MultiDict(
+            parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+        )
+        self.body = body
+
+    @property
+    def mimetype(self):
+        return self.headers.get("Content-Type", "").partition(";")[0].strip().lower()
+
+    @property
+    def json(self):
+        return self.get_json()
+
+    def get_json(self, silent=False):
+        """Return the parsed body if the request has a JSON content type, and
+        None otherwise.
+
+        :raise: BadRequest if the body is invalid JSON, unless 'silent'
+        """
+        mimetype = self.mimetype
+        if not (mimetype == "application/json" or mimetype.endswith("+json")):
+            return None
+
+        try:
+            return jsonlib.loads(self.body)
+        except ValueError:
+            if silent:
+                return None
+            raise BadRequest()
+
+    @property
+    def values(self):
+        form = MultiDict()
+        if self.mimetype == "application/x-www-form-urlencoded":
+            form = MultiDict(
+                parse_qsl(self.body.decode("latin-1"), keep_blank_values=True)
+            )
+        return CombinedMultiDict([self.args, form])
+
+
+class _Response:
+    """HTTP response with a body given as bytes, or as asynchronous iterator of
+    chunks (streamed response)."""
+
+    def __init__(self, status, body=b"", headers=None, chunks=None):
+        self.status = status
+        self.body = body
+        self.headers = Headers(headers)
+        self.chunks = chunks
+
+    async def send(self, send, head=False):
+        """Send the response via the ASGI 'send' function. For HEAD requests,
+        the body is omitted."""
+        if self.chunks is None:
+            self.headers["Content-Length"] = str(len(self.body))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status,
+                "headers": [
+                    (k.lower().encode("latin-1"), v.encode("latin-1"))
+                    for k, v in self.headers.items()
+                ],
+            }
+        )
+
+        if self.chunks is not None and not head:
+            async for chunk in self.chunks:
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b"" if head or self.chunks is not None else self.body,
+            }
+        )
+
+
+def _json_response(data, status=200, headers=None):
+    response = _Response(status, jsonlib.dumps(data) + b"\n", headers)
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+def _not_modified(etag):
+    return _Response(304, headers={"ETag": quote_etag(etag)})
+
+
+def _encode_entries(entries, count):
+    """Encode the next 'count' entries of the iterator as lines of JSON objects
+    (see 'resources.PocketResource.stream()').
+
+    :return: bytes (empty if the iterator is exhausted)
+    """
+    return b"".join(
+        jsonlib.dumps({"table": table_name, "eid": eid, "element": element}) + b"\n"
+        for table_name, eid, element in itertools.islice(entries, count)
+    )
+
+
+class App:
+    """ASGI application serving the resources of the webservice. The server
+    is stopped at the end of the application's lifespan.
+    """
+
+    def __init__(self, server, executor, config):
+        self.server = server
+        self.executor = executor
+        self.config = config
+
+        self._routes = [
+            (POCKETS_TAIL, {"POST": self.run_pockets}),
+            (
+                "{}/<pocket_name>".format(POCKETS_TAIL),
+                {"GET": self.list_entries, "POST": self.add_entry},
+            ),
+            (
+                "{}/<pocket_name>/<table_name>/<eid>".format(POCKETS_TAIL),
+                {
+                    "GET": self.get_entry,
+                    "DELETE": self.remove_entry,
+                    "PATCH": self.update_entry,
+                },
+            ),
+            (COPY_TAIL, {"POST": self.copy_entry}),
+            (VERSION_TAIL, {"GET": self.get_version}),
+        ]
+        # Compile rules into regular expressions, like flask's default converter
+        self._routes = [
+            (re.compile("^{}$".format(re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", r))), m)
+            for r, m in self._routes
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            try:
+                response = await self._respond(scope, receive)
+            except _Disconnected:
+                return
+            await response.send(send, head=scope["method"] == "HEAD")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close(self):
+        """Wait for running commands, and stop the server."""
+        self.executor.shutdown()
+        self.server.run("stop")
+
+    def _match(self, path, method):
+        """Return the handler of the request and the URL parameters.
+
+        :raise: NotFound or MethodNotAllowed
+        """
+        for pattern, handlers in self._routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+
+            allowed = set(handlers) | {"OPTIONS"}
+            if "GET" in handlers:
+                allowed.add("HEAD")
+                if method == "HEAD":
+                    method = "GET"
+            if method == "OPTIONS":
+                return self._options(sorted(allowed)), {}
+            if method not in handlers:
+                raise MethodNotAllowed(valid_methods=sorted(allowed))
+            return handlers[method], match.groupdict()
+
+        raise NotFound()
+
+    @staticmethod
+    def _options(allowed):
+        async def options(request):
+            return _Response(200, headers={"Allow": ", ".join(allowed)})
+
+        return options
+
+    async def _respond(self, scope, receive):
+        try:
+            handler, kwargs = self._match(scope["path"], scope["method"])
+        except NotFound as e:
+            # Same response as flask's for unknown URLs
+            return _Response(e.code, e.get_body().encode(), e.get_headers())
+        except HTTPException as e:
+            return self._error_response(e)
+
+        try:
+            request = _Request(scope, await self._receive_body(scope, receive))
+            logger.debug(
+                "Dispatching {r.method} {r.path} holding {{args: {r.args}, "
+                "body: {r.body}}}".format(r=request)
+            )
+            response = await handler(request, **kwargs)
+        except Saturated:
+            retry_after = self.config["RETRY_AFTER"]
+            logger.warning(
+                "Rejected {} {} since {} commands are queued".format(
+                    scope["method"], scope["path"], self.executor.queue_depth
+                )
+            )
+            return _json_response(
+                {"error": "Service unavailable, too many pending requests."},
+                503,
+                {"Retry-After": str(retry_after)},
+            )
+        except HTTPException as e:
+            return self._error_response(e)
+        except Exception:
+            logger.exception("Unexpected error")
+            return _json_response({"error": "unexpected error"}, 500)
+
+        return self._compress(scope, response)
+
+    @staticmethod
+    def _error_response(error):
+        """Create the response for the HTTP exception like flask_restful does."""
+        data = getattr(error, "data", None) or {"message": error.description}
+        headers = [(k, v) for k, v in error.get_headers() if k != "Content-Type"]
+        return _json_response(data, error.code, headers)
+
+    async def _receive_body(self, scope, receive):
+        """Receive the request body, and decompress it if needed.
+
+        :raise: RequestEntityTooLarge if the body exceeds MAX_CONTENT_LENGTH (or
+            MAX_DECOMPRESSED_SIZE after decompression), _Disconnected if the
+            client disconnected
+        """
+        max_size = self.config["MAX_CONTENT_LENGTH"]
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise _Disconnected()
+
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise RequestEntityTooLarge()
+            chunks.append(chunk)
+
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+
+        for name, value in scope["headers"]:
+            if name.lower() == b"content-encoding":
+                if value.decode("latin-1").strip().lower() in compression.ENCODINGS:
+                    body = compression.decompress(
+                        body, max_size=compression.max_decompressed_size(self.config)
+                    )
+        return body
+
+    def _compress(self, scope, response):
+        """Compress the response body like 'compression.compress_response()'."""
+        level = self.config["COMPRESS_LEVEL"]
+        if (
+            not level
+            or response.chunks is not None
+            or response.status in (204, 304)
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        response.headers.add("Vary", "Accept-Encoding")
+
+        headers = Headers(
+            [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+        )
+        encoding = parse_accept_header(headers.get("Accept-Encoding")).best_match(
+            compression.ENCODINGS
+        )
+        if encoding is None or len(response.body) < self.config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        response.body = compression.compress(response.body, encoding, level=level)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    async def run_safely(self, command, **kwargs):
+        """Run the command on the server in a worker thread, see
+        'resources.LogResource.run_safely()'."""
+        response, code = await self.executor.run(
+            lambda: run_command(self.server, command, **kwargs)
+        )
+        return _json_response(response, code)
+
+    async def run_conditionally(self, request, command, pocket, **kwargs):
+        """Run the non-modifying command, see
+        'resources.LogResource.run_conditionally()'."""
+        if_none_match = parse_etags(request.headers.get("If-None-Match"))
+
+        def run():
+            etag = self.server.pocket_revision(pocket)
+            if if_none_match.contains(etag):
+                return etag, None
+            return etag, run_command(self.server, command, pocket=pocket, **kwargs)
+
+        etag, result = await self.executor.run(run)
+        if result is None:
+            return _not_modified(etag)
+
+        response, code = result
+        headers = {"ETag": quote_etag(etag)} if code == 200 else None
+        return _json_response(response, code, headers)
+
+    async def run_pockets(self, request):
+        return await self.run_safely("pockets")
+
+    async def list_entries(self, request, pocket_name):
+        # Older clients send the JSON-encoded arguments as request body
+        body = request.get_json(silent=True)
+        args = jsonlib.loads(body) if isinstance(body, str) else {}
+
+        list_args = list_parser.parse_args(_QueryRequest(None, request.args))
+        args.update({k: v for k, v in list_args.items() if v is not None})
+        filters = _parse_filters(request.args)
+        if filters:
+            args["filters"] = filters
+
+        accept = parse_accept_header(request.headers.get("Accept"), MIMEAccept)
+        if accept.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            return await self.stream_entries(request, pocket_name, **args)
+
+        return await self.run_conditionally(request, "list", pocket_name, **args)
+
+    async def stream_entries(self, request, pocket_name, **kwargs):
+        """Stream the entries of the pocket, see
+        'resources.PocketResource.stream()'. Entries are encoded in chunks by
+        the worker threads; the stream is sent as fast as the client receives
+        it."""
+        if_none_match = parse_etags(request.headers.get("If-None-Match"))
+
+        def start():
+            etag = self.server.pocket_revision(pocket_name)
+            if if_none_match.contains(etag):
+                return etag, None
+            return etag, self.server.iter_entries(pocket=pocket_name, **kwargs)
+
+        try:
+            etag, entries = await self.executor.run(start)
+        except exceptions.PocketException as e:
+            return _json_response({"error": str(e)}, _error_code(e))
+        if entries is None:
+            return _not_modified(etag)
+
+        async def chunks():
+            while True:
+                try:
+                    chunk = await self.executor.run(
+                        _encode_entries, entries, STREAM_CHUNK_SIZE, bounded=False
+                    )
+                except Exception:
+                    logger.exception("Unexpected error")
+                    yield jsonlib.dumps({"error": "unexpected error"}) + b"\n"
+                    return
+
+                if not chunk:
+                    return
+                yield chunk
+
+        return _Response(
+            200,
+            headers={"Content-Type": NDJSON_MIMETYPE, "ETag": quote_etag(etag)},
+            chunks=chunks(),
+        )
+
+    async def add_entry(self, request, pocket_name):
+        args = put_parser.parse_args(request)
+        return await self.run_safely("add", pocket=pocket_name, **args)
+
+    async def get_entry(self, request, pocket_name, table_name, eid):
+        return await self.run_conditionally(
+            request, "get", pocket_name, table_name=table_name, eid=eid
+        )
+
+    async def remove_entry(self, request, pocket_name, table_name, eid):
+        return await self.run_safely(
+            "remove", pocket=pocket_name, table_name=table_name, eid=eid
+        )
+
+    async def update_entry(self, request, pocket_name, table_name, eid):
+        args = update_parser.parse_args(request)
+        return await self.run_safely(
+            "update", pocket=pocket_name, table_name=table_name, eid=eid, **args
+        )
+
+    async def copy_entry(self, request):
+        args = copy_parser.parse_args(request)
+        return await self.run_safely("copy", **args)
+
+    async def get_version(self, request):
+        return _json_response(
+            {"version": version(), "financeager_version": version("financeager")}
+        )
+
+
+def create_app(data_dir=None, config=None):
+    """Create the ASGI application. The data directory and the configuration
+    variables of the server are treated like by 'flask.create_app()'; of the
+    flask-specific variables, 'COMPRESS_MIN_SIZE', 'COMPRESS_LEVEL',
+    'MAX_CONTENT_LENGTH', and 'MAX_DECOMPRESSED_SIZE' are supported.
+    Additionally, 'MAX_WORKERS' (number of threads running server commands),
+    'MAX_QUEUE_DEPTH' (number of commands waiting for a free thread before
+    requests are rejected), and 'RETRY_AFTER' (seconds until rejected clients
+    should retry) are taken into account.
+
+    :return: App
+    """
+    setup_log_file_handler()
+
+    app_config = dict(DEFAULT_CONFIG)
+    app_config.update(config or {})
+
+    data_dir = prepare_data_dir(data_dir)
+    srv = create_server(data_dir, app_config)
+    executor = BoundedExecutor(
+        max_workers=app_config["MAX_WORKERS"],
+        max_queue_depth=app_config["MAX_QUEUE_DEPTH"],
+    )
+    logger.debug("Created ASGI app")
+    return App(srv, executor, app_config)
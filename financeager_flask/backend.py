@@ -0,0 +1,1077 @@
+"""Extension of the financeager server for the webservice."""
+import contextlib
+import glob
+import os.path
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from financeager import (
+    DEFAULT_POCKET_NAME,
+    DEFAULT_TABLE,
+    RECURRENT_TABLE,
+    UNSET_INDICATOR,
+    exceptions,
+    init_logger,
+    server,
+)
+from financeager.pocket import TinyDbPocket
+
+from . import cache, locking
+from . import metrics as metrics_module
+from . import recurrent, snapshot, sqlite, summary
+
+logger = init_logger(__name__)
+
+# Commands that a batch of operations may consist of
+BATCH_COMMANDS = ("add", "update", "remove")
+
+# Commands that modify the content of a pocket
+MODIFYING_COMMANDS = BATCH_COMMANDS + ("batch", "import")
+
+# Commands that read the content of a pocket
+READING_COMMANDS = ("list", "get", "summary")
+
+# Order of tables when iterating entries of a pocket
+TABLES = (DEFAULT_TABLE, RECURRENT_TABLE)
+
+# Maximum number of pockets that are evaluated in parallel by 'aggregate'
+AGGREGATE_MAX_WORKERS = 4
+
+# Engines to store pockets
+JSON_ENGINE = "json"
+SQLITE_ENGINE = "sqlite"
+STORAGE_ENGINES = (JSON_ENGINE, SQLITE_ENGINE)
+
+
+@contextlib.contextmanager
+def deferred_writes(pocket):
+    """Context manager to collect all writes to the storage of the given pocket,
+    and persist the final state once when leaving the context.
+    The storage content is read once when entering the context. Subsequent reads
+    and writes operate on the in-memory state.
+    For an SQLite pocket, all writes are run in a single transaction instead.
+    """
+    if isinstance(pocket, sqlite.SqlitePocket):
+        with pocket.transaction():
+            yield
+        return
+
+    storage = pocket._db.storage
+    data = storage.read()
+    dirty = False
+
+    def read():
+        return data
+
+    def write(new_data):
+        nonlocal data, dirty
+        data = new_data
+        dirty = True
+
+    # Shadow the storage methods by instance attributes
+    storage.read = read
+    storage.write = write
+    try:
+        yield
+    finally:
+        del storage.read
+        del storage.write
+        if dirty:
+            storage.write(data)
+
+
+def _pocket_name(name):
+    """Return the name of the pocket as used by 'TinyDbPocket'."""
+    return str(name or DEFAULT_POCKET_NAME)
+
+
+def _documents(pd, table_name, filters=None):
+    """Return the documents of the pocket's table in order of ascending IDs.
+    An SQLite pocket only returns documents that match the filters.
+
+    :return: list of tinydb.table.Document
+    """
+    if isinstance(pd, sqlite.SqlitePocket):
+        return pd.documents(table_name, filters)
+
+    # TinyDB keeps documents in order of ascending IDs
+    return list(pd._db.table(table_name))
+
+
+def _query_condition(filters):
+    """Create the query condition for the given filters of the 'list' command.
+
+    :return: tinydb.queries.QueryInstance
+    :raise: PocketValidationFailure if filters are invalid
+    """
+    try:
+        return TinyDbPocket._create_query_condition(**(filters or {}))
+    except (AttributeError, TypeError, ValueError) as e:
+        raise exceptions.PocketValidationFailure(f"Invalid filters: {e}")
+
+
+def _parse_cursor(cursor):
+    """Parse the cursor of a page of entries into table name and entry ID.
+
+    :return: tuple, or None if no cursor given
+    :raise: PocketValidationFailure if cursor is invalid
+    """
+    if cursor is None:
+        return None
+
+    try:
+        table_name, eid = cursor.split(":")
+        eid = int(eid)
+    except ValueError:
+        table_name = None
+
+    if table_name not in TABLES:
+        raise exceptions.PocketValidationFailure(f"Invalid cursor: {cursor}")
+
+    return table_name, eid
+
+
+def _validate_limit(limit):
+    if limit is not None and limit < 1:
+        raise exceptions.PocketValidationFailure("Limit must be positive.")
+
+
+def _limit_entries(entries, limit):
+    """Pass through the elements of the first 'limit' entries of the given
+    iterable of (table name, entry ID, element) tuples."""
+    count = 0
+    last = None
+    for table_name, eid, element in entries:
+        if (table_name, eid) != last:
+            if count == limit:
+                return
+            count += 1
+            last = (table_name, eid)
+
+        yield table_name, eid, element
+
+
+def _add_entry_safely(add_entry, entry):
+    """Call the function adding an entry with the given kwargs.
+
+    :return: dict with key 'id' or 'error'
+    """
+    try:
+        return {"id": add_entry(**entry)}
+    except exceptions.PocketException as e:
+        return {"error": e}
+    except (TypeError, ValueError) as e:
+        # Missing or malformed fields
+        return {"error": exceptions.PocketValidationFailure(f"Invalid entry: {e}")}
+
+
+class ServerPocketMixin:
+    """Mixin for the pocket classes of the server. The category cache is built on
+    first use instead of when opening the pocket. All caches of the pocket can
+    be built upfront, and dumped to and restored from a snapshot (see the
+    'snapshot' module).
+    """
+
+    def _create_category_cache(self):
+        # Deferred until first access of '_category_cache'
+        self._lazy_category_cache = None
+
+    @property
+    def _category_cache(self):
+        if self._lazy_category_cache is None:
+            super()._create_category_cache()
+        return self._lazy_category_cache
+
+    @_category_cache.setter
+    def _category_cache(self, category_cache):
+        self._lazy_category_cache = category_cache
+
+    def warm_up(self):
+        """Build the category cache and the summary, and generate the elements of
+        all recurrent entries."""
+        self._category_cache
+        self.summary()
+        self.get_entries()
+
+    def add_entries(self, entries):
+        """Add the given entries in order (dicts holding the kwargs of
+        'add_entry()'). Invalid entries are skipped. Unlike for 'add_entry()', a
+        'category' given as None is kept instead of being derived from previous
+        entries of the same name.
+
+        :return: list of dicts with key 'id' or 'error', one for every entry
+        """
+        return [_add_entry_safely(self._add_entry_keeping_category, e) for e in entries]
+
+    def _add_entry_keeping_category(self, table_name=None, **kwargs):
+        eid = self.add_entry(table_name=table_name, **kwargs)
+        if "category" in kwargs and kwargs["category"] is None:
+            self.update_entry(eid, table_name=table_name, category=UNSET_INDICATOR)
+        return eid
+
+    def dump_state(self):
+        """Return the caches of the pocket. The generated recurrent elements are
+        only included if they are up to date.
+
+        :return: dict
+        """
+        with self._recurrent_cache_lock:
+            recurrent_cache = None
+            if self._recurrent_cache_key is not None:
+                revision, day = self._recurrent_cache_key
+                if revision == self._recurrent_revision:
+                    recurrent_cache = (day, dict(self._recurrent_cache))
+
+        with self._summary_lock:
+            return {
+                "category_cache": self._lazy_category_cache,
+                "summary": self._summary,
+                "recurrent_cache": recurrent_cache,
+            }
+
+    def load_state(self, state):
+        """Restore the caches of the pocket as returned by 'dump_state()'. Cached
+        recurrent elements of another day are discarded."""
+        self._lazy_category_cache = state["category_cache"]
+        with self._summary_lock:
+            self._summary = state["summary"]
+
+        if state["recurrent_cache"] is not None:
+            day, recurrent_cache = state["recurrent_cache"]
+            if day == date.today():
+                with self._recurrent_cache_lock:
+                    self._recurrent_cache = recurrent_cache
+                    self._recurrent_cache_key = (self._recurrent_revision, day)
+
+
+class ServerTinyDbPocket(
+    ServerPocketMixin,
+    recurrent.RecurrentCacheMixin,
+    summary.SummaryMixin,
+    TinyDbPocket,
+):
+    """TinyDbPocket maintaining a summary of its entries, and caching the
+    elements generated from recurrent entries."""
+
+    def add_entries(self, entries):
+        """Add the given entries like 'add_entries()' of the base class, but
+        insert them into each table at once. TinyDB rewrites the whole table
+        on every insert, hence adding entries one by one takes quadratic time.
+        """
+        documents = {DEFAULT_TABLE: [], RECURRENT_TABLE: []}
+
+        def preprocess(table_name=None, **kwargs):
+            table_name = table_name or DEFAULT_TABLE
+            keep_category = "category" in kwargs and kwargs["category"] is None
+            fields = self._preprocess_entry(raw_data=kwargs, table_name=table_name)
+            if keep_category:
+                fields["category"] = None
+            # Categories of later entries are derived from earlier ones
+            self._update_category_cache(**fields)
+            documents[table_name].append(fields)
+            return table_name, len(documents[table_name]) - 1
+
+        results = [_add_entry_safely(preprocess, e) for e in entries]
+
+        eids = {
+            table_name: self._db.table(table_name).insert_multiple(fields)
+            for table_name, fields in documents.items()
+            if fields
+        }
+
+        if self._summary is not None:
+            for table_name, fields in documents.items():
+                for element in fields:
+                    self._summary.add(table_name, element)
+        if documents[RECURRENT_TABLE]:
+            self._invalidate_recurrent_cache(RECURRENT_TABLE)
+
+        for result in results:
+            if "id" in result:
+                table_name, index = result["id"]
+                result["id"] = eids[table_name][index]
+        return results
+
+
+class ServerSqlitePocket(
+    ServerPocketMixin,
+    recurrent.RecurrentCacheMixin,
+    summary.SummaryMixin,
+    sqlite.SqlitePocket,
+):
+    """SqlitePocket maintaining a summary of its entries, and caching the
+    elements generated from recurrent entries."""
+
+    def _summarized_documents(self, table_name):
+        return self.documents(table_name)
+
+
+class Server(server.Server):
+    """Server additionally supporting to run a batch of operations on a pocket
+    (command 'batch'), to add many entries to a pocket at once (command
+    'import'), to list the entries of several pockets at once
+    (command 'aggregate'), to summarize the entries of a pocket (command
+    'summary', see the 'summary' module), and to report statistics of the
+    cache of generated recurrent elements (command 'stats', see the 'recurrent'
+    module).
+    The server keeps track of the revision of every pocket.
+    The server is thread-safe. Every pocket is guarded by a readers-writer lock:
+    commands reading a pocket run concurrently, whereas commands modifying a
+    pocket run exclusively.
+    In multi-process mode, several servers (in separate processes) can share a
+    data directory. Every pocket file is then additionally guarded by an advisory
+    file lock. A lock file next to the pocket file holds the pocket's revision;
+    if another process modified the pocket, it is reloaded.
+    Pockets are stored in JSON files (via TinyDB), or in SQLite databases (see the
+    'sqlite' module).
+    The content of pockets stored in JSON files is cached in memory (see the
+    'cache' module). If a memory budget is given, least recently used pockets
+    are evicted from the cache.
+    Pockets are loaded on first access, or all at once by 'preload()'. If a
+    snapshot directory is given, snapshots of the pockets in memory are saved
+    when stopping the server, and used when loading pockets again (see the
+    'snapshot' module).
+    """
+
+    def __init__(
+        self,
+        storage_engine=JSON_ENGINE,
+        multiprocess=False,
+        cache_mode=cache.WRITE_THROUGH,
+        flush_interval=cache.DEFAULT_FLUSH_INTERVAL,
+        flush_threshold=cache.DEFAULT_FLUSH_THRESHOLD,
+        memory_budget=None,
+        metrics=None,
+        snapshot_dir=None,
+        **kwargs,
+    ):
+        """Create server. Remaining kwargs are passed to 'server.Server'.
+
+        :param storage_engine: one of STORAGE_ENGINES
+        :param multiprocess: whether to coordinate with servers in other
+            processes using the same data directory
+        :param cache_mode: one of 'cache.CACHE_MODES'
+        :param flush_interval: interval in seconds to persist modified pockets
+            in write-behind mode
+        :param flush_threshold: number of modifications after which a pocket
+            is persisted in write-behind mode
+        :param memory_budget: approximate size (in bytes) of pocket content to
+            keep in memory
+        :param metrics: 'metrics.Metrics' instance to record command durations
+            and errors, and storage operations in (optional)
+        :param snapshot_dir: directory to store snapshots of pockets in
+            (optional)
+        :raise: ValueError if multi-process mode or snapshots are requested
+            without data_dir, or multi-process mode in combination with
+            write-behind mode; if storage engine or cache mode are invalid, or
+            write-behind mode is requested for SQLite
+        """
+        if storage_engine not in STORAGE_ENGINES:
+            raise ValueError(f"Invalid storage engine: {storage_engine}")
+        if multiprocess and kwargs.get("data_dir") is None:
+            raise ValueError("Multi-process mode requires a data directory.")
+        if snapshot_dir is not None and kwargs.get("data_dir") is None:
+            raise ValueError("Snapshots require a data directory.")
+        if cache_mode not in cache.CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {cache_mode}")
+        if multiprocess and cache_mode == cache.WRITE_BEHIND:
+            raise ValueError("Multi-process mode requires write-through caching.")
+        if storage_engine == SQLITE_ENGINE and cache_mode == cache.WRITE_BEHIND:
+            raise ValueError("Write-behind caching requires the JSON storage engine.")
+
+        super().__init__(**kwargs)
+        self._storage_engine = storage_engine
+        self._multiprocess = multiprocess
+        self._write_behind = cache_mode == cache.WRITE_BEHIND
+        self._flush_threshold = flush_threshold
+        self._memory_budget = memory_budget
+
+        # Caching storages of loaded pockets, least recently used first
+        self._storages = OrderedDict()
+
+        # Distinguishes revisions of pockets from those of other server instances
+        self._instance_id = uuid.uuid4().hex[:12]
+        self._revisions = {}
+        # Revisions of pocket files as last seen (multi-process mode only)
+        self._file_revisions = {}
+
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._pockets_lock = threading.Lock()
+
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.add(
+                metrics_module.CallbackCounter(
+                    metrics_module.PREFIX + "recurrent_cache_total",
+                    "Number of lookups in the cache of generated recurrent "
+                    "elements, by result.",
+                    ("result",),
+                    self._recurrent_cache_lookups,
+                )
+            )
+
+        self._flusher = None
+        if self._write_behind and kwargs.get("data_dir") is not None:
+            self._flusher = cache.Flusher(self.flush, flush_interval)
+            self._flusher.start()
+            cache.install_shutdown_hook(self.flush)
+
+        self._snapshot_dir = snapshot_dir
+        if snapshot_dir is not None:
+            cache.install_shutdown_hook(self.save_snapshots)
+
+    def run(self, command, **kwargs):
+        """Run the given command. See 'server.Server.run()' for details.
+        The responses of the 'batch' and 'import' commands contain the key
+        'results', the response of the 'aggregate' command contains the key
+        'pockets', the response of the 'summary' command contains the key
+        'summary', the response of the 'stats' command contains the key
+        'recurrent_cache'.
+        The locks of the pockets involved are held while running the command.
+        Before stopping, snapshots of the pockets are saved if enabled.
+
+        :return: dict
+        """
+        if command == "stop" and self._flusher is not None:
+            self._flusher.stop()
+            cache.remove_shutdown_hook(self.flush)
+        if command == "stop" and self._snapshot_dir is not None:
+            self.save_snapshots()
+            cache.remove_shutdown_hook(self.save_snapshots)
+
+        elapsed = metrics_module.timer()
+        with self._command_locked(command, kwargs):
+            response = self._run(command, **kwargs)
+
+        self._evict()
+
+        if self._metrics is not None:
+            self._metrics.command_duration.observe(
+                elapsed(), command, kwargs.get("pocket") or ""
+            )
+            if "error" in response:
+                self._metrics.command_errors.inc(command)
+        return response
+
+    def _run(self, command, **kwargs):
+        try:
+            if command == "batch":
+                logger.debug(f"Running '{command}' with {kwargs}")
+                try:
+                    response = {"results": self._run_batch(**kwargs)}
+                except exceptions.PocketException as e:
+                    response = {"error": e}
+            elif command == "import":
+                logger.debug(f"Running '{command}' on pocket {kwargs.get('pocket')}")
+                try:
+                    response = {"results": self._import(**kwargs)}
+                except exceptions.PocketException as e:
+                    response = {"error": e}
+            elif command == "aggregate":
+                logger.debug(f"Running '{command}' with {kwargs}")
+                try:
+                    response = {"pockets": self._aggregate(**kwargs)}
+                except exceptions.PocketException as e:
+                    response = {"error": e}
+            elif command == "summary":
+                logger.debug(f"Running '{command}' with {kwargs}")
+                response = {"summary": self._get_pocket(kwargs.get("pocket")).summary()}
+            elif command == "stats":
+                response = {"recurrent_cache": self._recurrent_cache_stats()}
+            elif command == "list" and (
+                kwargs.get("limit") is not None or kwargs.get("cursor") is not None
+            ):
+                logger.debug(f"Running '{command}' with {kwargs}")
+                try:
+                    response = self._list_page(**kwargs)
+                except exceptions.PocketException as e:
+                    response = {"error": e}
+            elif command == "list":
+                kwargs.pop("limit", None)
+                kwargs.pop("cursor", None)
+                try:
+                    _query_condition(kwargs.get("filters"))
+                except exceptions.PocketException as e:
+                    response = {"error": e}
+                else:
+                    response = super().run(command, **kwargs)
+            else:
+                response = super().run(command, **kwargs)
+
+        finally:
+            # Increment the revision after modifying the pocket such that it
+            # never tags outdated content
+            if command in MODIFYING_COMMANDS:
+                self._increment_revision(kwargs.get("pocket"))
+            elif command == "copy":
+                self._increment_revision(kwargs.get("destination_pocket"))
+
+        return response
+
+    def _pocket_lock(self, name=None):
+        """Return the readers-writer lock of the pocket, created on first
+        access."""
+        name = _pocket_name(name)
+        with self._locks_lock:
+            try:
+                return self._locks[name]
+            except KeyError:
+                lock = self._locks[name] = locking.RWLock()
+                return lock
+
+    @contextlib.contextmanager
+    def _command_locked(self, command, kwargs):
+        """Context manager holding the locks of the pockets that the command
+        with given kwargs accesses. Locks are acquired in order of pocket names to
+        avoid deadlocks.
+        """
+        if command in READING_COMMANDS:
+            exclusive = {_pocket_name(kwargs.get("pocket")): False}
+        elif command in MODIFYING_COMMANDS:
+            exclusive = {_pocket_name(kwargs.get("pocket")): True}
+        elif command == "copy":
+            exclusive = {
+                _pocket_name(kwargs.get("source_pocket")): False,
+                _pocket_name(kwargs.get("destination_pocket")): True,
+            }
+        elif command == "stop":
+            with self._pockets_lock:
+                exclusive = {name: True for name in self._pockets}
+        else:
+            # Commands accessing pockets individually (aggregate), or none
+            exclusive = {}
+
+        with contextlib.ExitStack() as stack:
+            for name in sorted(exclusive):
+                stack.enter_context(self._pocket_locked(name, exclusive[name]))
+            yield
+
+    @contextlib.contextmanager
+    def _pocket_locked(self, name=None, exclusive=False):
+        """Context manager holding the lock of the pocket, exclusively or shared.
+        In multi-process mode, the file lock is held as well. The pocket is
+        reloaded if it was modified by another process; if it is modified while
+        holding the lock, its file revision is updated.
+        Since other threads might use the pocket while the lock is shared, the
+        pocket is only reloaded while holding the lock exclusively.
+        """
+        name = _pocket_name(name)
+        lock = self._pocket_lock(name)
+        if not self._multiprocess:
+            with lock.write_locked() if exclusive else lock.read_locked():
+                yield
+            return
+
+        lock_filepath = self._lock_filepath(name)
+        if not exclusive:
+            with lock.read_locked(), locking.file_locked(lock_filepath) as file:
+                if self._file_revisions.get(name, "") == file.read():
+                    yield
+                    return
+            # The pocket was modified by another process; it's reloaded below
+
+        with lock.write_locked(), locking.file_locked(lock_filepath, exclusive) as file:
+            self._sync_pocket(name, file.read())
+            revision = self._revisions.get(name)
+            try:
+                yield
+            finally:
+                if exclusive and self._revisions.get(name) != revision:
+                    file_revision = uuid.uuid4().hex
+                    file.seek(0)
+                    file.truncate()
+                    file.write(file_revision)
+                    file.flush()
+                    self._file_revisions[name] = file_revision
+
+    def _sync_pocket(self, name, file_revision):
+        """Drop the pocket if its file revision differs from the one last seen,
+        such that it's reloaded from the file on next access. The caller must
+        hold the pocket lock exclusively."""
+        if self._file_revisions.get(name, "") == file_revision:
+            return
+
+        logger.debug(f"Reloading pocket '{name}' modified by other process")
+        self._drop_pocket(name)
+        self._file_revisions[name] = file_revision
+
+    def _drop_pocket(self, name):
+        """Persist and close the pocket, and remove it from memory. The caller
+        must hold the pocket lock exclusively, or such that no other thread uses
+        the pocket."""
+        with self._pockets_lock:
+            pd = self._pockets.pop(name, None)
+            self._storages.pop(name, None)
+
+        if pd is not None:
+            pd.close()
+
+    def flush(self):
+        """Persist the modifications of all pockets cached in memory."""
+        with self._pockets_lock:
+            names = list(self._storages)
+
+        for name in names:
+            with self._pocket_locked(name):
+                storage = self._storages.get(name)
+                if storage is not None:
+                    storage.flush()
+
+    def _evict(self):
+        """Drop least recently used pockets (except the most recent one) from
+        memory until the cached content fits into the memory budget. Pockets
+        that are currently in use are skipped.
+        """
+        if self._memory_budget is None:
+            return
+
+        with self._pockets_lock:
+            candidates = list(self._storages)[:-1]
+
+        for name in candidates:
+            with self._pockets_lock:
+                size = sum(s.size for s in self._storages.values())
+            if size <= self._memory_budget:
+                break
+
+            lock = self._pocket_lock(name)
+            if not lock.acquire_write(blocking=False):
+                continue
+            try:
+                logger.debug(f"Evicting pocket '{name}' from memory")
+                self._drop_pocket(name)
+            finally:
+                lock.release_write()
+
+    def preload(self):
+        """Load all pockets into memory, and build their caches, e.g. before a
+        prefork server forks its worker processes such that they share the
+        loaded content copy-on-write. Connections of SQLite pockets are closed
+        afterwards since they must not be shared with forked processes; they
+        are reopened on next access.
+        """
+        for name in self._pocket_names():
+            with self._pocket_locked(name):
+                pd = self._get_pocket(name)
+                pd.warm_up()
+                if isinstance(pd, sqlite.SqlitePocket):
+                    pd.close()
+
+    def save_snapshots(self, snapshot_dir=None):
+        """Save snapshots of all pockets in memory into the given directory
+        (default: the snapshot directory of the server), which is created if not
+        present. Modifications are persisted beforehand.
+        """
+        snapshot_dir = snapshot_dir or self._snapshot_dir
+        os.makedirs(snapshot_dir, exist_ok=True)
+        with self._pockets_lock:
+            names = list(self._pockets)
+
+        for name in names:
+            with self._pocket_locked(name, exclusive=True):
+                pd = self._pockets.get(name)
+                if pd is None:
+                    # Dropped in the meantime
+                    continue
+
+                state = pd.dump_state()
+                storage = self._storages.get(name)
+                if storage is not None:
+                    storage.flush()
+                    state["data"] = storage.read()
+                elif isinstance(pd, sqlite.SqlitePocket):
+                    # Transfer all changes into the database file
+                    pd.checkpoint()
+
+                snapshot.save(snapshot_dir, name, self._pocket_filepaths(name), state)
+
+    def _pocket_filepaths(self, name):
+        """Return the paths of the files that the pocket is stored in."""
+        data_dir = self._pocket_kwargs["data_dir"]
+        if self._storage_engine == SQLITE_ENGINE:
+            filepath = os.path.join(data_dir, f"{name}{sqlite.FILE_EXTENSION}")
+            return [filepath, f"{filepath}-wal"]
+        return [os.path.join(data_dir, f"{name}.json")]
+
+    def _lock_filepath(self, name):
+        return os.path.join(self._pocket_kwargs["data_dir"], f"{name}.json.lock")
+
+    def _get_pocket(self, name=None):
+        """Get the pocket identified by 'name', see 'server.Server._get_pocket()'.
+        A newly loaded pocket is prepared for concurrent access.
+        """
+        name = _pocket_name(name)
+        with self._pockets_lock:
+            try:
+                pd = self._pockets[name]
+            except KeyError:
+                pd = self._pockets[name] = self._load_pocket(name)
+            else:
+                if name in self._storages:
+                    self._storages.move_to_end(name)
+            return pd
+
+    def _load_pocket(self, name):
+        """Create the pocket according to the storage engine. The storage of a
+        JSON pocket is cached and synchronized. If a valid snapshot exists, the
+        pocket content and caches are restored from it.
+        """
+        logger.debug(f"Loading pocket '{name}'")
+        state = None
+        if self._snapshot_dir is not None:
+            state = snapshot.load(
+                self._snapshot_dir, name, self._pocket_filepaths(name)
+            )
+
+        if self._storage_engine == SQLITE_ENGINE:
+            pd = ServerSqlitePocket(name, **self._pocket_kwargs)
+            if state is not None:
+                pd.load_state(state)
+            return pd
+
+        pd = ServerTinyDbPocket(name, **self._pocket_kwargs)
+        if self._metrics is not None:
+            pd._db._storage = metrics_module.InstrumentedStorage(
+                pd._db.storage, self._metrics.storage_duration
+            )
+        if self._pocket_kwargs.get("data_dir") is not None:
+            self._storages[name] = pd._db._storage = cache.CachingStorage(
+                pd._db.storage,
+                write_behind=self._write_behind,
+                flush_threshold=self._flush_threshold,
+                data=None if state is None else state.pop("data"),
+            )
+        locking.synchronize(pd._db, TABLES)
+        if state is not None:
+            pd.load_state(state)
+        return pd
+
+    def _pocket_names(self):
+        """Return names of loaded pockets, and of pockets stored in the data
+        directory (if any) according to the storage engine.
+
+        :return: list(str)
+        """
+        with self._pockets_lock:
+            names = set(self._pockets)
+
+        data_dir = self._pocket_kwargs.get("data_dir")
+        if data_dir is not None:
+            extension = (
+                sqlite.FILE_EXTENSION
+                if self._storage_engine == SQLITE_ENGINE
+                else ".json"
+            )
+            names.update(
+                os.path.splitext(os.path.basename(f))[0]
+                for f in glob.glob(os.path.join(data_dir, f"*{extension}"))
+            )
+        return sorted(names)
+
+    def _recurrent_cache_stats(self):
+        """Return the statistics of the recurrent-element caches, summed over all
+        pockets in memory (see 'RecurrentCacheMixin.recurrent_cache_stats()').
+
+        :return: dict
+        """
+        with self._pockets_lock:
+            pockets = list(self._pockets.values())
+
+        stats = {"hits": 0, "misses": 0, "size": 0}
+        for pd in pockets:
+            for key, value in pd.recurrent_cache_stats().items():
+                stats[key] += value
+        return stats
+
+    def _recurrent_cache_lookups(self):
+        stats = self._recurrent_cache_stats()
+        return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+    def _increment_revision(self, name):
+        name = _pocket_name(name)
+        self._revisions[name] = self._revisions.get(name, 0) + 1
+
+    def pocket_revision(self, name=None):
+        """Return an identifier for the current state of the pocket. It changes
+        whenever the pocket is modified, and on every new day (recurrent entries
+        are listed up to the current date).
+        In multi-process mode, the identifier is the same for all processes.
+
+        :return: str
+        """
+        name = _pocket_name(name)
+        if self._multiprocess:
+            with locking.file_locked(self._lock_filepath(name)) as file:
+                revision = file.read() or "0"
+        else:
+            revision = "{}-{}".format(self._instance_id, self._revisions.get(name, 0))
+
+        return "{}-{}".format(revision, date.today().isoformat())
+
+    def iter_entries(
+        self, pocket=None, filters=None, recurrent_only=False, cursor=None, limit=None
+    ):
+        """Iterate the entries of the pocket that match the filters, ordered by
+        table (see TABLES) and ID. Recurrent entries are generated.
+        If `recurrent_only` is true, iterate the entries of the recurrent table
+        instead (the 'eid' field is included).
+        If a cursor (as returned by 'list' with limit) is given, iteration starts
+        after the entry that it refers to. At most 'limit' entries are iterated (a
+        recurrent entry counts as one, regardless of the number of generated
+        elements).
+        Filters, cursor, and limit are validated immediately. The entries are
+        generated lazily from a snapshot of the pocket content such that the
+        pocket is not locked during iteration.
+
+        :return: generator of tuples (table name, entry ID, element)
+        :raise: PocketValidationFailure if filters, cursor, or limit are invalid
+        """
+        with self._pocket_locked(pocket):
+            return self._iter_entries(
+                pocket=pocket,
+                filters=filters,
+                recurrent_only=recurrent_only,
+                cursor=cursor,
+                limit=limit,
+            )
+
+    def export_entries(self, pocket=None):
+        """Iterate the entries of the pocket as stored, ordered by table (see
+        TABLES) and ID. Unlike 'iter_entries()', elements of recurrent entries
+        are not generated. The entries are taken from a snapshot of the pocket
+        content such that the pocket is not locked during iteration.
+
+        :return: generator of tuples (table name, entry ID, element)
+        """
+        with self._pocket_locked(pocket):
+            pd = self._get_pocket(pocket)
+            snapshot = {name: _documents(pd, name) for name in TABLES}
+
+        return (
+            (table_name, element.doc_id, element)
+            for table_name, documents in snapshot.items()
+            for element in documents
+        )
+
+    def _iter_entries(
+        self, pocket=None, filters=None, recurrent_only=False, cursor=None, limit=None
+    ):
+        start = _parse_cursor(cursor)
+        _validate_limit(limit)
+
+        condition = _query_condition(filters)
+        pd = self._get_pocket(pocket)
+
+        tables = (RECURRENT_TABLE,) if recurrent_only else TABLES
+        # Filters don't apply to recurrent entries before generating elements
+        snapshot = {
+            name: _documents(
+                pd, name, filters if recurrent_only or name == DEFAULT_TABLE else None
+            )
+            for name in tables
+        }
+
+        entries = self._generate_entries(pd, condition, recurrent_only, start, snapshot)
+        if limit is not None:
+            entries = _limit_entries(entries, limit)
+        return entries
+
+    @staticmethod
+    def _generate_entries(pd, condition, recurrent_only, start, snapshot):
+        for table_name, documents in snapshot.items():
+            min_eid = 0
+            if start is not None:
+                start_table_name, start_eid = start
+                if TABLES.index(table_name) < TABLES.index(start_table_name):
+                    continue
+                if table_name == start_table_name:
+                    min_eid = start_eid
+
+            for element in documents:
+                eid = element.doc_id
+                if eid <= min_eid:
+                    continue
+
+                if table_name == DEFAULT_TABLE:
+                    if condition(element):
+                        yield table_name, eid, element
+                elif recurrent_only:
+                    if condition(element):
+                        yield table_name, eid, {**element, **{"eid": eid}}
+                else:
+                    for e in pd._create_recurrent_elements(element):
+                        if condition(e):
+                            yield table_name, eid, e
+
+    def _list_page(self, limit=None, recurrent_only=False, **kwargs):
+        """Return at most 'limit' entries of the pocket. For the remaining kwargs,
+        see 'iter_entries()'.
+
+        :return: dict with keys 'elements' (structured like the response of
+            'list') and 'next_cursor' (to request the next page, or None if
+            there are no further entries)
+        """
+        _validate_limit(limit)
+
+        if recurrent_only:
+            elements = []
+        else:
+            elements = {DEFAULT_TABLE: {}, RECURRENT_TABLE: defaultdict(list)}
+
+        # Look ahead by one entry to find out whether there is a next page
+        count = 0
+        last = None
+        next_cursor = None
+        for table_name, eid, element in self._iter_entries(
+            recurrent_only=recurrent_only,
+            limit=None if limit is None else limit + 1,
+            **kwargs,
+        ):
+            if (table_name, eid) != last:
+                if count == limit:
+                    next_cursor = "{}:{}".format(*last)
+                    break
+                count += 1
+                last = (table_name, eid)
+
+            if recurrent_only:
+                elements.append(element)
+            elif table_name == DEFAULT_TABLE:
+                elements[table_name][eid] = element
+            else:
+                elements[table_name][eid].append(element)
+
+        return {"elements": elements, "next_cursor": next_cursor}
+
+    def _aggregate(self, pockets=None, filters=None, recurrent_only=False):
+        """List the entries of several pockets that match the filters. If no
+        pocket names are given, all pockets are taken into account. The pockets
+        are evaluated in parallel (using at most AGGREGATE_MAX_WORKERS threads).
+
+        :return: dict mapping pocket names to their elements (structured like the
+            response of 'list')
+        :raise: PocketValidationFailure if unknown pockets are requested
+        """
+        names = self._pocket_names()
+        if pockets is None:
+            pockets = names
+        else:
+            unknown = sorted(set(pockets) - set(names))
+            if unknown:
+                raise exceptions.PocketValidationFailure(
+                    "Unknown pocket(s): {}".format(", ".join(unknown))
+                )
+            pockets = sorted(set(pockets))
+
+        _query_condition(filters)
+
+        def get_entries(name):
+            with self._pocket_locked(name):
+                return self._get_pocket(name).get_entries(
+                    filters=filters, recurrent_only=recurrent_only
+                )
+
+        if len(pockets) < 2:
+            results = [get_entries(name) for name in pockets]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(len(pockets), AGGREGATE_MAX_WORKERS)
+            ) as executor:
+                results = list(executor.map(get_entries, pockets))
+
+        return dict(zip(pockets, results))
+
+    def _run_batch(self, pocket=None, operations=None):
+        """Run the given operations in order on the pocket. Every operation is a
+        dict holding the 'command' (one of BATCH_COMMANDS), and the kwargs of the
+        command. Failing operations do not abort the batch.
+        The pocket storage is written once after all operations were run.
+
+        :return: list of responses (dicts with key 'id' or 'error'), one for
+            every operation
+        """
+        pd = self._get_pocket(pocket)
+
+        with deferred_writes(pd):
+            return [self._run_operation(pd, o) for o in operations or []]
+
+    def _import(self, pocket=None, entries=None):
+        """Add the given entries (dicts holding the kwargs of the 'add' command)
+        to the pocket. Invalid entries are skipped. The pocket storage is written
+        once after all entries were added.
+
+        :return: list of responses (dicts with key 'id' or 'error'), one for
+            every entry
+        """
+        pd = self._get_pocket(pocket)
+
+        with deferred_writes(pd):
+            return pd.add_entries(entries or [])
+
+    @staticmethod
+    def _run_operation(pd, operation):
+        """Run a single operation of a batch on the pocket.
+
+        :return: dict with key 'id' or 'error'
+        """
+        if not isinstance(operation, dict):
+            return {
+                "error": exceptions.PocketValidationFailure(
+                    "Server: batch operation must be an object"
+                )
+            }
+
+        kwargs = dict(operation)
+        command = kwargs.pop("command", None)
+        if command not in BATCH_COMMANDS:
+            return {
+                "error": exceptions.PocketValidationFailure(
+                    f"Server: unknown batch command '{command}'"
+                )
+            }
+
+        if command != "add":
+            if "eid" not in kwargs:
+                return {
+                    "error": exceptions.PocketValidationFailure(
+                        f"Server: batch command '{command}' requires field 'eid'"
+                    )
+                }
+            try:
+                kwargs["eid"] = int(kwargs["eid"])
+            except (TypeError, ValueError):
+                return {
+                    "error": exceptions.PocketValidationFailure(
+                        "Server: field 'eid' must be an integer"
+                    )
+                }
+
+        if command == "remove":
+            unexpected = sorted(set(kwargs) - {"eid", "table_name"})
+            if unexpected:
+                return {
+                    "error": exceptions.PocketValidationFailure(
+                        "Server: unexpected fields of batch command 'remove': "
+                        + ", ".join(unexpected)
+                    )
+                }
+
+        method = {
+            "add": pd.add_entry,
+            "update": pd.update_entry,
+            "remove": pd.remove_entry,
+        }[command]
+
+        try:
+            return {"id": method(**kwargs)}
+        except exceptions.PocketException as e:
+            return {"error": e}
+        except (TypeError, ValueError) as e:
+            # Malformed arguments not covered above
+            return {
+                "error": exceptions.PocketValidationFailure(f"Invalid operation: {e}")
+            }
@@ -0,0 +1,231 @@
+"""Bulk import and export of entries as CSV or NDJSON files.
+
+An uploaded file is read line by line while it arrives. Rows are validated
+like the payload of an add request, and added to the pocket in chunks of
+IMPORT_CHUNK_SIZE rows (one write of the pocket storage per chunk), hence memory
+use doesn't depend on the size of the file. Invalid rows (including lines that
+aren't UTF-8 encoded) are reported, and don't abort the import.
+
+CSV files start with a header row naming the fields of the entries ('name',
+'value', 'category', 'date', 'frequency', 'start', 'end', 'table_name'); other
+columns are ignored, and empty cells are treated as absent fields. NDJSON files
+hold one JSON object per line.
+
+Exported files have the same layout (with the additional field 'eid'), hence
+they can be imported again. They are encoded in chunks of EXPORT_CHUNK_SIZE
+entries while being sent. Fields without value are exported as null (NDJSON),
+or as empty cells (CSV). An entry with a category of null is imported without
+category, whereas the category of an entry with an empty or absent category is
+derived from earlier entries of the same name; hence only NDJSON files
+preserve entries without category in any case.
+"""
+import csv
+import io
+import itertools
+
+from werkzeug.exceptions import HTTPException
+
+from . import CSV_MIMETYPE, NDJSON_MIMETYPE, jsonlib
+
+# Supported file formats, by MIME type
+FORMATS = {CSV_MIMETYPE: "csv", NDJSON_MIMETYPE: "ndjson"}
+
+# Number of rows added to the pocket at once
+IMPORT_CHUNK_SIZE = 500
+
+# Maximum number of invalid rows that are reported individually
+MAX_REPORTED_ERRORS = 100
+
+# Error reported for rows that aren't valid UTF-8
+INVALID_ENCODING_ERROR = "Invalid UTF-8 encoding."
+
+# Number of entries encoded at once when exporting
+EXPORT_CHUNK_SIZE = 500
+
+# Fields of exported entries, in order of CSV columns
+EXPORT_FIELDS = (
+    "table_name",
+    "eid",
+    "name",
+    "value",
+    "category",
+    "date",
+    "frequency",
+    "start",
+    "end",
+)
+
+
+def _decode(lines):
+    """Decode the lines of UTF-8 encoded bytes. A byte order mark is skipped.
+
+    :return: generator of str, or None for lines that aren't valid UTF-8
+    """
+    for number, line in enumerate(lines):
+        try:
+            yield line.decode("utf-8-sig" if number == 0 else "utf-8")
+        except UnicodeDecodeError:
+            yield None
+
+
+def iter_rows(stream, file_format):
+    """Parse the rows of the file in the given format (one of FORMATS values)
+    read from the stream.
+
+    :return: generator of tuples of row number (starting at 1) and the row data
+        (dict), or an error message (str) if the row can't be parsed
+    """
+    lines = _decode(stream)
+
+    if file_format == "csv":
+        invalid = []
+
+        def valid_lines():
+            for line in lines:
+                if line is None:
+                    # Reported before the next row; blank lines are skipped
+                    invalid.append(None)
+                    line = "\n"
+                yield line
+
+        number = 0
+        for row in csv.DictReader(valid_lines()):
+            for _ in invalid:
+                number += 1
+                yield number, INVALID_ENCODING_ERROR
+            invalid.clear()
+
+            number += 1
+            yield number, {
+                k.strip().lower(): v
+                for k, v in row.items()
+                if k is not None and v not in (None, "")
+            }
+
+        for _ in invalid:
+            number += 1
+            yield number, INVALID_ENCODING_ERROR
+        return
+
+    number = 0
+    for line in lines:
+        if line is None:
+            number += 1
+            yield number, INVALID_ENCODING_ERROR
+            continue
+
+        if not line.strip():
+            continue
+
+        number += 1
+        try:
+            row = jsonlib.loads(line)
+        except ValueError:
+            yield number, "Invalid JSON."
+            continue
+
+        if not isinstance(row, dict):
+            yield number, "Row must be a JSON object."
+        else:
+            yield number, row
+
+
+def _error_message(error):
+    """Return the message of the HTTP exception raised by RequestSchema."""
+    data = getattr(error, "data", None) or {"message": error.description}
+    return data["message"]
+
+
+def import_entries(server, pocket, rows, schema, error_code):
+    """Validate the rows (as generated by 'iter_rows()') using the schema
+    (validation.RequestSchema), and add them to the pocket in chunks. Errors
+    returned by the server are converted using 'error_code()'.
+
+    :return: dict with keys 'imported' (number of added entries), 'failed'
+        (number of invalid rows), and 'errors' (list of dicts with keys 'row',
+        'error', and 'status' for the first MAX_REPORTED_ERRORS invalid rows)
+    :raise: PocketException if the server fails to run the import
+    """
+    result = {"imported": 0, "failed": 0, "errors": []}
+
+    def report(number, error, status):
+        result["failed"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"row": number, "error": error, "status": status})
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, IMPORT_CHUNK_SIZE))
+        if not chunk:
+            return result
+
+        numbers = []
+        entries = []
+        for number, row in chunk:
+            if isinstance(row, str):
+                report(number, row, 400)
+                continue
+
+            try:
+                args = schema.parse(row)
+            except HTTPException as e:
+                report(number, _error_message(e), e.code)
+                continue
+
+            entry = {k: v for k, v in args.items() if v is not None}
+            if "category" in row and row["category"] is None:
+                entry["category"] = None
+            numbers.append(number)
+            entries.append(entry)
+
+        if not entries:
+            continue
+
+        response = server.run("import", pocket=pocket, entries=entries)
+        if "error" in response:
+            raise response["error"]
+
+        for number, entry_result in zip(numbers, response["results"]):
+            if "error" in entry_result:
+                error = entry_result["error"]
+                report(number, str(error), error_code(error))
+            else:
+                result["imported"] += 1
+
+
+def _export_row(table_name, eid, element):
+    row = {"table_name": table_name, "eid": eid}
+    row.update((k, v) for k, v in element.items() if k in EXPORT_FIELDS)
+    return row
+
+
+def encode_entries(entries, file_format):
+    """Encode the entries (as generated by 'backend.Server.export_entries()') in
+    the given format (one of FORMATS values). Absent fields are omitted (NDJSON),
+    or left empty (CSV); None fields are encoded as null, or left empty.
+
+    :return: generator of bytes, each holding up to EXPORT_CHUNK_SIZE entries
+        (CSV: preceded by the header row)
+    """
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS, lineterminator="\n")
+
+        def encode(chunk):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(_export_row(*e) for e in chunk)
+            return buffer.getvalue().encode("utf-8")
+
+        yield ",".join(EXPORT_FIELDS).encode() + b"\n"
+    else:
+
+        def encode(chunk):
+            return b"".join(jsonlib.dumps(_export_row(*e)) + b"\n" for e in chunk)
+
+    entries = iter(entries)
+    while True:
+        chunk = list(itertools.islice(entries, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield encode(chunk)
@@ -0,0 +1,120 @@
+"""In-memory caching of pocket content.
+
+In write-through mode, every modification of a pocket is persisted immediately.
+In write-behind mode, modifications are collected in memory, and persisted
+periodically, after a number of modifications, or on shutdown.
+"""
+import atexit
+import os
+import signal
+import sys
+import threading
+
+from financeager import init_logger
+from tinydb.storages import Storage
+
+logger = init_logger(__name__)
+
+WRITE_THROUGH = "write-through"
+WRITE_BEHIND = "write-behind"
+CACHE_MODES = (WRITE_THROUGH, WRITE_BEHIND)
+
+# Defaults for write-behind mode
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_FLUSH_THRESHOLD = 100
+
+
+class CachingStorage(Storage):
+    """Wrapper around a TinyDB storage keeping its content in memory. The content
+    is read once; subsequent reads are served from memory.
+    Writes are passed to the wrapped storage immediately (write-through), or when
+    flushing (write-behind). In write-behind mode, the storage is flushed after
+    'flush_threshold' writes, if given.
+    If the content of the wrapped storage is already known (e.g. from a
+    snapshot), it can be passed as 'data' such that it's not read again.
+    """
+
+    def __init__(self, storage, write_behind=False, flush_threshold=None, data=None):
+        self._storage = storage
+        self._lock = threading.Lock()
+        self.write_behind = write_behind
+        self.flush_threshold = flush_threshold
+
+        self._data = storage.read() if data is None else data
+        self.dirty_writes = 0
+        self.size = self._stored_size()
+
+    def read(self):
+        return self._data
+
+    def write(self, data):
+        with self._lock:
+            self._data = data
+            self.dirty_writes += 1
+
+        if not self.write_behind or (
+            self.flush_threshold and self.dirty_writes >= self.flush_threshold
+        ):
+            self.flush()
+
+    def flush(self):
+        """Persist the content in the wrapped storage if it was modified."""
+        with self._lock:
+            if not self.dirty_writes:
+                return
+
+            self._storage.write(self._data)
+            self.dirty_writes = 0
+            self.size = self._stored_size()
+
+    def close(self):
+        self.flush()
+        self._storage.close()
+
+    def _stored_size(self):
+        """Return the size of the persisted content in bytes (zero if unknown).
+        It is used to estimate the memory consumption of the cached content.
+        """
+        try:
+            return os.fstat(self._storage._handle.fileno()).st_size
+        except (AttributeError, OSError):
+            return 0
+
+
+class Flusher(threading.Thread):
+    """Daemon thread calling the given function periodically until stopped."""
+
+    def __init__(self, flush, interval):
+        super().__init__(name="financeager-flask-flusher", daemon=True)
+        self._flush = flush
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self._flush()
+            except Exception:
+                logger.exception("Flushing pockets failed")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def install_shutdown_hook(flush):
+    """Call the given function when the interpreter exits. If SIGTERM is not
+    handled yet, it is converted to a regular exit such that the function is
+    called as well.
+    """
+    atexit.register(flush)
+
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, _: sys.exit(128 + signum))
+
+
+def remove_shutdown_hook(function):
+    """Don't call the given function when the interpreter exits, see
+    'install_shutdown_hook()'."""
+    atexit.unregister(function)
@@ -0,0 +1,159 @@
+"""Compression of HTTP message bodies exchanged between client and webservice."""
+import gzip
+import io
+import zlib
+
+import flask
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
+
+# Content codings supported for request and response bodies
+ENCODINGS = ("gzip", "deflate")
+
+# Defaults of the app configuration
+DEFAULT_COMPRESS_MIN_SIZE = 500
+DEFAULT_COMPRESS_LEVEL = 6
+# Maximum size of decompressed request bodies in bytes, unless limited by the
+# 'MAX_CONTENT_LENGTH' of the app
+DEFAULT_MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def compress(data, encoding, level=DEFAULT_COMPRESS_LEVEL):
+    """Compress the given bytes according to the content coding.
+
+    :return: bytes
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    return zlib.compress(data, level)
+
+
+def compress_response(response):
+    """Compress the response body if the client accepts a supported content
+    coding, and if the body is at least as large as the 'COMPRESS_MIN_SIZE'
+    configured for the app. The 'COMPRESS_LEVEL' is used for compression (zero
+    disables compression).
+    Meant to be registered as function to run after each request.
+    """
+    config = flask.current_app.config
+    level = config.get("COMPRESS_LEVEL", DEFAULT_COMPRESS_LEVEL)
+    if (
+        not level
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    encoding = flask.request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < config.get("COMPRESS_MIN_SIZE", DEFAULT_COMPRESS_MIN_SIZE):
+        return response
+
+    response.set_data(compress(data, encoding, level=level))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+class _DecompressingStream(io.RawIOBase):
+    """Readable stream decompressing the content of the wrapped stream on the
+    fly. Reading more than 'max_size' decompressed bytes raises an error.
+    """
+
+    def __init__(self, stream, max_size=None):
+        super().__init__()
+        self._stream = stream
+        self._max_size = max_size
+        self._size = 0
+        # Accept both gzip and zlib format
+        self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            if self._decompressor.eof:
+                return 0
+
+            data = self._decompressor.unconsumed_tail
+            if not data:
+                data = self._stream.read(_CHUNK_SIZE)
+                if not data:
+                    return 0
+
+            try:
+                self._buffer = self._decompressor.decompress(data, _CHUNK_SIZE)
+            except zlib.error:
+                raise BadRequest("Invalid compressed request body.")
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        self._size += size
+        if self._max_size is not None and self._size > self._max_size:
+            raise RequestEntityTooLarge()
+
+        return size
+
+
+def max_decompressed_size(config):
+    """Return the maximum size in bytes of decompressed request bodies for the
+    app configuration: 'MAX_CONTENT_LENGTH' if set, and 'MAX_DECOMPRESSED_SIZE'
+    otherwise.
+    """
+    max_size = config.get("MAX_CONTENT_LENGTH")
+    if max_size is None:
+        max_size = config.get("MAX_DECOMPRESSED_SIZE", DEFAULT_MAX_DECOMPRESSED_SIZE)
+    return max_size
+
+
+def decompress(data, max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+    """Decompress the given bytes in gzip or zlib format. The decompressed data
+    must not exceed 'max_size' bytes, if given.
+
+    :return: bytes
+    :raise: werkzeug.exceptions.BadRequest if the data is invalid,
+        RequestEntityTooLarge if it's too large
+    """
+    stream = _DecompressingStream(io.BytesIO(data), max_size=max_size)
+    return io.BufferedReader(stream).read()
+
+
+class DecompressionMiddleware:
+    """WSGI middleware to transparently decompress request bodies sent with a
+    supported content coding. The body is decompressed while it is read by the
+    application.
+    """
+
+    def __init__(self, app, max_size=DEFAULT_MAX_DECOMPRESSED_SIZE):
+        """Wrap the given WSGI app. The decompressed request body must not exceed
+        'max_size' bytes, if given.
+        """
+        self.app = app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding in ENCODINGS:
+            stream = _DecompressingStream(
+                get_input_stream(environ), max_size=self.max_size
+            )
+            environ["wsgi.input"] = io.BufferedReader(stream)
+            # The decompressed length is unknown; the body is read until EOF
+            environ["wsgi.input_terminated"] = True
+            environ.pop("CONTENT_LENGTH", None)
+            del environ["HTTP_CONTENT_ENCODING"]
+
+        return self.app(environ, start_response)
@@ -1,19 +1,109 @@
 """Utilities to create flask webservice."""
 import os
 
+import click
 from financeager import (
     init_logger,
     make_log_stream_handler_verbose,
-    server,
     setup_log_file_handler,
 )
 from flask import Flask
 from flask_restful import Api
 
-from . import COPY_TAIL, POCKETS_TAIL, VERSION_TAIL, resources
+from . import (
+    AGGREGATE_TAIL,
+    BATCH_TAIL,
+    COPY_TAIL,
+    EXPORT_TAIL,
+    IMPORT_TAIL,
+    METRICS_TAIL,
+    POCKETS_TAIL,
+    STATS_TAIL,
+    SUMMARY_TAIL,
+    VERSION_TAIL,
+    backend,
+    cache,
+    compression,
+    metrics,
+    profiling,
+    resources,
+    sqlite,
+)
 
 logger = init_logger(__name__)
 
+# Defaults of the app configuration of the server (see 'create_app()')
+DEFAULT_SERVER_CONFIG = {
+    "MULTIPROCESS": False,
+    "POCKET_STORAGE_ENGINE": backend.JSON_ENGINE,
+    "POCKET_CACHE_MODE": cache.WRITE_THROUGH,
+    "POCKET_FLUSH_INTERVAL": cache.DEFAULT_FLUSH_INTERVAL,
+    "POCKET_FLUSH_THRESHOLD": cache.DEFAULT_FLUSH_THRESHOLD,
+    "POCKET_MEMORY_BUDGET": None,
+    "POCKET_PRELOAD": False,
+    "POCKET_SNAPSHOTS": False,
+    "POCKET_SNAPSHOT_DIR": None,
+}
+
+
+def prepare_data_dir(data_dir=None):
+    """Return the data directory given as argument, or by the environment
+    variable 'FINANCEAGER_FLASK_DATA_DIR', and create it. Warn if neither is
+    given.
+
+    :return: str or None
+    """
+    data_dir = data_dir or os.environ.get("FINANCEAGER_FLASK_DATA_DIR")
+    if data_dir is None:
+        logger.warning(
+            "'data_dir' not given. Application data is stored in "
+            "memory and is lost when the flask app terminates. Set "
+            "the environment variable FINANCEAGER_FLASK_DATA_DIR "
+            "accordingly for persistent data storage."
+        )
+    else:
+        os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def _snapshot_dir(data_dir, config):
+    snapshot_dir = config["POCKET_SNAPSHOT_DIR"]
+    if snapshot_dir is None and data_dir is not None:
+        snapshot_dir = os.path.join(data_dir, "snapshots")
+    return snapshot_dir
+
+
+def create_server(data_dir, config, metrics=None):
+    """Create the server for the data directory according to the configuration
+    (see DEFAULT_SERVER_CONFIG and 'create_app()'). Pockets are preloaded if
+    configured.
+
+    :return: backend.Server
+    """
+    snapshots_enabled = config["POCKET_SNAPSHOTS"]
+    if snapshots_enabled and data_dir is None:
+        logger.warning("Snapshots disabled since no 'data_dir' given.")
+        snapshots_enabled = False
+
+    srv = backend.Server(
+        data_dir=data_dir,
+        storage_engine=config["POCKET_STORAGE_ENGINE"],
+        multiprocess=config["MULTIPROCESS"],
+        cache_mode=config["POCKET_CACHE_MODE"],
+        flush_interval=config["POCKET_FLUSH_INTERVAL"],
+        flush_threshold=config["POCKET_FLUSH_THRESHOLD"],
+        memory_budget=config["POCKET_MEMORY_BUDGET"],
+        metrics=metrics,
+        snapshot_dir=_snapshot_dir(data_dir, config) if snapshots_enabled else None,
+    )
+    logger.debug("Started financeager server with data dir '{}'".format(data_dir))
+
+    if config["POCKET_PRELOAD"]:
+        srv.preload()
+        logger.debug("Preloaded pockets")
+
+    return srv
+
 
 def create_app(data_dir=None, config=None):
     """Create web app with RESTful API built from resources. The function is
@@ -21,10 +111,37 @@ def create_app(data_dir=None, config=None):
     The log file handler is set up very first.
     If 'data_dir' or the environment variable 'FINANCEAGER_FLASK_DATA_DIR' is
     given, a directory is created to store application data.
-    An instance of 'server.Server' is created, passing 'data_dir'. If 'data_dir'
+    An instance of 'backend.Server' is created, passing 'data_dir'. If 'data_dir'
     is not given, the application data is stored in memory and will be lost when
     the app terminates.
     'config' is a dict of configuration variables that flask understands.
+    Additionally, 'COMPRESS_MIN_SIZE' (minimum size of a response body in bytes
+    to be compressed) and 'COMPRESS_LEVEL' (zero disables compression) are
+    taken into account. If 'MULTIPROCESS' is set, the data directory can be
+    shared by several app processes (e.g. multiple WSGI workers).
+    Pockets are stored according to 'POCKET_STORAGE_ENGINE' ('json' or
+    'sqlite'); the 'migrate-pockets' CLI command converts JSON pockets in the data
+    directory to SQLite databases.
+    Pocket content is cached in memory according to 'POCKET_CACHE_MODE'
+    ('write-through' or 'write-behind'), 'POCKET_FLUSH_INTERVAL' (in seconds) and
+    'POCKET_FLUSH_THRESHOLD' (number of modifications; both for write-behind
+    mode), and 'POCKET_MEMORY_BUDGET' (in bytes, unlimited if None).
+    Pockets are loaded on first access. If 'POCKET_PRELOAD' is set, all pockets
+    are loaded when creating the app (e.g. before a prefork server forks its
+    workers). If 'POCKET_SNAPSHOTS' is set, snapshots of the loaded pockets are
+    saved on shutdown into 'POCKET_SNAPSHOT_DIR' (default: the 'snapshots'
+    subdirectory of the data directory), and used when loading the pockets
+    after a restart. The 'snapshot-pockets' CLI command creates the snapshots
+    of all pockets in the data directory.
+    If 'METRICS' is set, request and server metrics are recorded, and exposed
+    at METRICS_TAIL.
+    If 'PROFILE' is set, requests with the 'profiling.PROFILE_HEADER', and the
+    fraction 'PROFILE_SAMPLE_RATE' of all requests are profiled. Profiles are
+    dumped into 'PROFILE_DIR' (default: the 'profiles' subdirectory of the data
+    directory), and their 'PROFILE_TOP' functions are logged.
+    Compressed request bodies are decompressed. The decompressed body must
+    not exceed 'MAX_CONTENT_LENGTH', or 'MAX_DECOMPRESSED_SIZE' if the former
+    is not set.
     """
     setup_log_file_handler()
 
@@ -33,20 +150,20 @@ def create_app(data_dir=None, config=None):
     init_logger("werkzeug")
 
     app = Flask(__name__)
+    app.config["COMPRESS_MIN_SIZE"] = compression.DEFAULT_COMPRESS_MIN_SIZE
+    app.config["COMPRESS_LEVEL"] = compression.DEFAULT_COMPRESS_LEVEL
+    app.config["MAX_DECOMPRESSED_SIZE"] = compression.DEFAULT_MAX_DECOMPRESSED_SIZE
+    app.config.update(DEFAULT_SERVER_CONFIG)
+    app.config["METRICS"] = False
+    app.config["PROFILE"] = False
+    app.config["PROFILE_SAMPLE_RATE"] = 0.0
+    app.config["PROFILE_DIR"] = None
+    app.config["PROFILE_TOP"] = profiling.DEFAULT_TOP
     app.config.update(config or {})
     if app.debug:
         make_log_stream_handler_verbose()
 
-    data_dir = data_dir or os.environ.get("FINANCEAGER_FLASK_DATA_DIR")
-    if data_dir is None:
-        logger.warning(
-            "'data_dir' not given. Application data is stored in "
-            "memory and is lost when the flask app terminates. Set "
-            "the environment variable FINANCEAGER_FLASK_DATA_DIR "
-            "accordingly for persistent data storage."
-        )
-    else:
-        os.makedirs(data_dir, exist_ok=True)
+    data_dir = prepare_data_dir(data_dir)
 
     logger.debug(
         "Created flask app {} - {} mode".format(
@@ -54,14 +171,37 @@ def create_app(data_dir=None, config=None):
         )
     )
 
-    srv = server.Server(data_dir=data_dir)
-    logger.debug("Started financeager server with data dir '{}'".format(data_dir))
+    service_metrics = metrics.Metrics() if app.config["METRICS"] else None
+
+    srv = create_server(data_dir, app.config, metrics=service_metrics)
+
+    decorators = []
+    if app.config["PROFILE"]:
+        profile_dir = app.config["PROFILE_DIR"]
+        if profile_dir is None and data_dir is not None:
+            profile_dir = os.path.join(data_dir, "profiles")
 
-    api = Api(app)
+        if profile_dir is None:
+            logger.warning("Profiling disabled since no 'PROFILE_DIR' given.")
+        else:
+            decorators.append(
+                profiling.profiled(
+                    profile_dir,
+                    sample_rate=app.config["PROFILE_SAMPLE_RATE"],
+                    top=app.config["PROFILE_TOP"],
+                )
+            )
+
+    api = Api(app, decorators=decorators)
+    api.representations["application/json"] = resources.output_json
     api.add_resource(
         resources.PocketsResource, POCKETS_TAIL, resource_class_args=(srv,)
     )
+    api.add_resource(
+        resources.AggregateResource, AGGREGATE_TAIL, resource_class_args=(srv,)
+    )
     api.add_resource(resources.CopyResource, COPY_TAIL, resource_class_args=(srv,))
+    api.add_resource(resources.StatsResource, STATS_TAIL, resource_class_args=(srv,))
     api.add_resource(
         resources.VersionResource, VERSION_TAIL, resource_class_args=(srv,)
     )
@@ -70,12 +210,67 @@ def create_app(data_dir=None, config=None):
         "{}/<pocket_name>".format(POCKETS_TAIL),
         resource_class_args=(srv,),
     )
+    api.add_resource(
+        resources.BatchResource,
+        "{}/<pocket_name>{}".format(POCKETS_TAIL, BATCH_TAIL),
+        resource_class_args=(srv,),
+    )
+    api.add_resource(
+        resources.ImportResource,
+        "{}/<pocket_name>{}".format(POCKETS_TAIL, IMPORT_TAIL),
+        resource_class_args=(srv,),
+    )
+    api.add_resource(
+        resources.ExportResource,
+        "{}/<pocket_name>{}".format(POCKETS_TAIL, EXPORT_TAIL),
+        resource_class_args=(srv,),
+    )
+    api.add_resource(
+        resources.SummaryResource,
+        "{}/<pocket_name>{}".format(POCKETS_TAIL, SUMMARY_TAIL),
+        resource_class_args=(srv,),
+    )
     api.add_resource(
         resources.EntryResource,
         "{}/<pocket_name>/<table_name>/<eid>".format(POCKETS_TAIL),
         resource_class_args=(srv,),
     )
 
+    if service_metrics is not None:
+        api.add_resource(
+            resources.MetricsResource,
+            METRICS_TAIL,
+            resource_class_args=(service_metrics,),
+        )
+        # Registered before compression such that compressed sizes are recorded
+        metrics.instrument_app(app, service_metrics)
+
+    app.after_request(compression.compress_response)
+    app.wsgi_app = compression.DecompressionMiddleware(
+        app.wsgi_app, max_size=compression.max_decompressed_size(app.config)
+    )
+
+    @app.cli.command("migrate-pockets")
+    @click.option("--overwrite", is_flag=True, help="Replace already migrated pockets.")
+    def migrate_pockets(overwrite):
+        """Migrate JSON pockets in the data directory to SQLite databases."""
+        if data_dir is None:
+            raise click.UsageError("No data directory given.")
+
+        for name in sqlite.migrate(data_dir, overwrite=overwrite):
+            click.echo(f"Migrated pocket '{name}'.")
+
+    @app.cli.command("snapshot-pockets")
+    def snapshot_pockets():
+        """Save snapshots of all pockets in the data directory."""
+        if data_dir is None:
+            raise click.UsageError("No data directory given.")
+
+        snapshot_dir = _snapshot_dir(data_dir, app.config)
+        srv.preload()
+        srv.save_snapshots(snapshot_dir)
+        click.echo(f"Saved snapshots into '{snapshot_dir}'.")
+
     # Assign attribute such that e.g. test_cli can access Server methods
     app._server = srv
 
@@ -1,120 +1,602 @@
 """Construction and handling of HTTP requests to communicate with webservice."""
+import asyncio
+import functools
+import gzip
+import hashlib
 import http
 import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from financeager import DEFAULT_POCKET_NAME, DEFAULT_TABLE, exceptions
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from . import COPY_TAIL, DEFAULT_HOST, POCKETS_TAIL, VERSION_TAIL
+from . import (
+    AGGREGATE_TAIL,
+    BATCH_TAIL,
+    COPY_TAIL,
+    CSV_MIMETYPE,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_HOST,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_RETRY_BACKOFF,
+    EXPORT_TAIL,
+    FILTER_PREFIX,
+    IMPORT_TAIL,
+    NDJSON_MIMETYPE,
+    POCKETS_TAIL,
+    SUMMARY_TAIL,
+    VERSION_TAIL,
+    jsonlib,
+)
 
 VERSION_MESSAGE = (
     "The webserver runs financeager-flask {version}\n"
     + "               and financeager       {financeager_version}"
 )
 
+IMPORT_MESSAGE = "Imported {imported} entries, {failed} failed."
+EXPORT_MESSAGE = "Exported entries to '{filepath}' ({size} bytes)."
+
+# Media types of imported and exported files, by format
+FILE_MIMETYPES = {"csv": CSV_MIMETYPE, "ndjson": NDJSON_MIMETYPE}
+
+# Size of the chunks of exported files written to disk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 
 class Proxy:
-    """Proxy for communicating with webservice via HTTP."""
+    """Proxy for communicating with webservice via HTTP.
+    All requests are sent through a single pooled session such that connections
+    to the webservice are kept alive and reused. The session is created on first
+    use, and closed by 'close()' or when leaving the outermost 'with' block.
+    """
 
     def __init__(self, http_config=None):
         """Args:
         http_config (dict): HTTP configuration with fields 'host' (default:
-            DEFAULT_HOST), 'timeout' (default: DEFAULT_TIMEOUT) and
-            optionally 'username'/'password' (for basic auth)
+            DEFAULT_HOST), 'timeout' (default: DEFAULT_TIMEOUT),
+            'pool_size' (default: DEFAULT_POOL_SIZE), 'retries' (default:
+            DEFAULT_RETRIES), 'keep_alive' (default: True) and optionally
+            'username'/'password' (for basic auth), 'cache_dir' (directory
+            to cache responses of 'list', 'get', and 'summary' commands in),
+            'cache_size' (maximum number of cached responses; default:
+            DEFAULT_CACHE_SIZE), and 'compress_min_size' (minimum size of
+            request bodies in bytes to be compressed; compression is disabled
+            if zero)
         """
         self.http_config = http_config or {}
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._context_depth = 0
+
+    def __enter__(self):
+        self._context_depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._context_depth -= 1
+        if self._context_depth == 0:
+            self.close()
+
+    @property
+    def session(self):
+        """The requests.Session used for communication, created on first
+        access."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        """Create session with a connection pool of configured size. Failed
+        connection attempts, and idempotent requests that the server answered
+        with a gateway error, are retried.
+        """
+        retries = self.http_config.get("retries", DEFAULT_RETRIES)
+        max_retries = Retry(
+            total=retries,
+            backoff_factor=DEFAULT_RETRY_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        pool_size = self.http_config.get("pool_size", DEFAULT_POOL_SIZE)
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.http_config.get("keep_alive", True):
+            session.headers["Connection"] = "close"
+
+        return session
+
+    def close(self):
+        """Close the session and all pooled connections."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
 
     def run(self, command, **data):
         """Convert specified command and data into HTTP request, send it to
         webservice, and return response. Handle error responses.
         The data kwargs are passed to the HTTP request.
         'pocket' and 'table_name' data fields are substituted, if None.
+        For 'list', the 'limit' and 'cursor' data fields request a page of
+        entries (see backend.Server.iter_entries).
+        For 'import' and 'export', the 'filepath' and 'file_format' data fields
+        are passed to 'import_entries()' and 'export_entries()', respectively,
+        and a description of the result is returned.
+        For 'aggregate', the 'pockets' data field holds the names of the pockets
+        to list entries from (all pockets if omitted). 'summary' returns the
+        running aggregates of the pocket (see the 'summary' module).
 
-        :return: dict. See Server class for possible keys
+        :return: dict (see Server class for possible keys), or str
         :raise: ValueError if invalid command given
         :raise: CommunicationError on e.g. timeouts or server-side errors,
             InvalidRequest on invalid requests
         """
 
-        pocket = data.pop("pocket", None) or DEFAULT_POCKET_NAME
+        pocket = data.pop("pocket", None)
+
+        if command == "import":
+            return self._format_import(self.import_entries(pocket=pocket, **data))
+        if command == "export":
+            size = self.export_entries(pocket=pocket, **data)
+            return EXPORT_MESSAGE.format(filepath=data["filepath"], size=size)
 
         host = self.http_config.get("host", DEFAULT_HOST)
         base_url = "{}{}".format(host, POCKETS_TAIL)
-        pocket_url = "{}/{}".format(base_url, pocket)
+        pocket_url = self._pocket_url(pocket)
         copy_url = "{}{}".format(host, COPY_TAIL)
+        aggregate_url = "{}{}".format(host, AGGREGATE_TAIL)
+        summary_url = "{}{}".format(pocket_url, SUMMARY_TAIL)
         version_url = "{}{}".format(host, VERSION_TAIL)
         eid_url = "{}/{}/{}".format(
             pocket_url, data.get("table_name") or DEFAULT_TABLE, data.get("eid")
         )
 
-        username = self.http_config.get("username")
-        password = self.http_config.get("password")
-        auth = None
-        if username and password:
-            auth = (username, password)
-
-        kwargs = dict(auth=auth, timeout=self.http_config.get("timeout"))
+        kwargs = self._request_kwargs()
 
         if command == "list":
-            # Correctly send filters; allowing for server-side deserialization
-            kwargs["json"] = json.dumps(data)
+            params = self._list_params(data)
+            if params:
+                kwargs["params"] = params
         else:
             kwargs["json"] = data or None
 
         if command == "list":
             url = pocket_url
-            function = requests.get
+            function = self.session.get
         elif command == "remove":
             url = eid_url
-            function = requests.delete
+            function = self.session.delete
         elif command == "add":
             url = pocket_url
-            function = requests.post
+            function = self.session.post
         elif command == "pockets":
             url = base_url
-            function = requests.post
+            function = self.session.post
         elif command == "copy":
             url = copy_url
-            function = requests.post
+            function = self.session.post
+        elif command == "aggregate":
+            url = aggregate_url
+            function = self.session.post
         elif command == "get":
             url = eid_url
-            function = requests.get
+            function = self.session.get
+        elif command == "summary":
+            url = summary_url
+            function = self.session.get
         elif command == "update":
             url = eid_url
-            function = requests.patch
+            function = self.session.patch
         elif command == "web-version":
             url = version_url
-            function = requests.get
+            function = self.session.get
         else:
             raise ValueError("Unknown command: {}".format(command))
 
+        cache_filepath = None
+        cached = None
+        if command in ["list", "get", "summary"]:
+            cache_filepath = self._cache_filepath(
+                url, [kwargs.get("json"), kwargs.get("params")]
+            )
+            cached = self._load_cached(cache_filepath)
+            if cached is not None:
+                # Let server skip sending the response if unchanged
+                kwargs["headers"] = {"If-None-Match": cached["etag"]}
+
+        self._encode_body(kwargs)
+        response = self._send(function, url, **kwargs)
+
+        if command == "web-version":
+            return VERSION_MESSAGE.format(**jsonlib.loads(response.content))
+
+        if response.status_code == http.HTTPStatus.NOT_MODIFIED:
+            self._touch_cached(cache_filepath)
+            return cached["body"]
+
+        body = jsonlib.loads(response.content)
+        etag = response.headers.get("ETag")
+        if cache_filepath is not None and etag is not None:
+            self._store_cached(cache_filepath, etag, body)
+
+        return body
+
+    def run_batch(self, operations, pocket=None):
+        """Send the given operations to the webservice in a single request. Every
+        operation is a dict holding the 'command' (one of 'add', 'update',
+        'remove') and the corresponding data fields (e.g. 'eid' and 'table_name'
+        for 'update'). The server runs the operations in order.
+
+        :return: dict with key 'results', holding a list with a dict (keys 'id',
+            or 'error' and 'status') for every operation
+        :raise: CommunicationError on e.g. timeouts or server-side errors,
+            InvalidRequest on invalid requests
+        """
+        url = "{}{}".format(self._pocket_url(pocket), BATCH_TAIL)
+        kwargs = self._request_kwargs()
+        kwargs["json"] = {"operations": list(operations)}
+        self._encode_body(kwargs)
+
+        return jsonlib.loads(self._send(self.session.post, url, **kwargs).content)
+
+    def import_entries(self, filepath, pocket=None, file_format=None):
+        """Upload the CSV or NDJSON file to add its entries to the pocket. The file
+        is streamed from disk. Unless given, the format ('csv' or 'ndjson') is
+        derived from the file name extension (see '_file_format()').
+
+        :return: dict with keys 'imported' (number of added entries), 'failed'
+            (number of invalid rows), and 'errors' (list of dicts with keys
+            'row', 'error', and 'status')
+        :raise: CommunicationError on e.g. timeouts or server-side errors,
+            InvalidRequest on invalid requests or if the file can't be read
+        """
+        file_format = file_format or _file_format(filepath)
+
+        url = "{}{}".format(self._pocket_url(pocket), IMPORT_TAIL)
+        kwargs = self._request_kwargs()
+        kwargs["headers"] = {"Content-Type": FILE_MIMETYPES[file_format]}
+
+        try:
+            file = open(filepath, "rb")
+        except OSError as e:
+            raise exceptions.InvalidRequest("Error reading file: {}".format(e))
+
+        with file:
+            response = self._send(self.session.post, url, data=file, **kwargs)
+        return jsonlib.loads(response.content)
+
+    def export_entries(self, filepath, pocket=None, file_format=None):
+        """Download the entries of the pocket into a CSV or NDJSON file. The file
+        is written while the response arrives, and replaced only once the
+        download is complete. Unless given, the format ('csv' or 'ndjson') is
+        derived from the file name extension (see '_file_format()').
+
+        :return: number of bytes written (int)
+        :raise: CommunicationError on e.g. timeouts, server-side errors, or
+            incomplete downloads, InvalidRequest on invalid requests or if the
+            file can't be written
+        """
+        file_format = file_format or _file_format(filepath)
+
+        url = "{}{}".format(self._pocket_url(pocket), EXPORT_TAIL)
+        kwargs = self._request_kwargs()
+        kwargs["headers"] = {"Accept": FILE_MIMETYPES[file_format]}
+
+        response = self._send(self.session.get, url, stream=True, **kwargs)
+        with response:
+            try:
+                fd, tmp_filepath = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(filepath)), suffix=".tmp"
+                )
+            except OSError as e:
+                raise exceptions.InvalidRequest("Error writing file: {}".format(e))
+
+            size = 0
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp_filepath, filepath)
+            except requests.RequestException as e:
+                os.remove(tmp_filepath)
+                raise exceptions.CommunicationError(
+                    "Error receiving response: {}".format(e)
+                )
+            except OSError as e:
+                if os.path.exists(tmp_filepath):
+                    os.remove(tmp_filepath)
+                raise exceptions.InvalidRequest("Error writing file: {}".format(e))
+
+        return size
+
+    @staticmethod
+    def _format_import(response):
+        """Describe the result of an import, one line per reported error."""
+        lines = [IMPORT_MESSAGE.format(**response)]
+        for error in response["errors"]:
+            message = error["error"]
+            if isinstance(message, dict):
+                message = "; ".join("{}: {}".format(*item) for item in message.items())
+            lines.append("Row {}: {}".format(error["row"], message))
+        return "\n".join(lines)
+
+    def iter_entries(self, pocket=None, **data):
+        """Request the entries of the pocket as a stream, and generate them while
+        they arrive. The data kwargs are the same as for the 'list' command.
+
+        :return: generator of dicts with keys 'table' (table name), 'eid' (ID of
+            the entry), and 'element' (a standard element, an element generated
+            from a recurrent entry, or a recurrent entry if 'recurrent_only' is
+            set)
+        :raise: CommunicationError on e.g. timeouts or server-side errors,
+            InvalidRequest on invalid requests
+        """
+        kwargs = self._request_kwargs()
+        kwargs["params"] = self._list_params(data)
+        kwargs["headers"] = {"Accept": NDJSON_MIMETYPE}
+
+        response = self._send(
+            self.session.get, self._pocket_url(pocket), stream=True, **kwargs
+        )
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+
+                item = jsonlib.loads(line)
+                if "error" in item:
+                    raise exceptions.CommunicationError(
+                        "Error streaming entries: {}".format(item["error"])
+                    )
+                yield item
+
+    @staticmethod
+    def _list_params(data):
+        """Encode the data kwargs of the 'list' command (filters, 'recurrent_only',
+        and the pagination options 'limit' and 'cursor') as query parameters.
+        Filters for None are encoded as empty values. Parameters are sorted such
+        that equal requests have equal URLs.
+
+        :return: dict of query parameters
+        """
+        params = {}
+        for key in ["limit", "cursor"]:
+            value = data.pop(key, None)
+            if value is not None:
+                params[key] = value
+
+        if data.pop("recurrent_only", False):
+            params["recurrent_only"] = "true"
+
+        for field, pattern in (data.pop("filters", None) or {}).items():
+            params[FILTER_PREFIX + field] = "" if pattern is None else pattern
+
+        return dict(sorted(params.items()))
+
+    def _encode_body(self, kwargs):
+        """Replace the JSON payload of the request kwargs by a gzip-compressed
+        body if it is at least of the configured 'compress_min_size'."""
+        min_size = self.http_config.get("compress_min_size")
+        if not min_size or kwargs.get("json") is None:
+            return
+
+        data = jsonlib.dumps(kwargs["json"])
+        if len(data) < min_size:
+            return
+
+        del kwargs["json"]
+        kwargs["data"] = gzip.compress(data)
+        kwargs.setdefault("headers", {}).update(
+            {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        )
+
+    def _cache_filepath(self, url, data):
+        """Return path of the cache file for the response to a request of given
+        URL and data, or None if caching is disabled.
+        """
+        cache_dir = self.http_config.get("cache_dir")
+        if not cache_dir:
+            return None
+
+        key = json.dumps([self.http_config.get("username"), url, data], sort_keys=True)
+        return os.path.join(
+            cache_dir, "{}.json".format(hashlib.sha256(key.encode()).hexdigest())
+        )
+
+    @staticmethod
+    def _load_cached(filepath):
+        """Return cached response (dict with keys 'etag' and 'body'), or None if
+        not available."""
+        if filepath is None:
+            return None
+
+        try:
+            with open(filepath, "rb") as file:
+                return jsonlib.loads(file.read())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _touch_cached(filepath):
+        """Mark the cached response as recently used."""
+        try:
+            os.utime(filepath)
+        except OSError:
+            pass
+
+    def _store_cached(self, filepath, etag, body):
+        """Store response in the cache. The file is replaced atomically to be
+        safe for concurrent access. If the cache holds more than 'cache_size'
+        responses, the least recently used ones are removed."""
+        cache_dir = os.path.dirname(filepath)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_filepath = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(jsonlib.dumps({"etag": etag, "body": body}))
+            os.replace(tmp_filepath, filepath)
+        except OSError:
+            # Caching is an optimization only
+            return
+
+        self._prune_cache(cache_dir)
+
+    def _prune_cache(self, cache_dir):
+        """Remove the least recently used responses exceeding the cache size."""
+        cache_size = self.http_config.get("cache_size", DEFAULT_CACHE_SIZE)
+        try:
+            entries = [
+                e
+                for e in os.scandir(cache_dir)
+                if e.name.endswith(".json") and e.is_file()
+            ]
+            if len(entries) <= cache_size:
+                return
+
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[: len(entries) - cache_size]:
+                os.remove(entry.path)
+        except OSError:
+            # Files might be removed concurrently
+            pass
+
+    def _pocket_url(self, pocket):
+        host = self.http_config.get("host", DEFAULT_HOST)
+        return "{}{}/{}".format(host, POCKETS_TAIL, pocket or DEFAULT_POCKET_NAME)
+
+    def _request_kwargs(self):
+        """Return common kwargs for sending a request (authentication and
+        timeout)."""
+        username = self.http_config.get("username")
+        password = self.http_config.get("password")
+        auth = None
+        if username and password:
+            auth = (username, password)
+
+        return dict(auth=auth, timeout=self.http_config.get("timeout"))
+
+    @staticmethod
+    def _send(function, url, **kwargs):
+        """Send request using the given function of the session.
+
+        :return: requests.Response
+        :raise: CommunicationError on e.g. timeouts or server-side errors,
+            InvalidRequest on invalid requests. Errors due to error responses
+            hold the 'status_code' of the response
+        """
         try:
             response = function(url, **kwargs)
         except requests.RequestException as e:
             raise exceptions.CommunicationError("Error sending request: {}".format(e))
 
         if response.ok:
-            if command == "web-version":
-                return VERSION_MESSAGE.format(**response.json())
-            return response.json()
+            return response
+
+        try:
+            # Get further information about error (see Server.run)
+            error = jsonlib.loads(response.content)["error"]
+        except (ValueError, KeyError, TypeError):
+            error = "-"
+
+        status_code = response.status_code
+        if 400 <= status_code < 500:
+            error_class = exceptions.InvalidRequest
         else:
-            try:
-                # Get further information about error (see Server.run)
-                error = response.json()["error"]
-            except (json.JSONDecodeError, KeyError):
-                error = "-"
-
-            status_code = response.status_code
-            if 400 <= status_code < 500:
-                error_class = exceptions.InvalidRequest
-            else:
-                error_class = exceptions.CommunicationError
-
-            message = (
-                "Error handling request. "
-                + "Server returned '{} ({}): {}'".format(
-                    http.HTTPStatus(status_code).phrase, status_code, error
-                )
+            error_class = exceptions.CommunicationError
+
+        message = "Error handling request. " + "Server returned '{} ({}): {}'".format(
+            http.HTTPStatus(status_code).phrase, status_code, error
+        )
+
+        exception = error_class(message)
+        exception.status_code = status_code
+        raise exception
+
+
+def _file_format(filepath):
+    """Return the format of the file to import or export: 'csv' for files with
+    extension '.csv', and 'ndjson' otherwise."""
+    return "csv" if filepath.lower().endswith(".csv") else "ndjson"
+
+
+class AsyncProxy:
+    """Proxy for communicating with webservice from asyncio code, e.g.
+
+        async with AsyncProxy(http_config) as proxy:
+            responses = await asyncio.gather(
+                *[proxy.run("list", pocket=p) for p in pockets]
             )
 
-            raise error_class(message)
+    Requests are sent by a Proxy in a pool of worker threads such that at most
+    'max_concurrency' requests are in flight at a time; further requests wait for
+    a free worker. Commands, responses and errors are the same as for Proxy.
+    Leaving the 'async with' block awaits 'aclose()'; use 'close()' outside of
+    asyncio code.
+    """
+
+    def __init__(self, http_config=None, max_concurrency=None):
+        """Args:
+        http_config (dict): HTTP configuration, see Proxy
+        max_concurrency (int): maximum number of concurrent requests (default:
+            configured 'pool_size', or DEFAULT_POOL_SIZE)
+        """
+        http_config = dict(http_config or {})
+        pool_size = http_config.get("pool_size", DEFAULT_POOL_SIZE)
+        self.max_concurrency = max_concurrency or pool_size
+
+        # Every concurrent request can use a pooled connection
+        http_config["pool_size"] = max(pool_size, self.max_concurrency)
+        self.proxy = Proxy(http_config=http_config)
+        self._executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def run(self, command, **data):
+        """Run the command. See Proxy.run()."""
+        return await self._call(self.proxy.run, command, **data)
+
+    async def run_batch(self, operations, pocket=None):
+        """Run the batch of operations. See Proxy.run_batch()."""
+        return await self._call(self.proxy.run_batch, operations, pocket=pocket)
+
+    async def _call(self, function, *args, **kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="financeager-flask",
+            )
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def aclose(self):
+        """Wait for pending requests without blocking the event loop, and close
+        all connections."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """Wait for pending requests, and close all connections."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.proxy.close()
@@ -0,0 +1,57 @@
+"""JSON serialization of data exchanged between client and webservice.
+
+If the optional 'orjson' package is installed, it is used for (de)serialization;
+otherwise the standard library's 'json' module is used. Another implementation
+can be plugged in via 'set_backend()'.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj).encode()
+
+
+if orjson is not None:
+
+    def _orjson_dumps(obj):
+        # Entry IDs are used as keys of the 'list' response
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    _DEFAULT_BACKEND = (_orjson_dumps, orjson.loads)
+else:
+    _DEFAULT_BACKEND = (_stdlib_dumps, json.loads)
+
+_backend = _DEFAULT_BACKEND
+
+
+def dumps(obj):
+    """Serialize the object.
+
+    :return: bytes
+    """
+    return _backend[0](obj)
+
+
+def loads(data):
+    """Deserialize the given bytes or string.
+
+    :raise: ValueError if data is not valid JSON
+    """
+    return _backend[1](data)
+
+
+def set_backend(dumps=None, loads=None):
+    """Use the given functions for serialization (returning bytes) and
+    deserialization (raising ValueError on invalid input). Without arguments,
+    the default implementation is restored.
+    """
+    global _backend
+    if dumps is None or loads is None:
+        _backend = _DEFAULT_BACKEND
+    else:
+        _backend = (dumps, loads)
@@ -0,0 +1,166 @@
+"""Synchronization primitives to safely share pockets between threads and
+processes."""
+import contextlib
+import threading
+
+from tinydb.storages import Storage
+from tinydb.table import Table
+from tinydb.utils import LRUCache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class RWLock:
+    """Readers-writer lock. Any number of readers can hold the lock at the same
+    time, whereas a writer holds it exclusively. Waiting writers take precedence
+    over new readers such that writers don't starve.
+    The lock is not re-entrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self, blocking=True):
+        """Acquire the lock as writer. If not blocking, return immediately
+        whether the lock could be acquired."""
+        with self._condition:
+            if not blocking and (self._writing or self._readers):
+                return False
+
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+            return True
+
+    def release_write(self):
+        with self._condition:
+            self._writing = False
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read_locked(self):
+        """Context manager holding the lock as reader."""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_locked(self):
+        """Context manager holding the lock as writer."""
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class SynchronizedStorage(Storage):
+    """Wrapper around a TinyDB storage such that only one thread at a time
+    accesses it (e.g. JSONStorage uses a single file handle for all reads).
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._lock = threading.Lock()
+
+    def read(self):
+        with self._lock:
+            return self._storage.read()
+
+    def write(self, data):
+        with self._lock:
+            self._storage.write(data)
+
+    def close(self):
+        with self._lock:
+            self._storage.close()
+
+
+class SynchronizedLRUCache(LRUCache):
+    """LRU cache that can be accessed by multiple threads."""
+
+    def __init__(self, capacity=None):
+        super().__init__(capacity=capacity)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return super().get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            super().set(key, value)
+
+
+class SynchronizedTable(Table):
+    """TinyDB table whose query cache can be accessed by multiple threads."""
+
+    query_cache_class = SynchronizedLRUCache
+
+
+def synchronize(db, table_names=()):
+    """Prepare the given TinyDB database for concurrent reads by multiple
+    threads. Storage access is serialized, and tables use a synchronized query
+    cache. The given tables are created upfront.
+    Modifying the database still requires exclusive access.
+    """
+    db._storage = SynchronizedStorage(db.storage)
+    db.table_class = SynchronizedTable
+
+    # Re-create tables to refer to the synchronized storage
+    db._tables.clear()
+    for name in {db.default_table_name, *table_names}:
+        db.table(name)
+
+
+@contextlib.contextmanager
+def file_locked(filepath, exclusive=False):
+    """Context manager holding an advisory lock (see flock(2)) of the file,
+    exclusively or shared. The lock is respected by all processes using this
+    function. The file is created if not present.
+
+    :return: the file object, opened for reading and writing at the start
+    :raise: RuntimeError if file locking is not supported on the platform
+    """
+    if fcntl is None:
+        raise RuntimeError("File locking is not supported on this platform.")
+
+    with open(filepath, "a+") as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            file.seek(0)
+            yield file
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -3,7 +3,16 @@ from financeager import clients
 from financeager import exceptions as base_exceptions
 from financeager import plugin
 
-from . import DEFAULT_HOST, DEFAULT_TIMEOUT, exceptions, httprequests, offline
+from . import (
+    CACHE_DIR,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_HOST,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    exceptions,
+    offline,
+)
 
 SERVICE_NAME = "flask"
 CONFIG_SECTION_NAME = "SERVICE:{}".format(SERVICE_NAME.upper())
@@ -16,11 +25,24 @@ class _Configuration(plugin.PluginConfiguration):
             "timeout": DEFAULT_TIMEOUT,
             "username": "",
             "password": "",
+            "pool_size": DEFAULT_POOL_SIZE,
+            "retries": DEFAULT_RETRIES,
+            "keep_alive": True,
+            "offline_fsync": True,
+            "cache_dir": CACHE_DIR,
+            "cache_size": DEFAULT_CACHE_SIZE,
+            "compress_min_size": 0,
         }
 
     def init_option_types(self, option_types):
         option_types[CONFIG_SECTION_NAME] = {
             "timeout": "int",
+            "pool_size": "int",
+            "retries": "int",
+            "keep_alive": "boolean",
+            "offline_fsync": "boolean",
+            "cache_size": "int",
+            "compress_min_size": "int",
         }
 
 
@@ -32,49 +54,114 @@ class _CliOptions(plugin.PluginCliOptions):
             "(only if configured with service name '{}')".format(SERVICE_NAME),
         )
 
+        import_parser = command_parser.add_parser(
+            "import",
+            help="add the entries of a CSV or NDJSON file to the database "
+            "(only if configured with service name '{}')".format(SERVICE_NAME),
+        )
+        import_parser.add_argument(
+            "filepath",
+            help="file to import. CSV files start with a header row naming the "
+            "entry fields (e.g. 'name,value,category,date')",
+        )
+        import_parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=["csv", "ndjson"],
+            help="file format (default: derived from file name extension)",
+        )
+        import_parser.add_argument(
+            "-p", "--pocket", help="name of pocket to import entries into"
+        )
+
+        export_parser = command_parser.add_parser(
+            "export",
+            help="write the entries of a pocket to a CSV or NDJSON file "
+            "(only if configured with service name '{}')".format(SERVICE_NAME),
+        )
+        export_parser.add_argument(
+            "filepath", help="file to write. Existing files are replaced"
+        )
+        export_parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=["csv", "ndjson"],
+            help="file format (default: derived from file name extension)",
+        )
+        export_parser.add_argument(
+            "-p", "--pocket", help="name of pocket to export entries from"
+        )
+
 
 class _Client(clients.Client):
     """Client for communicating with the financeager Flask webservice."""
 
     def __init__(self, *, configuration, sinks):
-        """Set up proxy and urllib3 logger."""
+        """Set up urllib3 logger. The proxy is created on first use."""
         super().__init__(configuration=configuration, sinks=sinks)
-        self.proxy = httprequests.Proxy(
-            http_config=configuration.get_section(CONFIG_SECTION_NAME)
-        )
 
         financeager.init_logger("urllib3")
 
+    @property
+    def proxy(self):
+        """Proxy to the webservice. Since importing the HTTP client libraries
+        takes a considerable part of the CLI start-up time, they are imported
+        only when the proxy is first accessed.
+        """
+        if self._proxy is None:
+            from . import httprequests
+
+            self._proxy = httprequests.Proxy(
+                http_config=self.configuration.get_section(CONFIG_SECTION_NAME)
+            )
+        return self._proxy
+
+    @proxy.setter
+    def proxy(self, proxy):
+        self._proxy = proxy
+
     def safely_run(self, command, **params):
         """Execute base functionality.
         If successful, attempt to recover offline backup. Otherwise store
         request in offline backup.
         Return whether execution was successful.
+        The command and the recovery share a single connection to the server.
 
         :return: bool
         """
-        success = super().safely_run(command, **params)
+        with self.proxy:
+            success = super().safely_run(command, **params)
 
-        if success:
-            try:
-                # Avoid recursion by passing base class for invoking safely_run
-                if offline.recover(super()):
-                    self.sinks.info("Recovered offline backup.")
+            if success:
+                try:
+                    if offline.recover(self):
+                        self.sinks.info("Recovered offline backup.")
 
-            except exceptions.OfflineRecoveryError:
-                self.sinks.error("Offline backup recovery failed!")
-                success = False
+                except exceptions.OfflineRecoveryError:
+                    self.sinks.error("Offline backup recovery failed!")
+                    success = False
 
         # If request was erroneous, it's not supposed to be stored offline
         if (
             not isinstance(self.latest_exception, base_exceptions.InvalidRequest)
             and self.latest_exception is not None
-            and offline.add(command, **params)
+            and offline.add(
+                command,
+                fsync=self.configuration.get_option(
+                    CONFIG_SECTION_NAME, "offline_fsync"
+                ),
+                **params,
+            )
         ):
             self.sinks.info("Stored '{}' request in offline backup.".format(command))
 
         return success
 
+    def shutdown(self):
+        """Close connections to the server, if any were opened."""
+        if self._proxy is not None:
+            self._proxy.close()
+
 
 def main():
     return plugin.ServicePlugin(
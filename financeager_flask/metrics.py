@@ -0,0 +1,282 @@
+"""Collection of service metrics, exposed in the Prometheus text format.
+
+The 'Metrics' class holds the metrics recorded by the webservice: request
+counts, latencies and payload sizes per resource; latencies and errors per
+server command; and durations of pocket storage reads and writes.
+"""
+import math
+import threading
+import time
+
+import flask
+from tinydb.storages import Storage
+
+# Media type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+PREFIX = "financeager_flask_"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{{{}}}".format(
+        ",".join('{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values))
+    )
+
+
+def timer():
+    """Return a function returning the seconds elapsed since this call."""
+    start = time.perf_counter()
+    return lambda: time.perf_counter() - start
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class of metrics with an optional set of labels."""
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} requires labels {', '.join(self.labelnames)}"
+            )
+        return tuple(str(label) for label in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_sample(self, labels, value):
+        yield "{}{} {}".format(
+            self.name,
+            _format_labels(self.labelnames, labels),
+            _format_value(value),
+        )
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, *labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([], 0))
+            return sum(counts)
+
+    def _render_sample(self, labels, value):
+        counts, total = value
+        names = self.labelnames + ("le",)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield "{}_bucket{} {}".format(
+                self.name,
+                _format_labels(names, labels + (_format_value(bound),)),
+                cumulative,
+            )
+        label_string = _format_labels(self.labelnames, labels)
+        yield f"{self.name}_sum{label_string} {_format_value(total)}"
+        yield f"{self.name}_count{label_string} {cumulative}"
+
+
+class CallbackCounter(Counter):
+    """Counter whose values are provided by a function returning a dict mapping
+    label tuples to values, called on rendering."""
+
+    def __init__(self, name, help, labelnames, callback):
+        super().__init__(name, help, labelnames)
+        self._callback = callback
+
+    def render(self):
+        with self._lock:
+            self._values = dict(self._callback())
+        return super().render()
+
+
+class Metrics:
+    """Registry of the metrics of the webservice."""
+
+    def __init__(self):
+        self.requests = Counter(
+            PREFIX + "http_requests_total",
+            "Number of HTTP requests by resource, method, and status code.",
+            ("resource", "method", "status"),
+        )
+        self.request_duration = Histogram(
+            PREFIX + "http_request_duration_seconds",
+            "Duration of HTTP requests by resource and method.",
+            ("resource", "method"),
+        )
+        self.request_size = Histogram(
+            PREFIX + "http_request_size_bytes",
+            "Size of HTTP request bodies by resource.",
+            ("resource",),
+            buckets=SIZE_BUCKETS,
+        )
+        self.response_size = Histogram(
+            PREFIX + "http_response_size_bytes",
+            "Size of HTTP response bodies (if known upfront) by resource.",
+            ("resource",),
+            buckets=SIZE_BUCKETS,
+        )
+        self.command_duration = Histogram(
+            PREFIX + "command_duration_seconds",
+            "Duration of server commands by command and pocket.",
+            ("command", "pocket"),
+        )
+        self.command_errors = Counter(
+            PREFIX + "command_errors_total",
+            "Number of server commands that returned an error, by command.",
+            ("command",),
+        )
+        self.storage_duration = Histogram(
+            PREFIX + "storage_operation_duration_seconds",
+            "Duration of pocket storage operations by operation (read/write).",
+            ("operation",),
+        )
+        self._metrics = [
+            self.requests,
+            self.request_duration,
+            self.request_size,
+            self.response_size,
+            self.command_duration,
+            self.command_errors,
+            self.storage_duration,
+        ]
+
+    def add(self, metric):
+        """Register an additional metric."""
+        self._metrics.append(metric)
+
+    def render(self):
+        """Return all metrics in the text exposition format.
+
+        :return: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedStorage(Storage):
+    """Wrapper around a TinyDB storage recording durations of reads and writes.
+    Other attributes are looked up in the wrapped storage.
+    """
+
+    def __init__(self, storage, histogram):
+        self._storage = storage
+        self._histogram = histogram
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    def _timed(self, operation, function, *args):
+        elapsed = timer()
+        try:
+            return function(*args)
+        finally:
+            self._histogram.observe(elapsed(), operation)
+
+    def read(self):
+        return self._timed("read", self._storage.read)
+
+    def write(self, data):
+        self._timed("write", self._storage.write, data)
+
+    def close(self):
+        self._storage.close()
+
+
+def instrument_app(app, metrics):
+    """Record count, duration, and payload sizes of the requests to the flask
+    app. Requests are labelled by the URL rule of the resource. For streamed
+    responses, the duration until the response starts is recorded.
+    """
+
+    @app.before_request
+    def start_timer():
+        flask.g.metrics_timer = timer()
+
+    @app.after_request
+    def record_request(response):
+        request = flask.request
+        resource = request.url_rule.rule if request.url_rule else "unmatched"
+        elapsed = flask.g.get("metrics_timer")
+        if elapsed is not None:
+            metrics.request_duration.observe(elapsed(), resource, request.method)
+        metrics.requests.inc(resource, request.method, response.status_code)
+        if request.content_length is not None:
+            metrics.request_size.observe(request.content_length, resource)
+        if not response.is_streamed and response.content_length is not None:
+            metrics.response_size.observe(response.content_length, resource)
+        return response
@@ -1,49 +1,176 @@
 """Module for storing client requests when server not available, and recovering
 of such.
+
+The offline backup is an append-only journal holding one JSON-encoded request per
+line. During recovery, the position up to which the journal has been recovered is
+tracked in a checkpoint file next to it.
 """
 
 import json
+import os
 import os.path
+import shutil
 
 from financeager import init_logger
+from financeager.exceptions import CommunicationError, InvalidRequest
 
 from . import OFFLINE_FILEPATH, exceptions
 
 logger = init_logger(__name__)
 
+# Maximum number of items sent to the server in a single request on recovery
+RECOVERY_CHUNK_SIZE = 500
+
+# Status codes of responses of servers that don't provide the batch endpoint
+BATCH_UNSUPPORTED_STATUS_CODES = (404, 405)
+
+
+def _checkpoint_filepath(filepath):
+    return "{}.checkpoint".format(filepath)
+
+
+def _read_checkpoint(filepath):
+    """Return the offset (in bytes) up to which the journal has been recovered."""
+    try:
+        with open(_checkpoint_filepath(filepath), "r") as file:
+            return int(file.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_checkpoint(filepath, offset):
+    tmp_filepath = "{}.tmp".format(_checkpoint_filepath(filepath))
+    with open(tmp_filepath, "w") as file:
+        file.write(str(offset))
+    os.replace(tmp_filepath, _checkpoint_filepath(filepath))
+
+
+def _remove(filepath):
+    for path in [filepath, _checkpoint_filepath(filepath)]:
+        if os.path.exists(path):
+            os.remove(path)
 
-def _load(filepath):
-    if os.path.exists(filepath):
+
+def _migrate(filepath):
+    """Convert a backup file of the previous format (a single JSON list) into a
+    journal."""
+    try:
         with open(filepath, "r") as file:
+            if file.read(1) != "[":
+                return
+            file.seek(0)
             content = json.load(file)
-            logger.debug("Loaded {}".format(content))
-    else:
-        content = []
+    except FileNotFoundError:
+        return
+
+    logger.debug("Converting {} into journal".format(filepath))
+    tmp_filepath = "{}.tmp".format(filepath)
+    with open(tmp_filepath, "w") as file:
+        for item in content:
+            file.write(json.dumps(item) + "\n")
+    os.replace(tmp_filepath, filepath)
+
+
+def _read(filepath, offset=0):
+    """Stream the items of the journal, starting at the given offset (in bytes).
+    Lines that can't be decoded (e.g. truncated by a crash while appending) are
+    skipped.
+
+    :return: generator of tuples (item, offset after the item's line)
+    """
+    with open(filepath, "rb") as file:
+        file.seek(offset)
+        for line in file:
+            offset += len(line)
+            try:
+                item = json.loads(line)
+            except ValueError:
+                if line.strip():
+                    logger.warning("Skipping corrupt line in {}".format(filepath))
+                continue
+            yield item, offset
+
+
+def _chunks(items):
+    """Group the stream of journal items into chunks of consecutive items that
+    refer to the same pocket. A chunk holds at most RECOVERY_CHUNK_SIZE items.
+
+    :return: generator of tuples (pocket name, list of tuples (item, offset after
+        the item's line))
+    """
+    chunk = []
+    pocket = None
+    for item, offset in items:
+        if chunk and (
+            len(chunk) >= RECOVERY_CHUNK_SIZE or item.get("pocket") != pocket
+        ):
+            yield pocket, chunk
+            chunk = []
+
+        pocket = item.get("pocket")
+        chunk.append((item, offset))
+
+    if chunk:
+        yield pocket, chunk
 
-    return content
 
+def _replay(client, pocket, operations):
+    """Send the operations one by one via 'client.proxy.run', for servers that
+    don't provide the batch endpoint.
+
+    :return: generator of responses (dicts with key 'id' or 'error'), one for
+        every operation
+    :raise: CommunicationError if sending an operation fails
+    """
+    for operation in operations:
+        data = dict(operation)
+        command = data.pop("command")
+        try:
+            yield {"id": client.proxy.run(command, pocket=pocket, **data)["id"]}
+        except InvalidRequest as e:
+            yield {"error": e}
 
-def _write(content, filepath):
-    with open(filepath, "w") as file:
-        logger.debug("Writing {}".format(content))
-        json.dump(content, file)
 
+def _recover_chunk(client, pocket, chunk):
+    """Recover the items of the chunk by sending them to the server via
+    'client.proxy.run_batch'. If the server doesn't provide the batch endpoint,
+    the items are sent one by one instead. The outcome of every item is reported
+    to the client's sinks. Items rejected by the server are not recovered again.
 
-def _recover_data(client, content):
-    """Recover the data items in the content list by running the commands via
-    'client.safely_run'. If an error occurs, the recovery is aborted, and the
-    currently processed data is returned.
-    The content list is modified in-place.
+    :return: generator of offsets after the items that have been recovered
+    :raise: CommunicationError or InvalidRequest if sending the chunk fails
     """
-    while len(content):
-        data = content.pop()
-        if not client.safely_run(**data):
-            return data
+    operations = []
+    for item, _ in chunk:
+        operation = dict(item)
+        operation.pop("pocket", None)
+        operations.append(operation)
 
+    try:
+        results = client.proxy.run_batch(operations, pocket=pocket)["results"]
+    except InvalidRequest as e:
+        if getattr(e, "status_code", None) not in BATCH_UNSUPPORTED_STATUS_CODES:
+            raise
+        logger.debug("Batch endpoint not available, sending items one by one")
+        results = _replay(client, pocket, operations)
 
-def add(command, offline_filepath=None, **cl_kwargs):
+    for (_, offset), operation, result in zip(chunk, operations, results):
+        command = operation["command"]
+        if "error" in result:
+            client.sinks.error(
+                "Failed to recover '{}' request: {}".format(command, result["error"])
+            )
+        else:
+            client.sinks.info(
+                "Recovered '{}' request (element {}).".format(command, result["id"])
+            )
+        yield offset
+
+
+def add(command, offline_filepath=None, fsync=True, **cl_kwargs):
     """Add a command and optional kwargs passed from the command line to the
-    offline backup database.
+    offline backup journal.
+    If 'fsync' is set, the journal is synced to disk before returning.
 
     Non-modifying request commands such as 'print' or 'list' are not stored.
 
@@ -54,20 +181,56 @@ def add(command, offline_filepath=None, **cl_kwargs):
         return False
 
     offline_filepath = offline_filepath or OFFLINE_FILEPATH
-    content = _load(offline_filepath)
+    _migrate(offline_filepath)
 
     cl_kwargs["command"] = command
-    content.append(cl_kwargs)
-    _write(content, offline_filepath)
+    line = json.dumps(cl_kwargs).encode() + b"\n"
+
+    with open(offline_filepath, "a+b") as file:
+        if file.tell() > 0:
+            # Terminate a line that was left incomplete
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                line = b"\n" + line
+
+        logger.debug("Appending {}".format(cl_kwargs))
+        file.write(line)
+        file.flush()
+        if fsync:
+            os.fsync(file.fileno())
 
     return True
 
 
+def compact(offline_filepath=None):
+    """Drop the part of the offline backup journal that has already been
+    recovered, and reset the checkpoint.
+    """
+    offline_filepath = offline_filepath or OFFLINE_FILEPATH
+
+    offset = _read_checkpoint(offline_filepath)
+    if not offset or not os.path.exists(offline_filepath):
+        return
+
+    tmp_filepath = "{}.tmp".format(offline_filepath)
+    with open(offline_filepath, "rb") as source, open(tmp_filepath, "wb") as target:
+        source.seek(offset)
+        shutil.copyfileobj(source, target)
+        target.flush()
+        os.fsync(target.fileno())
+
+    os.replace(tmp_filepath, offline_filepath)
+    os.remove(_checkpoint_filepath(offline_filepath))
+
+
 def recover(client, offline_filepath=None):
-    """Recover the offline backup by passing its content to the given client.
-    The recovery will be aborted if a CommunicationError occurs.
+    """Recover the offline backup by streaming its content in chunks to the
+    server via the proxy of the given client. After every recovered chunk (or
+    item, if the items are sent one by one), a checkpoint is stored.
+    The recovery will be aborted if sending a chunk fails. The recovered part of
+    the journal is then dropped.
 
-    If the recovery succeeded, the backup file is deleted.
+    If the recovery succeeded, the journal is deleted.
 
     :return: if anything was recovered
     :raises: OfflineRecoveryError if recovery failed
@@ -75,17 +238,26 @@ def recover(client, offline_filepath=None):
 
     offline_filepath = offline_filepath or OFFLINE_FILEPATH
 
-    content = _load(offline_filepath)
-    if not content:
+    _migrate(offline_filepath)
+    if not os.path.exists(offline_filepath):
         return False
 
-    failed_recovery_data = _recover_data(client, content)
-
-    if failed_recovery_data is None:
-        os.remove(offline_filepath)
-    else:
-        content.append(failed_recovery_data)
-        _write(content, offline_filepath)
+    recovered = False
+    offset = _read_checkpoint(offline_filepath)
+    try:
+        for pocket, chunk in _chunks(_read(offline_filepath, offset)):
+            end = None
+            try:
+                for end in _recover_chunk(client, pocket, chunk):
+                    recovered = True
+            finally:
+                if end is not None:
+                    _write_checkpoint(offline_filepath, end)
+    except (CommunicationError, InvalidRequest) as e:
+        logger.error("Recovering offline backup failed: {}".format(e))
+        compact(offline_filepath)
         raise exceptions.OfflineRecoveryError()
 
-    return True
+    _remove(offline_filepath)
+
+    return recovered
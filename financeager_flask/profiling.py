@@ -0,0 +1,112 @@
+"""Profiling of individual requests.
+
+When enabled in the app, requests carrying the PROFILE_HEADER, and a random
+sample of all requests, are profiled with cProfile. The profile of a request is
+dumped into the profile directory (to be inspected e.g. with 'python -m pstats'
+or snakeviz), and the functions with highest cumulative time are logged.
+For streamed responses, only the time until the response starts is profiled.
+"""
+import cProfile
+import functools
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+import flask
+from financeager import init_logger
+
+logger = init_logger(__name__)
+
+# Request header to have a request profiled
+PROFILE_HEADER = "X-Financeager-Profile"
+
+DEFAULT_TOP = 10
+
+# Only one request at a time is profiled; concurrent profilers are not supported
+# by every Python version
+_lock = threading.Lock()
+
+
+def _filename(request):
+    path = re.sub(r"[^A-Za-z0-9]+", "_", request.path).strip("_")
+    return "{}-{}-{}-{}.prof".format(
+        time.strftime("%Y%m%dT%H%M%S"), request.method, path, uuid.uuid4().hex[:8]
+    )
+
+
+def summarize(profiler, top=DEFAULT_TOP):
+    """Return a single line describing the 'top' functions with highest
+    cumulative time in the profile.
+    """
+    stats = pstats.Stats(profiler).stats
+    entries = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return "; ".join(
+        "{} ({}:{}) {:.1f} ms".format(
+            function, os.path.basename(filename), line, cumulative * 1000
+        )
+        for (filename, line, function), (_, _, _, cumulative, _) in entries[:top]
+    )
+
+
+def profiled(profile_dir, sample_rate=0.0, top=DEFAULT_TOP):
+    """Create a decorator for resource methods (see flask_restful's
+    'Api.decorators') that profiles requests with PROFILE_HEADER set, and the
+    fraction 'sample_rate' of all other requests. Profiles are dumped into
+    'profile_dir', which is created if not present.
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            request = flask.request
+            if not (
+                request.headers.get(PROFILE_HEADER)
+                or (sample_rate and random.random() < sample_rate)
+            ):
+                return function(*args, **kwargs)
+
+            if not _lock.acquire(blocking=False):
+                return function(*args, **kwargs)
+
+            try:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # Another profiler is active, e.g. when running under one
+                    return function(*args, **kwargs)
+
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    profiler.disable()
+                    _dump(profiler, request, profile_dir, top)
+            finally:
+                _lock.release()
+
+        return wrapper
+
+    return decorator
+
+
+def _dump(profiler, request, profile_dir, top):
+    filepath = os.path.join(profile_dir, _filename(request))
+    try:
+        profiler.dump_stats(filepath)
+    except OSError as e:
+        logger.warning(f"Dumping profile failed: {e}")
+        filepath = None
+
+    logger.info(
+        "Profiled {} {} (dump: {}): {}".format(
+            request.method,
+            request.full_path.rstrip("?"),
+            filepath,
+            summarize(profiler, top),
+        )
+    )
@@ -0,0 +1,93 @@
+"""Memoization of the elements generated from recurrent entries.
+
+Generating the occurrences of a recurrent entry (e.g. one element per month) is
+costly, and the result only changes when the entry is modified, or on a new
+day. The generated elements are hence cached per entry; the cache is cleared
+whenever the recurrent table is modified, and on every new day.
+"""
+import threading
+from datetime import date
+
+from financeager import RECURRENT_TABLE
+from tinydb.table import Document
+
+
+class RecurrentCacheMixin:
+    """Mixin for pocket classes to cache the elements generated from recurrent
+    entries. Number of cache hits and misses are counted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Maps entry IDs to the entry content and the generated elements
+        self._recurrent_cache = {}
+        self._recurrent_cache_key = None
+        self._recurrent_cache_lock = threading.Lock()
+        self._recurrent_revision = 0
+        self.recurrent_cache_hits = 0
+        self.recurrent_cache_misses = 0
+
+    def recurrent_cache_stats(self):
+        """Return number of cache hits and misses, and number of cached entries.
+
+        :return: dict
+        """
+        with self._recurrent_cache_lock:
+            return {
+                "hits": self.recurrent_cache_hits,
+                "misses": self.recurrent_cache_misses,
+                "size": len(self._recurrent_cache),
+            }
+
+    def _create_recurrent_elements(self, element):
+        """Generate the elements of the recurrent element, see
+        'TinyDbPocket._create_recurrent_elements()'. The elements are taken
+        from the cache if the recurrent element is unchanged.
+        """
+        if element.doc_id is None:
+            return super()._create_recurrent_elements(element)
+
+        key = (self._recurrent_revision, date.today())
+        with self._recurrent_cache_lock:
+            if self._recurrent_cache_key != key:
+                self._recurrent_cache.clear()
+                self._recurrent_cache_key = key
+
+            # The element may stem from a snapshot older than the cache content
+            content, elements = self._recurrent_cache.get(element.doc_id, (None, None))
+            if content != element:
+                elements = None
+
+            if elements is None:
+                self.recurrent_cache_misses += 1
+            else:
+                self.recurrent_cache_hits += 1
+
+        if elements is None:
+            elements = [dict(e) for e in super()._create_recurrent_elements(element)]
+            with self._recurrent_cache_lock:
+                if self._recurrent_cache_key == key:
+                    self._recurrent_cache[element.doc_id] = (dict(element), elements)
+
+        # Return copies such that callers can't modify the cache content
+        return (Document(e, doc_id=None) for e in elements)
+
+    def _invalidate_recurrent_cache(self, table_name):
+        if table_name == RECURRENT_TABLE:
+            with self._recurrent_cache_lock:
+                self._recurrent_revision += 1
+
+    def add_entry(self, table_name=None, **kwargs):
+        eid = super().add_entry(table_name=table_name, **kwargs)
+        self._invalidate_recurrent_cache(table_name)
+        return eid
+
+    def update_entry(self, eid, table_name=None, **kwargs):
+        eid = super().update_entry(eid, table_name=table_name, **kwargs)
+        self._invalidate_recurrent_cache(table_name)
+        return eid
+
+    def remove_entry(self, eid, table_name=None):
+        eid = super().remove_entry(eid, table_name=table_name)
+        self._invalidate_recurrent_cache(table_name)
+        return eid
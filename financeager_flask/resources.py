@@ -1,21 +1,47 @@
 """Webservice resources as end points of financeager REST API."""
-import json
-
 import flask
+import flask_restful
 from financeager import exceptions, init_logger
-from flask_restful import Resource, reqparse
+from flask_restful import Resource, inputs, reqparse
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
 
-from . import version
+from . import (
+    CSV_MIMETYPE,
+    FILTER_PREFIX,
+    NDJSON_MIMETYPE,
+    NULLABLE_FILTER_FIELDS,
+    bulk,
+    jsonlib,
+    metrics,
+    validation,
+    version,
+)
 
 logger = init_logger(__name__)
 
-copy_parser = reqparse.RequestParser()
+
+def _error_code(error):
+    """Return the HTTP status code corresponding to the given server error."""
+    if isinstance(error, exceptions.PocketEntryNotFound):
+        return 404
+    return 400
+
+
+def _json_array(value):
+    """Type of request arguments that must be JSON arrays."""
+    if not isinstance(value, list):
+        raise ValueError("Expected JSON array.")
+    return value
+
+
+copy_parser = validation.RequestSchema()
 copy_parser.add_argument("destination_pocket", required=True)
 copy_parser.add_argument("source_pocket", required=True)
 copy_parser.add_argument("eid", required=True, type=int)
 copy_parser.add_argument("table_name")
 
-put_parser = reqparse.RequestParser()
+put_parser = validation.RequestSchema()
 put_parser.add_argument("name", required=True)
 put_parser.add_argument("value", required=True, type=float)
 put_parser.add_argument("category")
@@ -29,7 +55,22 @@ print_parser = reqparse.RequestParser()
 print_parser.add_argument("filters")
 print_parser.add_argument("recurrent_only", type=bool)
 
-update_parser = reqparse.RequestParser()
+list_parser = reqparse.RequestParser()
+list_parser.add_argument("limit", type=inputs.positive, location="args")
+list_parser.add_argument("cursor", location="args")
+list_parser.add_argument("recurrent_only", type=inputs.boolean, location="args")
+
+aggregate_parser = reqparse.RequestParser()
+aggregate_parser.add_argument("pockets", type=list, location="json")
+aggregate_parser.add_argument("filters", type=dict, location="json")
+aggregate_parser.add_argument("recurrent_only", type=bool, location="json")
+
+batch_parser = reqparse.RequestParser()
+batch_parser.add_argument(
+    "operations", required=True, type=_json_array, location="json"
+)
+
+update_parser = validation.RequestSchema()
 update_parser.add_argument("name")
 update_parser.add_argument("value", type=float)
 update_parser.add_argument("category")
@@ -39,6 +80,78 @@ update_parser.add_argument("start")
 update_parser.add_argument("end")
 
 
+def _parse_filters(args):
+    """Extract the filters of the 'list' command from the query parameters (see
+    FILTER_PREFIX).
+
+    :return: dict
+    """
+    filters = {}
+    for key, value in args.items():
+        if not key.startswith(FILTER_PREFIX):
+            continue
+
+        field = key.partition(FILTER_PREFIX)[2]
+        if not value and field in NULLABLE_FILTER_FIELDS:
+            value = None
+        filters[field] = value
+
+    return filters
+
+
+def _legacy_list_args(body):
+    """Parse the arguments of the 'list' command that older clients send as
+    JSON-encoded string in the request body. Only 'filters' and
+    'recurrent_only' are taken into account.
+
+    :return: dict
+    :raise: werkzeug.exceptions.BadRequest if the body is invalid
+    """
+    if not isinstance(body, str):
+        return {}
+
+    try:
+        data = jsonlib.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("filters") or {}, dict):
+        flask_restful.abort(
+            400, message="Invalid request body. Expected JSON-encoded object."
+        )
+
+    return {k: data[k] for k in ("filters", "recurrent_only") if k in data}
+
+
+def run_command(server, command, **kwargs):
+    """Run the command on the server. Errors are converted into a response
+    holding the error message; unexpected exceptions are logged.
+
+    :return: tuple of response (dict) and HTTP status code
+    """
+    try:
+        response = server.run(command, **kwargs)
+    except Exception:
+        logger.exception("Unexpected error")
+        return {"error": "unexpected error"}, 500
+
+    if "error" in response:
+        error = response["error"]
+        return {"error": str(error)}, _error_code(error)
+    return response, 200
+
+
+def output_json(data, code, headers=None):
+    """Create JSON response using the serializer of the 'jsonlib' module. Meant
+    to be registered as representation of the flask_restful Api."""
+    response = flask.make_response(jsonlib.dumps(data) + b"\n", code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def _not_modified(etag):
+    return flask.Response(status=304, headers={"ETag": quote_etag(etag)})
+
+
 class LogResource(Resource):
     """Custom class to facilitate request logging and safe execution of server
     commands."""
@@ -54,29 +167,37 @@ class LogResource(Resource):
         If an unexpected exception is caught, the method logs it and returns an
         internal server error.
         """
-        try:
-            response = self.server.run(command, **kwargs)
+        response, code = run_command(self.server, command, **kwargs)
+        return response if code == 200 else (response, code)
 
-            if "error" in response:
-                error = response["error"]
-                if isinstance(error, exceptions.PocketEntryNotFound):
-                    error_code = 404
-                else:
-                    error_code = 400
-                response = ({"error": str(error)}, error_code)
+    def run_conditionally(self, command, pocket, **kwargs):
+        """Wrapper around 'run_safely()' for non-modifying commands. The
+        response is tagged with the revision of the pocket. If the client
+        indicates that it holds the response of the current revision, an empty
+        response (Not Modified) is returned instead.
+        """
+        etag = self.server.pocket_revision(pocket)
+        if flask.request.if_none_match.contains(etag):
+            return _not_modified(etag)
 
-        except Exception:
-            logger.exception("Unexpected error")
-            response = ({"error": "unexpected error"}, 500)
+        response = self.run_safely(command, pocket=pocket, **kwargs)
+        if isinstance(response, dict):
+            response = (response, 200, {"ETag": quote_etag(etag)})
 
         return response
 
+    # Whether to log the request body; disabled for resources that stream it
+    log_body = True
+
     def dispatch_request(self, *args, **kwargs):
         """Log content of request that is about to be dispatched."""
-        logger.debug(
-            "Dispatching {r} holding {{data: {r.data}, "
-            "values: {r.values}, json: {r.json}}}".format(r=flask.request)
-        )
+        if self.log_body:
+            logger.debug(
+                "Dispatching {r} holding {{data: {r.data}, "
+                "values: {r.values}, json: {r.json}}}".format(r=flask.request)
+            )
+        else:
+            logger.debug("Dispatching {}".format(flask.request))
         return super().dispatch_request(*args, **kwargs)
 
 
@@ -87,17 +208,159 @@ class PocketsResource(LogResource):
 
 class PocketResource(LogResource):
     def get(self, pocket_name):
-        args = json.loads(flask.request.json or "{}")
-        return self.run_safely("list", pocket=pocket_name, **args)
+        args = _legacy_list_args(flask.request.get_json(silent=True))
+
+        list_args = list_parser.parse_args()
+        args.update({k: v for k, v in list_args.items() if v is not None})
+        filters = _parse_filters(flask.request.args)
+        if filters:
+            args["filters"] = filters
+
+        accept = flask.request.accept_mimetypes
+        if accept.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+            return self.stream(pocket_name, **args)
+
+        return self.run_conditionally("list", pocket=pocket_name, **args)
+
+    def stream(self, pocket_name, **kwargs):
+        """Stream the entries of the pocket, one JSON object (with fields 'table',
+        'eid', and 'element') per line. If an error occurs while streaming, an
+        object with field 'error' is sent as last line.
+        """
+        etag = self.server.pocket_revision(pocket_name)
+        if flask.request.if_none_match.contains(etag):
+            return _not_modified(etag)
+
+        try:
+            entries = self.server.iter_entries(pocket=pocket_name, **kwargs)
+        except exceptions.PocketException as e:
+            return {"error": str(e)}, _error_code(e)
+        except Exception:
+            logger.exception("Unexpected error")
+            return {"error": "unexpected error"}, 500
+
+        def generate():
+            try:
+                for table_name, eid, element in entries:
+                    yield jsonlib.dumps(
+                        {"table": table_name, "eid": eid, "element": element}
+                    ) + b"\n"
+            except Exception:
+                logger.exception("Unexpected error")
+                yield jsonlib.dumps({"error": "unexpected error"}) + b"\n"
+
+        return flask.Response(
+            generate(), mimetype=NDJSON_MIMETYPE, headers={"ETag": quote_etag(etag)}
+        )
 
     def post(self, pocket_name):
         args = put_parser.parse_args()
         return self.run_safely("add", pocket=pocket_name, **args)
 
 
+class AggregateResource(LogResource):
+    def post(self):
+        args = aggregate_parser.parse_args()
+        return self.run_safely("aggregate", **args)
+
+
+class BatchResource(LogResource):
+    def post(self, pocket_name):
+        args = batch_parser.parse_args()
+        response = self.run_safely("batch", pocket=pocket_name, **args)
+
+        if isinstance(response, dict):
+            # Convert errors of individual operations
+            for result in response["results"]:
+                if "error" in result:
+                    error = result["error"]
+                    result["error"] = str(error)
+                    result["status"] = _error_code(error)
+
+        return response
+
+
+class ImportResource(LogResource):
+    log_body = False
+
+    def post(self, pocket_name):
+        """Import the entries of the CSV or NDJSON file sent as request body
+        (see the 'bulk' module). The body is read while entries are added.
+        """
+        mimetype = flask.request.mimetype
+        if mimetype not in bulk.FORMATS:
+            flask_restful.abort(
+                415,
+                message="Unsupported format '{}'. Expected one of: {}".format(
+                    mimetype, ", ".join(bulk.FORMATS)
+                ),
+            )
+
+        rows = bulk.iter_rows(flask.request.stream, bulk.FORMATS[mimetype])
+        try:
+            return bulk.import_entries(
+                self.server, pocket_name, rows, put_parser, _error_code
+            )
+        except exceptions.PocketException as e:
+            return {"error": str(e)}, _error_code(e)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Unexpected error")
+            return {"error": "unexpected error"}, 500
+
+
+class ExportResource(LogResource):
+    def get(self, pocket_name):
+        """Stream the entries of the pocket as NDJSON or CSV file (see the 'bulk'
+        module), depending on the accepted media types (default: NDJSON). If an
+        error occurs while streaming, the transfer is aborted such that the
+        client doesn't take the file as complete.
+        """
+        mimetype = (
+            flask.request.accept_mimetypes.best_match([NDJSON_MIMETYPE, CSV_MIMETYPE])
+            or NDJSON_MIMETYPE
+        )
+        file_format = bulk.FORMATS[mimetype]
+
+        etag = self.server.pocket_revision(pocket_name)
+        if flask.request.if_none_match.contains(etag):
+            return _not_modified(etag)
+
+        try:
+            entries = self.server.export_entries(pocket=pocket_name)
+        except exceptions.PocketException as e:
+            return {"error": str(e)}, _error_code(e)
+        except Exception:
+            logger.exception("Unexpected error")
+            return {"error": "unexpected error"}, 500
+
+        def generate():
+            try:
+                yield from bulk.encode_entries(entries, file_format)
+            except Exception:
+                logger.exception("Unexpected error")
+                raise
+
+        response = flask.Response(
+            generate(), mimetype=mimetype, headers={"ETag": quote_etag(etag)}
+        )
+        response.headers.set(
+            "Content-Disposition",
+            "attachment",
+            filename="{}.{}".format(pocket_name, file_format),
+        )
+        return response
+
+
+class SummaryResource(LogResource):
+    def get(self, pocket_name):
+        return self.run_conditionally("summary", pocket=pocket_name)
+
+
 class EntryResource(LogResource):
     def get(self, pocket_name, table_name, eid):
-        return self.run_safely(
+        return self.run_conditionally(
             "get", pocket=pocket_name, table_name=table_name, eid=eid
         )
 
@@ -119,6 +382,20 @@ class CopyResource(LogResource):
         return self.run_safely("copy", **args)
 
 
+class StatsResource(LogResource):
+    def get(self):
+        return self.run_safely("stats")
+
+
+class MetricsResource(Resource):
+    def __init__(self, metrics, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    def get(self):
+        return flask.Response(self.metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 class VersionResource(LogResource):
     def get(self):
         return {
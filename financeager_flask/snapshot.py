@@ -0,0 +1,88 @@
+"""On-disk snapshots of the in-memory state of pockets.
+
+A snapshot holds the content of a pocket loaded by the server together with the
+caches derived from it (category cache, summary, and generated recurrent
+elements). A restarted server loads the snapshot instead of parsing the pocket
+file and rebuilding the caches. Every pocket has a separate snapshot file such
+that pockets are still loaded on first access.
+A snapshot is only used if the pocket files are unchanged since the snapshot
+was taken (same modification times and sizes); otherwise it's ignored.
+Snapshots are pickled, hence the snapshot directory must only be writable by
+the server.
+"""
+import os
+import pickle
+import tempfile
+
+from financeager import init_logger
+
+logger = init_logger(__name__)
+
+FILE_EXTENSION = ".snapshot"
+
+# Snapshots of a different format version are ignored
+FORMAT_VERSION = 1
+
+
+def _filepath(snapshot_dir, name):
+    return os.path.join(snapshot_dir, f"{name}{FILE_EXTENSION}")
+
+
+def signature(filepaths):
+    """Return modification time and size of every file. Missing and empty files
+    are not distinguished.
+
+    :return: tuple
+    """
+    result = []
+    for filepath in filepaths:
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is None or not stat.st_size:
+            result.append(None)
+        else:
+            result.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(result)
+
+
+def save(snapshot_dir, name, filepaths, state):
+    """Save the state of the pocket 'name' stored in the given files. The
+    snapshot file is replaced atomically.
+    """
+    content = {
+        "version": FORMAT_VERSION,
+        "signature": signature(filepaths),
+        "state": state,
+    }
+    with tempfile.NamedTemporaryFile(
+        dir=snapshot_dir, prefix=f".{name}-", delete=False
+    ) as file:
+        pickle.dump(content, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file.name, _filepath(snapshot_dir, name))
+
+
+def load(snapshot_dir, name, filepaths):
+    """Load the state of the pocket 'name' stored in the given files.
+
+    :return: dict, or None if there is no snapshot, or it's outdated or invalid
+    """
+    try:
+        with open(_filepath(snapshot_dir, name), "rb") as file:
+            content = pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring invalid snapshot of pocket '{name}': {e}")
+        return None
+
+    if not isinstance(content, dict) or content.get("version") != FORMAT_VERSION:
+        return None
+    if content.get("signature") != signature(filepaths):
+        logger.debug(f"Ignoring outdated snapshot of pocket '{name}'")
+        return None
+
+    logger.debug(f"Loaded snapshot of pocket '{name}'")
+    return content["state"]
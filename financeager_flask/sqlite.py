@@ -0,0 +1,382 @@
+"""Pocket storing its entries in an SQLite database.
+
+Filters of the 'list' command are translated into SQL. The standard table is
+indexed by date, category, and name.
+"""
+import contextlib
+import glob
+import os.path
+import re
+import sqlite3
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+from financeager import DEFAULT_TABLE, RECURRENT_TABLE, exceptions, init_logger
+from financeager.pocket import Pocket, TinyDbPocket
+from tinydb.storages import JSONStorage
+from tinydb.table import Document
+
+logger = init_logger(__name__)
+
+FILE_EXTENSION = ".sqlite3"
+
+# Columns of the tables, in order
+COLUMNS = {
+    DEFAULT_TABLE: ("name", "value", "category", "date"),
+    RECURRENT_TABLE: ("name", "value", "category", "frequency", "start", "end"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS standard (
+    eid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    category TEXT,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS standard_date ON standard (date);
+CREATE INDEX IF NOT EXISTS standard_category ON standard (category);
+CREATE INDEX IF NOT EXISTS standard_name ON standard (name);
+CREATE TABLE IF NOT EXISTS recurrent (
+    eid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    category TEXT,
+    frequency TEXT NOT NULL,
+    start TEXT NOT NULL,
+    "end" TEXT
+);
+"""
+
+_REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+# Patterns of the date field that can only match at the start of a date
+# (YYYY-MM-DD) since they begin with the four digits of the year
+_DATE_PREFIX_PATTERN = re.compile(r"\d{4}(-[\d-]*)?")
+
+
+def _regexp(pattern, value):
+    """Implementation of the SQL REGEXP operator, following the semantics of
+    tinydb.Query.search()."""
+    return isinstance(value, str) and re.search(pattern, value) is not None
+
+
+def _quote(column):
+    return '"{}"'.format(column)
+
+
+def filter_clause(table_name, filters):
+    """Translate the filters of the 'list' command into an SQL expression for the
+    given table. The semantics are the same as for
+    'TinyDbPocket._create_query_condition()'.
+
+    :return: tuple of SQL expression and parameters
+    """
+    clauses = ["1"]
+    parameters = []
+
+    for field, pattern in filters.items():
+        if field not in COLUMNS[table_name]:
+            # Entries don't match filters for absent fields
+            return "0", []
+
+        column = _quote(field)
+        if pattern is None and field in ["category", "end"]:
+            clauses.append(f"{column} IS NULL")
+        elif field == "value":
+            clauses.append(f"{column} = ?")
+            parameters.append(float(pattern))
+        else:
+            pattern = pattern.lower()
+            if _REGEX_METACHARACTERS.isdisjoint(pattern):
+                clauses.append(f"instr({column}, ?) > 0")
+                parameters.append(pattern)
+            else:
+                clauses.append(f"{column} REGEXP ?")
+                parameters.append(pattern)
+
+            if field == "date" and _DATE_PREFIX_PATTERN.fullmatch(pattern):
+                # Four digits can only match the year at the start of the
+                # date; restrict to the range of the index
+                upper = pattern[:-1] + chr(ord(pattern[-1]) + 1)
+                clauses.append(f"{column} >= ? AND {column} < ?")
+                parameters.extend([pattern, upper])
+
+    return " AND ".join(clauses), parameters
+
+
+class SqlitePocket(TinyDbPocket):
+    """Pocket with an SQLite database backend. Validation of entries, and
+    generation of recurrent entries are the same as for TinyDbPocket.
+    Every thread accesses the database through a separate connection.
+    """
+
+    def __init__(self, name=None, data_dir=None, **kwargs):
+        """Create a pocket identified by 'name'. If 'data_dir' is given, the
+        database is stored in a file (the filepath is derived from the pocket's
+        name). Otherwise the data is stored in memory.
+        Further kwargs are ignored.
+        """
+        Pocket.__init__(self, name=name)
+
+        if data_dir is None:
+            # Named in-memory database to be shared by all connections
+            self._uri = "file:financeager-{}?mode=memory&cache=shared".format(
+                uuid.uuid4().hex
+            )
+        else:
+            self._uri = "file:{}".format(
+                os.path.join(data_dir, f"{self.name}{FILE_EXTENSION}")
+            )
+
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        connection = self._connection
+        if data_dir is not None:
+            connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+
+        self._create_category_cache()
+
+    @property
+    def _connection(self):
+        """The database connection of the current thread, opened on first
+        access."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self._uri, uri=True, isolation_level=None, check_same_thread=False
+            )
+            connection.row_factory = sqlite3.Row
+            connection.create_function("REGEXP", 2, _regexp, deterministic=True)
+            with self._connections_lock:
+                self._connections.append(connection)
+            self._local.connection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager to run all modifications in a single transaction. The
+        transaction is committed when leaving the context, even if an error
+        occurred (same as 'backend.deferred_writes()').
+        """
+        connection = self._connection
+        if connection.in_transaction:
+            yield
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        finally:
+            connection.execute("COMMIT")
+
+    def _create_category_cache(self):
+        self._category_cache = defaultdict(Counter)
+        for row in self._connection.execute("SELECT name, category FROM standard"):
+            self._category_cache[row["name"]].update([row["category"]])
+
+    def _select(self, table_name, filters=None, eid=None):
+        """Select documents of the table that match the filters (or the given
+        ID), in order of ascending IDs.
+
+        :return: list of tinydb.table.Document
+        """
+        clause, parameters = filter_clause(table_name, filters or {})
+        if eid is not None:
+            clause += " AND eid = ?"
+            parameters.append(eid)
+
+        columns = ", ".join(_quote(c) for c in COLUMNS[table_name])
+        rows = self._connection.execute(
+            f"SELECT eid, {columns} FROM {table_name} WHERE {clause} ORDER BY eid",
+            parameters,
+        )
+        return [
+            Document({c: row[c] for c in COLUMNS[table_name]}, doc_id=row["eid"])
+            for row in rows
+        ]
+
+    def _check_table_name(self, table_name):
+        if table_name not in COLUMNS:
+            raise exceptions.PocketValidationFailure(
+                f"Unknown table name: {table_name}"
+            )
+
+    def add_entry(self, table_name=None, **kwargs):
+        """Add an entry to the database. See 'TinyDbPocket.add_entry()'.
+
+        :raise: PocketValidationFailure if validation failed
+        :return: ID of new entry (int)
+        """
+        table_name = table_name or DEFAULT_TABLE
+        fields = self._preprocess_entry(raw_data=kwargs, table_name=table_name)
+
+        self._update_category_cache(**fields)
+
+        columns = [c for c in COLUMNS[table_name] if c in fields]
+        cursor = self._connection.execute(
+            "INSERT INTO {} ({}) VALUES ({})".format(
+                table_name,
+                ", ".join(_quote(c) for c in columns),
+                ", ".join("?" for _ in columns),
+            ),
+            [fields[c] for c in columns],
+        )
+        return cursor.lastrowid
+
+    def get_entry(self, eid, table_name=None):
+        """Get entry specified by 'eid' in the table 'table_name' (defaults to
+        table 'standard').
+
+        :raise: PocketEntryNotFound if element not found
+        :return: found element (tinydb.table.Document)
+        """
+        table_name = table_name or DEFAULT_TABLE
+        self._check_table_name(table_name)
+
+        elements = self._select(table_name, eid=int(eid))
+        if not elements:
+            raise exceptions.PocketEntryNotFound("Entry not found.")
+
+        return elements[0]
+
+    def update_entry(self, eid, table_name=None, **kwargs):
+        """Update one or more fields of a single entry. See
+        'TinyDbPocket.update_entry()'.
+
+        :raise: PocketEntryNotFound if element not found
+        :return: ID of the updated entry
+        """
+        table_name = table_name or DEFAULT_TABLE
+        fields = self._preprocess_entry_for_update(
+            raw_data=kwargs, table_name=table_name
+        )
+
+        self._update_category_cache(eid=eid, table_name=table_name, **fields)
+
+        columns = [c for c in COLUMNS[table_name] if c in fields]
+        if columns:
+            self._connection.execute(
+                "UPDATE {} SET {} WHERE eid = ?".format(
+                    table_name, ", ".join(f"{_quote(c)} = ?" for c in columns)
+                ),
+                [fields[c] for c in columns] + [int(eid)],
+            )
+
+        return int(eid)
+
+    def remove_entry(self, eid, table_name=None):
+        """Remove an entry given its ID. See 'TinyDbPocket.remove_entry()'.
+
+        :raise: PocketEntryNotFound if element/ID not found.
+        :return: element ID if removal was successful
+        """
+        table_name = table_name or DEFAULT_TABLE
+        entry = self.get_entry(eid=int(eid), table_name=table_name)
+
+        self._connection.execute(
+            f"DELETE FROM {table_name} WHERE eid = ?", [entry.doc_id]
+        )
+        self._update_category_cache(removing=True, **entry)
+
+        return entry.doc_id
+
+    def documents(self, table_name, filters=None):
+        """Return the documents of the table that match the filters, in order of
+        ascending IDs.
+
+        :return: list of tinydb.table.Document
+        """
+        return self._select(table_name, filters)
+
+    def get_entries(self, filters=None, recurrent_only=False):
+        """Get standard and recurrent entries that match the filters. See
+        'TinyDbPocket.get_entries()'.
+        Standard entries are filtered by the database; recurrent entries are
+        generated first, and filtered afterwards.
+        """
+        filters = filters or {}
+        condition = self._create_query_condition(**filters)
+
+        if recurrent_only:
+            return [
+                {**e, **{"eid": e.doc_id}}
+                for e in self._select(RECURRENT_TABLE, filters)
+            ]
+
+        elements = {DEFAULT_TABLE: {}, RECURRENT_TABLE: defaultdict(list)}
+
+        for element in self._select(DEFAULT_TABLE, filters):
+            elements[DEFAULT_TABLE][element.doc_id] = element
+
+        for element in self._select(RECURRENT_TABLE):
+            for e in self._create_recurrent_elements(element):
+                if condition(e):
+                    elements[RECURRENT_TABLE][element.doc_id].append(e)
+
+        return elements
+
+    def checkpoint(self):
+        """Transfer the content of the write-ahead log into the database file,
+        and truncate the log."""
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """Close all database connections."""
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def migrate(data_dir, overwrite=False):
+    """Import the pockets stored as JSON files in the data directory into SQLite
+    databases. Entry IDs are retained. Pockets already present as SQLite
+    database are skipped, unless 'overwrite' is set.
+
+    :return: list of names of migrated pockets
+    """
+    migrated = []
+    for filepath in sorted(glob.glob(os.path.join(data_dir, "*.json"))):
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        target = os.path.join(data_dir, f"{name}{FILE_EXTENSION}")
+        if os.path.exists(target) and not overwrite:
+            logger.info(f"Skipping pocket '{name}' (already migrated)")
+            continue
+
+        # A left-over write-ahead log must not be applied to the new database
+        for path in [target, f"{target}-wal", f"{target}-shm"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+        storage = JSONStorage(filepath, access_mode="r")
+        try:
+            data = storage.read() or {}
+        finally:
+            storage.close()
+
+        pd = SqlitePocket(name, data_dir=data_dir)
+        try:
+            with pd.transaction():
+                for table_name, columns in COLUMNS.items():
+                    for eid, document in data.get(table_name, {}).items():
+                        pd._connection.execute(
+                            "INSERT INTO {} (eid, {}) VALUES (?, {})".format(
+                                table_name,
+                                ", ".join(_quote(c) for c in columns),
+                                ", ".join("?" for _ in columns),
+                            ),
+                            [int(eid)] + [document.get(c) for c in columns],
+                        )
+        finally:
+            pd.close()
+
+        logger.info(f"Migrated pocket '{name}'")
+        migrated.append(name)
+
+    return migrated
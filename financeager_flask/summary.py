@@ -0,0 +1,165 @@
+"""Running aggregates of pocket entries.
+
+The summary of a pocket holds number and total value of the entries per table,
+per category, and (for standard entries) per month. It is computed once when
+first requested, and updated on every modification of the pocket such that
+requesting it takes time independent of the number of entries.
+Recurrent entries are summarized as stored, i.e. without generating their
+occurrences; their aggregates are reported under the key 'templates', and
+don't match the totals of the generated elements returned by 'list'.
+"""
+import threading
+from collections import defaultdict
+
+from financeager import DEFAULT_TABLE, RECURRENT_TABLE, exceptions
+
+# Totals are reported in cents precision
+TOTAL_DIGITS = 2
+
+
+class _Bucket:
+    """Number and total value of entries."""
+
+    __slots__ = ("count", "total")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, value, sign):
+        self.count += sign
+        self.total += sign * value
+
+    def as_dict(self):
+        return {"count": self.count, "total": round(self.total, TOTAL_DIGITS)}
+
+
+def _month(element):
+    date = element.get("date")
+    return None if date is None else date[:7]
+
+
+class Summary:
+    """Aggregates of the entries of a pocket's tables. Not thread-safe; the
+    caller must synchronize modifications and reads.
+    """
+
+    def __init__(self):
+        self._tables = {name: _Bucket() for name in (DEFAULT_TABLE, RECURRENT_TABLE)}
+        self._categories = {
+            name: defaultdict(_Bucket) for name in (DEFAULT_TABLE, RECURRENT_TABLE)
+        }
+        self._months = defaultdict(_Bucket)
+
+    def add(self, table_name, element):
+        self._update(table_name, element, 1)
+
+    def remove(self, table_name, element):
+        self._update(table_name, element, -1)
+
+    def _update(self, table_name, element, sign):
+        value = element["value"]
+        self._tables[table_name].update(value, sign)
+
+        buckets = [(self._categories[table_name], element.get("category"))]
+        if table_name == DEFAULT_TABLE:
+            buckets.append((self._months, _month(element)))
+
+        for group, key in buckets:
+            group[key].update(value, sign)
+            if not group[key].count:
+                del group[key]
+
+    def _table_dict(self, table_name):
+        result = self._tables[table_name].as_dict()
+        result["categories"] = [
+            {"category": category, **b.as_dict()}
+            for category, b in sorted(
+                self._categories[table_name].items(),
+                key=lambda item: (item[0] is not None, item[0] or ""),
+            )
+        ]
+        return result
+
+    def as_dict(self):
+        """Return the summary in JSON-serializable form. Categories and months
+        are sorted; the default category (None) comes first. The aggregates of
+        the recurrent table are nested under 'templates' since they refer to the
+        stored entries, not to their occurrences.
+        """
+        standard = self._table_dict(DEFAULT_TABLE)
+        standard["months"] = [
+            {"month": month, **b.as_dict()}
+            for month, b in sorted(self._months.items(), key=lambda item: item[0] or "")
+        ]
+        return {
+            DEFAULT_TABLE: standard,
+            RECURRENT_TABLE: {"templates": self._table_dict(RECURRENT_TABLE)},
+        }
+
+
+class SummaryMixin:
+    """Mixin for pocket classes to maintain a summary of their entries. The
+    summary is created on first access to 'summary()'; afterwards it is updated
+    when adding, updating, or removing entries.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._summary = None
+        self._summary_lock = threading.Lock()
+
+    def summary(self):
+        """Return the summary of the pocket's entries (see 'Summary.as_dict()').
+
+        :return: dict
+        """
+        with self._summary_lock:
+            if self._summary is None:
+                summary = Summary()
+                for table_name in (DEFAULT_TABLE, RECURRENT_TABLE):
+                    for element in self._summarized_documents(table_name):
+                        summary.add(table_name, element)
+                self._summary = summary
+
+            return self._summary.as_dict()
+
+    def _summarized_documents(self, table_name):
+        """Return all documents of the table, to create the summary from."""
+        return self._db.table(table_name).all()
+
+    def add_entry(self, table_name=None, **kwargs):
+        eid = super().add_entry(table_name=table_name, **kwargs)
+
+        if self._summary is not None:
+            table_name = table_name or DEFAULT_TABLE
+            self._summary.add(table_name, self.get_entry(eid, table_name=table_name))
+        return eid
+
+    def update_entry(self, eid, table_name=None, **kwargs):
+        if self._summary is None:
+            return super().update_entry(eid, table_name=table_name, **kwargs)
+
+        table_name = table_name or DEFAULT_TABLE
+        try:
+            old_element = self.get_entry(eid, table_name=table_name)
+        except exceptions.PocketEntryNotFound:
+            # Let the pocket report invalid data before the missing entry
+            return super().update_entry(eid, table_name=table_name, **kwargs)
+
+        eid = super().update_entry(eid, table_name=table_name, **kwargs)
+
+        self._summary.remove(table_name, old_element)
+        self._summary.add(table_name, self.get_entry(eid, table_name=table_name))
+        return eid
+
+    def remove_entry(self, eid, table_name=None):
+        if self._summary is None:
+            return super().remove_entry(eid, table_name=table_name)
+
+        table_name = table_name or DEFAULT_TABLE
+        element = self.get_entry(eid, table_name=table_name)
+        eid = super().remove_entry(eid, table_name=table_name)
+
+        self._summary.remove(table_name, element)
+        return eid
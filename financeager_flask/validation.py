@@ -0,0 +1,87 @@
+"""Validation of request payloads.
+
+'RequestSchema' is a lightweight replacement for 'flask_restful.reqparse'
+parsers whose arguments are looked up in the JSON body, the form data, and the
+query string (the default locations of reqparse). The fields and their
+converters are compiled once; parsing a request is a single pass over them.
+Parsed values and error responses (400 with a message per argument) are the
+same as those of reqparse.
+"""
+import flask
+import flask_restful
+from flask_restful.reqparse import Namespace
+
+MISSING_MESSAGE = (
+    "Missing required parameter in the JSON body or the post body or the query "
+    "string"
+)
+
+
+class RequestSchema:
+    """Schema of request arguments, supporting the subset of the
+    'reqparse.RequestParser' interface used by the resources.
+    """
+
+    def __init__(self):
+        self._fields = ()
+
+    def add_argument(self, name, required=False, type=str):
+        """Add an argument. 'type' is a callable converting the raw value, and
+        raising an exception if that's impossible.
+        """
+        self._fields += ((name, type, required),)
+        return self
+
+    def parse_args(self, req=None):
+        """Parse the arguments of the given request (default: the current flask
+        request). Arguments present in the JSON body take precedence over those
+        in the form data or query string. Absent arguments are None.
+
+        :return: reqparse.Namespace
+        :raise: werkzeug.exceptions.HTTPException with code 400 if a required
+            argument is missing, or an argument can't be converted
+        """
+        if req is None:
+            req = flask.request
+
+        body = req.json
+        if body is not None and not isinstance(body, dict):
+            flask_restful.abort(400, message="JSON body must be an object.")
+        return self._parse(body, req.values)
+
+    def parse(self, data):
+        """Parse the arguments given as dict (e.g. a row of an uploaded file).
+        Errors are reported as by 'parse_args()'.
+
+        :return: reqparse.Namespace
+        :raise: werkzeug.exceptions.HTTPException with code 400
+        """
+        return self._parse(data, {})
+
+    def _parse(self, body, values):
+        namespace = Namespace()
+        for name, convert, required in self._fields:
+            raw_values = []
+            if body is not None and name in body:
+                value = body[name]
+                if isinstance(value, list):
+                    raw_values.extend(value)
+                else:
+                    raw_values.append(value)
+            if name in values:
+                raw_values.extend(values.getlist(name))
+
+            if not raw_values:
+                if required:
+                    flask_restful.abort(400, message={name: MISSING_MESSAGE})
+                namespace[name] = None
+                continue
+
+            try:
+                # All values are validated; the first one is used
+                converted = [None if v is None else convert(v) for v in raw_values]
+            except Exception as e:
+                flask_restful.abort(400, message={name: str(e)})
+            namespace[name] = converted[0]
+
+        return namespace
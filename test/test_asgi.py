@@ -0,0 +1,287 @@
+import asyncio
+import gzip
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from financeager_flask import asgi
+from financeager_flask.flask import create_app as create_flask_app
+
+# Patch DATA_DIR to avoid having it created/interfering with logs on actual
+# machine
+TEST_DATA_DIR = tempfile.mkdtemp(prefix="financeager-")
+
+
+def request(app, method, path, body=None, headers=None, query_string=b""):
+    """Send a request to the ASGI app, and return status, headers (lowercase
+    names), and body of the response."""
+    if body is None:
+        body = b""
+    elif not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+        headers = dict({"Content-Type": "application/json"}, **(headers or {}))
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [
+            (k.lower().encode(), v.encode()) for k, v in (headers or {}).items()
+        ],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+
+    start = messages[0]
+    response_headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    response_body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], response_headers, response_body
+
+
+@mock.patch("financeager.DATA_DIR", TEST_DATA_DIR)
+class AsgiAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = asgi.create_app()
+        self.flask_client = create_flask_app().test_client()
+
+    def tearDown(self):
+        self.app.close()
+
+    def assert_same_response(self, method, path, body=None, query_string=b""):
+        status, _, content = request(
+            self.app, method, path, body=body, query_string=query_string
+        )
+        flask_response = self.flask_client.open(
+            path, method=method, json=body, query_string=query_string
+        )
+        self.assertEqual(status, flask_response.status_code)
+        self.assertEqual(content, flask_response.data)
+
+    def test_version(self):
+        status, headers, content = request(self.app, "GET", "/version")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "application/json")
+        self.assertIn("financeager_version", json.loads(content))
+
+    def test_add_get_list(self):
+        status, _, content = request(
+            self.app, "POST", "/pockets/2000", {"name": "bread", "value": -2}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content), {"id": 1})
+
+        status, headers, content = request(self.app, "GET", "/pockets/2000/standard/1")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content)["element"]["name"], "bread")
+
+        status, headers, content = request(self.app, "GET", "/pockets/2000")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(content)["elements"]["standard"]), 1)
+
+        etag = headers["etag"]
+        status, headers, content = request(
+            self.app, "GET", "/pockets/2000", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(status, 304)
+        self.assertEqual(headers["etag"], etag)
+        self.assertEqual(content, b"")
+
+        status, _, _ = request(
+            self.app, "PATCH", "/pockets/2000/standard/1", {"value": -3}
+        )
+        self.assertEqual(status, 200)
+        status, _, _ = request(
+            self.app, "GET", "/pockets/2000", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(status, 200)
+
+        status, _, content = request(
+            self.app,
+            "POST",
+            "/copy",
+            {"source_pocket": "2000", "destination_pocket": "2001", "eid": 1},
+        )
+        self.assertEqual(status, 200)
+        status, _, content = request(self.app, "DELETE", "/pockets/2000/standard/1")
+        self.assertEqual(status, 200)
+        status, _, content = request(self.app, "POST", "/pockets")
+        self.assertEqual(json.loads(content), {"pockets": ["2000", "2001"]})
+
+    def test_errors(self):
+        self.assert_same_response("GET", "/unknown")
+        self.assert_same_response("DELETE", "/pockets/2000")
+        self.assert_same_response("POST", "/pockets/2000", {"value": 1})
+        self.assert_same_response("POST", "/pockets/2000", [1])
+        self.assert_same_response("POST", "/pockets/2000", {"name": "a", "value": "b"})
+        self.assert_same_response("GET", "/pockets/2000", query_string=b"limit=0")
+        self.assert_same_response(
+            "GET", "/pockets/2000", query_string=b"recurrent_only=maybe"
+        )
+        self.assert_same_response("GET", "/pockets/2000/standard/1")
+        self.assert_same_response("GET", "/pockets/2000/unknown/1")
+        self.assert_same_response("DELETE", "/pockets/2000/standard/x")
+
+        status, headers, _ = request(self.app, "DELETE", "/pockets/2000")
+        self.assertEqual(headers["allow"], "GET, HEAD, OPTIONS, POST")
+
+        status, _, content = request(
+            self.app,
+            "POST",
+            "/pockets/2000",
+            b"{",
+            headers={"Content-Type": "application/json"},
+        )
+        self.assertEqual(status, 400)
+
+    def test_options_and_head(self):
+        status, headers, _ = request(self.app, "OPTIONS", "/version")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["allow"], "GET, HEAD, OPTIONS")
+
+        status, headers, content = request(self.app, "HEAD", "/version")
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers["content-length"], "0")
+        self.assertEqual(content, b"")
+
+    def test_stream(self):
+        for i in range(2 * asgi.STREAM_CHUNK_SIZE + 1):
+            self.app.server.run("add", pocket="2000", name=f"entry {i}", value=i)
+
+        status, headers, content = request(
+            self.app, "GET", "/pockets/2000", headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(lines), 2 * asgi.STREAM_CHUNK_SIZE + 1)
+        self.assertEqual(lines[0]["element"]["name"], "entry 0")
+
+        status, _, content = request(
+            self.app,
+            "GET",
+            "/pockets/2000",
+            headers={
+                "Accept": "application/x-ndjson",
+                "If-None-Match": headers["etag"],
+            },
+        )
+        self.assertEqual(status, 304)
+
+    def test_compression(self):
+        body = gzip.compress(json.dumps({"name": "bread", "value": -2}).encode())
+        status, _, _ = request(
+            self.app,
+            "POST",
+            "/pockets/2000",
+            body,
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        self.assertEqual(status, 200)
+
+        for i in range(50):
+            self.app.server.run("add", pocket="2000", name=f"entry {i}", value=i)
+        status, headers, content = request(
+            self.app, "GET", "/pockets/2000", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        elements = json.loads(gzip.decompress(content))["elements"]
+        self.assertEqual(len(elements["standard"]), 51)
+
+    def test_decompressed_size_limited(self):
+        app = asgi.create_app(config={"MAX_DECOMPRESSED_SIZE": 1000})
+        status, _, _ = request(
+            app,
+            "POST",
+            "/pockets/2000",
+            gzip.compress(b" " * 10000 + b"{}"),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+        )
+        self.assertEqual(status, 413)
+        app.close()
+
+
+@mock.patch("financeager.DATA_DIR", TEST_DATA_DIR)
+class BackpressureTestCase(unittest.TestCase):
+    def test_saturated(self):
+        app = asgi.create_app(
+            config={"MAX_WORKERS": 1, "MAX_QUEUE_DEPTH": 0, "RETRY_AFTER": 3}
+        )
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_run(command, **kwargs):
+            started.set()
+            release.wait()
+            return {"pockets": []}
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            with mock.patch.object(app.server, "run", side_effect=blocking_run):
+                blocked = loop.run_in_executor(None, request, app, "POST", "/pockets")
+                await loop.run_in_executor(None, started.wait)
+                self.assertEqual(app.executor.queue_depth, 0)
+                rejected = await loop.run_in_executor(
+                    None, request, app, "POST", "/pockets"
+                )
+                release.set()
+                return await blocked, rejected
+
+        (status, _, _), (rejected_status, headers, content) = asyncio.run(main())
+        self.assertEqual(status, 200)
+        self.assertEqual(rejected_status, 503)
+        self.assertEqual(headers["retry-after"], "3")
+        self.assertIn("error", json.loads(content))
+        app.close()
+
+    def test_executor_queue(self):
+        executor = asgi.BoundedExecutor(max_workers=1, max_queue_depth=1)
+        release = threading.Event()
+
+        async def main():
+            first = asyncio.ensure_future(executor.run(release.wait))
+            second = asyncio.ensure_future(executor.run(lambda: 2))
+            await asyncio.sleep(0)
+            self.assertEqual(executor.queue_depth, 1)
+            with self.assertRaises(asgi.Saturated):
+                await executor.run(lambda: 3)
+            # Unbounded functions are queued regardless
+            third = asyncio.ensure_future(executor.run(lambda: 3, bounded=False))
+            await asyncio.sleep(0)
+            release.set()
+            return await asyncio.gather(first, second, third)
+
+        self.assertEqual(asyncio.run(main()), [True, 2, 3])
+        executor.shutdown()
+
+    def test_lifespan(self):
+        app = asgi.create_app()
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        with mock.patch.object(app.server, "run") as mocked_run:
+            asyncio.run(app({"type": "lifespan"}, receive, send))
+        mocked_run.assert_called_once_with("stop")
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
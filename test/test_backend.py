@@ -0,0 +1,579 @@
+import gc
+import json
+import multiprocessing
+import os.path
+import tempfile
+import threading
+import unittest
+import weakref
+from unittest import mock
+
+from financeager import exceptions
+from tinydb import storages
+
+from financeager_flask import cache
+from financeager_flask.backend import (
+    JSON_ENGINE,
+    SQLITE_ENGINE,
+    Server,
+    deferred_writes,
+)
+
+
+class ServerBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(data_dir=tempfile.mkdtemp(prefix="financeager-"))
+
+    def tearDown(self):
+        self.server.run("stop")
+
+    def test_batch(self):
+        operations = [
+            {"command": "add", "name": "bread", "value": -2, "date": "2020-01-01"},
+            {"command": "add", "name": "rent", "value": -500, "frequency": "monthly"},
+            {"command": "update", "eid": 1, "name": "beer"},
+            {"command": "remove", "eid": 1},
+            {"command": "remove", "eid": 1},
+            {"command": "add", "name": "", "value": 1},
+            {"command": "update", "name": "foo"},
+            {"command": "list"},
+            5,
+            {"command": "add", "name": "bread", "value": -2, "pd": None},
+            {"command": "remove", "eid": "a"},
+            {"command": "remove", "eid": 2, "name": "rent"},
+        ]
+        with mock.patch.object(
+            storages.JSONStorage, "write", autospec=True
+        ) as mocked_write:
+            response = self.server.run("batch", pocket="2020", operations=operations)
+        # All operations are persisted at once
+        mocked_write.assert_called_once()
+
+        results = response["results"]
+        self.assertEqual(len(results), len(operations))
+        self.assertEqual(results[:4], [{"id": 1}, {"id": 2}, {"id": 1}, {"id": 1}])
+        self.assertIsInstance(results[4]["error"], exceptions.PocketEntryNotFound)
+        for result in results[5:]:
+            self.assertIsInstance(result["error"], exceptions.PocketValidationFailure)
+        self.assertEqual(
+            [str(r["error"]) for r in results[6:7] + results[10:]],
+            [
+                "Server: batch command 'update' requires field 'eid'",
+                "Server: field 'eid' must be an integer",
+                "Server: unexpected fields of batch command 'remove': name",
+            ],
+        )
+
+    def test_batch_persisted(self):
+        operations = [{"command": "add", "name": "bread", "value": -2}] * 3
+        self.server.run("batch", pocket="2020", operations=operations)
+
+        # Data is read from file by new server
+        self.server.run("stop")
+        self.server = Server(**self.server._pocket_kwargs)
+        response = self.server.run("list", pocket="2020")
+        self.assertEqual(len(response["elements"]["standard"]), 3)
+
+    def test_import(self):
+        # Summary is maintained, and categories are derived from earlier entries
+        self.server.run("summary", pocket="2020")
+        self.server.run("add", pocket="2020", name="rent", value=-500)
+        entries = [
+            {"name": "bread", "value": -2, "category": "food", "date": "2020-01-01"},
+            {"name": "rent", "value": -500, "frequency": "monthly"},
+            {"name": "rent", "value": -500, "table_name": "recurrent"},
+            {"name": "bread", "value": -3, "date": "2020-01-02"},
+            {"name": "", "value": 1},
+            {"name": "beer", "value": 1, "table_name": "unknown"},
+            {"name": "beer"},
+            {
+                "name": "rent",
+                "value": -600,
+                "frequency": "monthly",
+                "table_name": "recurrent",
+            },
+        ]
+        with mock.patch.object(
+            storages.JSONStorage, "write", autospec=True
+        ) as mocked_write:
+            response = self.server.run("import", pocket="2020", entries=entries)
+        mocked_write.assert_called_once()
+
+        results = response["results"]
+        self.assertEqual(results[:2], [{"id": 2}, {"id": 3}])
+        self.assertEqual(results[3], {"id": 4})
+        self.assertEqual(results[7], {"id": 1})
+        for result in results[2:3] + results[4:7]:
+            self.assertIsInstance(result["error"], exceptions.PocketValidationFailure)
+
+        element = self.server.run("get", pocket="2020", eid=4)["element"]
+        self.assertEqual(element["category"], "food")
+        summary = self.server.run("summary", pocket="2020")["summary"]
+        self.assertEqual(summary["standard"]["count"], 4)
+        self.assertEqual(summary["recurrent"]["templates"]["count"], 1)
+
+        # Same results as for adding the entries one by one
+        server = Server()
+        server.run("add", pocket="2020", name="rent", value=-500)
+        for entry, result in zip(entries, results):
+            response = server.run("add", pocket="2020", **entry)
+            self.assertEqual(response.get("id"), result.get("id"))
+        self.assertEqual(
+            server.run("list", pocket="2020"), self.server.run("list", pocket="2020")
+        )
+
+    def test_export_entries(self):
+        self.server.run(
+            "add",
+            pocket="2020",
+            name="rent",
+            value=-500,
+            frequency="monthly",
+            table_name="recurrent",
+        )
+        self.server.run("add", pocket="2020", name="bread", value=-2)
+        entries = self.server.export_entries(pocket="2020")
+
+        # Entries are taken from a snapshot
+        self.server.run("remove", pocket="2020", eid=1)
+        entries = list(entries)
+        self.assertEqual([e[:2] for e in entries], [("standard", 1), ("recurrent", 1)])
+        self.assertEqual(entries[1][2]["frequency"], "monthly")
+
+    def test_pocket_revision(self):
+        revision = self.server.pocket_revision("2020")
+        self.server.run("list", pocket="2020")
+        self.assertEqual(self.server.pocket_revision("2020"), revision)
+
+        self.server.run("add", pocket="2020", name="bread", value=-2)
+        self.assertNotEqual(self.server.pocket_revision("2020"), revision)
+
+        revision = self.server.pocket_revision("2021")
+        self.server.run("copy", source_pocket="2020", destination_pocket="2021", eid=1)
+        self.assertNotEqual(self.server.pocket_revision("2021"), revision)
+
+        # Revisions differ between server instances
+        self.assertNotEqual(
+            Server().pocket_revision("2021"), self.server.pocket_revision("2021")
+        )
+
+    def test_list_pages(self):
+        for name in ["a", "b", "c"]:
+            self.server.run("add", pocket="2020", name=name, value=1)
+        self.server.run(
+            "add",
+            pocket="2020",
+            name="rent",
+            value=-500,
+            frequency="monthly",
+            start="2020-01-01",
+            end="2020-03-31",
+            table_name="recurrent",
+        )
+
+        response = self.server.run("list", pocket="2020", limit=2)
+        self.assertEqual(list(response["elements"]["standard"]), [1, 2])
+        self.assertEqual(response["elements"]["recurrent"], {})
+        self.assertEqual(response["next_cursor"], "standard:2")
+
+        response = self.server.run(
+            "list", pocket="2020", limit=2, cursor=response["next_cursor"]
+        )
+        self.assertEqual(list(response["elements"]["standard"]), [3])
+        # All generated elements of a recurrent entry are part of the page
+        self.assertEqual(len(response["elements"]["recurrent"][1]), 3)
+        self.assertIsNone(response["next_cursor"])
+
+        response = self.server.run(
+            "list", pocket="2020", cursor="standard:1", filters={"name": "c"}
+        )
+        self.assertEqual(list(response["elements"]["standard"]), [3])
+
+        response = self.server.run("list", pocket="2020", limit=1, recurrent_only=True)
+        self.assertEqual(response["elements"][0]["eid"], 1)
+        self.assertIsNone(response["next_cursor"])
+
+    def test_list_pages_invalid(self):
+        for kwargs in [{"cursor": "foo:1"}, {"cursor": "standard"}, {"limit": 0}]:
+            response = self.server.run("list", pocket="2020", **kwargs)
+            self.assertIsInstance(response["error"], exceptions.PocketValidationFailure)
+
+    def test_iter_entries(self):
+        for name in ["a", "b", "c"]:
+            self.server.run("add", pocket="2020", name=name, value=1)
+
+        entries = self.server.iter_entries(pocket="2020", cursor="standard:1", limit=1)
+        self.assertEqual([(t, e) for t, e, _ in entries], [("standard", 2)])
+
+    def test_aggregate(self):
+        for pocket in ["2019", "2020", "2021"]:
+            self.server.run("add", pocket=pocket, name="bread", value=-2)
+        self.server.run("add", pocket="2020", name="rent", value=-500)
+
+        response = self.server.run("aggregate", filters={"name": "rent"})
+        pockets = response["pockets"]
+        self.assertEqual(list(pockets), ["2019", "2020", "2021"])
+        self.assertEqual(pockets["2019"]["standard"], {})
+        self.assertEqual(pockets["2020"]["standard"][2]["name"], "rent")
+
+        response = self.server.run(
+            "aggregate", pockets=["2021", "2019"], recurrent_only=True
+        )
+        self.assertEqual(response["pockets"], {"2019": [], "2021": []})
+
+        response = self.server.run("aggregate", pockets=["2020", "1999"])
+        self.assertIsInstance(response["error"], exceptions.PocketValidationFailure)
+        response = self.server.run("aggregate", filters={"value": "foo"})
+        self.assertIsInstance(response["error"], exceptions.PocketValidationFailure)
+
+    def test_concurrent_access(self):
+        def add(name):
+            for _ in range(20):
+                self.server.run("add", pocket="2020", name=name, value=-1)
+
+        def list_entries():
+            for _ in range(20):
+                response = self.server.run("list", pocket="2020")
+                self.assertNotIn("error", response)
+
+        threads = [threading.Thread(target=add, args=(n,)) for n in "abcd"]
+        threads += [threading.Thread(target=list_entries) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # No write is lost
+        self.server.run("stop")
+        self.server = Server(**self.server._pocket_kwargs)
+        response = self.server.run("list", pocket="2020")
+        self.assertEqual(len(response["elements"]["standard"]), 80)
+
+    def test_pocket_names_locked(self):
+        server = self.server
+        self.server.run("add", pocket="2020", name="bread", value=-2)
+
+        class Pockets(dict):
+            def __iter__(self):
+                # Concurrent loading of pockets is prevented while iterating
+                assert server._pockets_lock.locked()
+                return super().__iter__()
+
+            def values(self):
+                assert server._pockets_lock.locked()
+                return super().values()
+
+        for engine in [JSON_ENGINE, SQLITE_ENGINE]:
+            with self.subTest(engine=engine), mock.patch.object(
+                server, "_storage_engine", engine
+            ):
+                server._pockets = Pockets(server._pockets)
+                self.assertEqual(server.run("pockets"), {"pockets": ["2020"]})
+                server._pockets = dict(server._pockets)
+
+    def test_iter_entries_snapshot(self):
+        server = Server()
+        server.run("add", pocket="2020", name="bread", value=-2)
+        entries = server.iter_entries(pocket="2020")
+
+        # Iterating does not lock the pocket, and yields the state at creation
+        server.run("add", pocket="2020", name="beer", value=-3)
+        server.run("update", pocket="2020", eid=1, name="rolls")
+        self.assertEqual([e["name"] for _, _, e in entries], ["bread"])
+
+    def test_deferred_writes_on_error(self):
+        pd = self.server._get_pocket("2020")
+        with self.assertRaises(RuntimeError):
+            with deferred_writes(pd):
+                pd.add_entry(name="bread", value=-2)
+                raise RuntimeError
+
+        # Storage methods are restored, and the data written
+        self.assertNotIn("read", vars(pd._db.storage))
+        self.assertEqual(len(pd._db.storage.read()["standard"]), 1)
+
+
+class CachingServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+
+    def stored_entries(self, name):
+        with open(os.path.join(self.data_dir, f"{name}.json")) as file:
+            return json.loads(file.read() or "{}").get("standard", {})
+
+    def test_invalid_config(self):
+        self.assertRaises(ValueError, Server, cache_mode="foo")
+        self.assertRaises(
+            ValueError,
+            Server,
+            data_dir=self.data_dir,
+            multiprocess=True,
+            cache_mode=cache.WRITE_BEHIND,
+        )
+
+    def test_stopped_server_released(self):
+        server = Server(data_dir=self.data_dir, cache_mode=cache.WRITE_BEHIND)
+        server.run("add", pocket="2020", name="bread", value=-2)
+        server.run("stop")
+        self.assertEqual(len(self.stored_entries("2020")), 1)
+
+        # Server isn't referenced by the shutdown hook anymore
+        reference = weakref.ref(server)
+        del server
+        gc.collect()
+        self.assertIsNone(reference())
+
+    @mock.patch("financeager_flask.cache.install_shutdown_hook")
+    def test_write_behind(self, mocked_install):
+        server = Server(
+            data_dir=self.data_dir,
+            cache_mode=cache.WRITE_BEHIND,
+            flush_interval=60,
+            flush_threshold=3,
+        )
+        mocked_install.assert_called_once_with(server.flush)
+
+        server.run("add", pocket="2020", name="bread", value=-2)
+        server.run("add", pocket="2020", name="beer", value=-3)
+        self.assertEqual(self.stored_entries("2020"), {})
+        response = server.run("list", pocket="2020")
+        self.assertEqual(len(response["elements"]["standard"]), 2)
+
+        # Threshold reached
+        server.run("add", pocket="2020", name="rolls", value=-1)
+        self.assertEqual(len(self.stored_entries("2020")), 3)
+
+        server.run("remove", pocket="2020", eid=1)
+        server.flush()
+        self.assertEqual(len(self.stored_entries("2020")), 2)
+
+        server.run("remove", pocket="2020", eid=2)
+        server.run("stop")
+        self.assertEqual(len(self.stored_entries("2020")), 1)
+        self.assertFalse(server._flusher.is_alive())
+
+    def test_memory_budget(self):
+        server = Server(data_dir=self.data_dir, memory_budget=1)
+        for name in ["2019", "2020", "2021"]:
+            server.run("add", pocket=name, name="bread", value=-2)
+
+        # Only the most recently used pocket is kept in memory
+        self.assertEqual(list(server._pockets), ["2021"])
+        response = server.run("list", pocket="2019")
+        self.assertEqual(len(response["elements"]["standard"]), 1)
+        self.assertEqual(list(server._pockets), ["2019"])
+        server.run("stop")
+
+
+def _add_entries(data_dir, name, count):
+    server = Server(data_dir=data_dir, multiprocess=True)
+    for _ in range(count):
+        server.run("add", pocket="2020", name=name, value=-1)
+    server.run("stop")
+
+
+class MultiprocessServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+        self.servers = [
+            Server(data_dir=self.data_dir, multiprocess=True) for _ in range(2)
+        ]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.run("stop")
+
+    def test_no_data_dir(self):
+        self.assertRaises(ValueError, Server, multiprocess=True)
+
+    def test_changes_detected(self):
+        first, second = self.servers
+        first.run("add", pocket="2020", name="bread", value=-2)
+        response = second.run("list", pocket="2020")
+        self.assertEqual(len(response["elements"]["standard"]), 1)
+
+        # IDs don't collide, and category cache is up to date
+        response = second.run("add", pocket="2020", name="beer", value=-3)
+        self.assertEqual(response["id"], 2)
+        first.run("update", pocket="2020", eid=2, category="fun")
+        second.run("add", pocket="2020", name="beer", value=-3)
+        response = first.run("list", pocket="2020")
+        self.assertEqual(response["elements"]["standard"][3]["category"], "fun")
+
+    def test_pocket_revision(self):
+        first, second = self.servers
+        revision = first.pocket_revision("2020")
+        self.assertEqual(second.pocket_revision("2020"), revision)
+
+        first.run("list", pocket="2020")
+        self.assertEqual(second.pocket_revision("2020"), revision)
+
+        second.run("add", pocket="2020", name="bread", value=-2)
+        self.assertNotEqual(first.pocket_revision("2020"), revision)
+        self.assertEqual(first.pocket_revision("2020"), second.pocket_revision("2020"))
+
+    def test_reload_waits_for_readers(self):
+        # Closing an SQLite pocket closes the connections of all threads
+        second = Server(
+            data_dir=self.data_dir, multiprocess=True, storage_engine=SQLITE_ENGINE
+        )
+        self.servers.append(second)
+        second.run("add", pocket="2020", name="bread", value=-2)
+        pd = second._get_pocket("2020")
+        entered = threading.Event()
+        release = threading.Event()
+        names = []
+
+        def read():
+            with second._pocket_locked("2020"):
+                entered.set()
+                release.wait()
+                names.append(pd.get_entry(eid=1)["name"])
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        entered.wait()
+
+        # Simulate modification by other process; reloading waits for the reader
+        with open(second._lock_filepath("2020"), "w") as file:
+            file.write("modified")
+        lister = threading.Thread(
+            target=second.run, args=("list",), kwargs={"pocket": "2020"}
+        )
+        lister.start()
+        lister.join(0.1)
+        waiting = lister.is_alive()
+
+        release.set()
+        reader.join()
+        lister.join()
+        self.assertTrue(waiting)
+        self.assertEqual(names, ["bread"])
+        self.assertIsNot(second._get_pocket("2020"), pd)
+
+    def test_concurrent_processes(self):
+        processes = [
+            multiprocessing.Process(target=_add_entries, args=(self.data_dir, name, 10))
+            for name in "abc"
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        response = self.servers[0].run("list", pocket="2020")
+        self.assertEqual(len(response["elements"]["standard"]), 30)
+
+
+class SnapshotServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+        self.snapshot_dir = os.path.join(self.data_dir, "snapshots")
+
+    def create_server(self, storage_engine, **kwargs):
+        with mock.patch("financeager_flask.cache.install_shutdown_hook"):
+            return Server(
+                data_dir=self.data_dir, storage_engine=storage_engine, **kwargs
+            )
+
+    def fill(self, server):
+        server.run("add", pocket="2020", name="bread", value=-2, category="food")
+        server.run(
+            "add",
+            pocket="2020",
+            table_name="recurrent",
+            name="rent",
+            value=-500,
+            frequency="monthly",
+            start="2020-01-01",
+            end="2020-12-31",
+        )
+        server.run("add", pocket="2021", name="beer", value=-3)
+
+    def test_no_data_dir(self):
+        self.assertRaises(ValueError, Server, snapshot_dir=self.snapshot_dir)
+
+    def test_lazy_category_cache(self):
+        server = self.create_server(JSON_ENGINE)
+        self.fill(server)
+        server.run("stop")
+
+        server = self.create_server(JSON_ENGINE)
+        pd = server._get_pocket("2020")
+        self.assertIsNone(pd._lazy_category_cache)
+        response = server.run("add", pocket="2020", name="bread", value=-1)
+        response = server.run("get", pocket="2020", eid=response["id"])
+        self.assertEqual(response["element"]["category"], "food")
+        server.run("stop")
+
+    def test_preload(self):
+        server = self.create_server(JSON_ENGINE)
+        self.fill(server)
+        server.run("stop")
+
+        server = self.create_server(JSON_ENGINE)
+        server.preload()
+        self.assertEqual(sorted(server._pockets), ["2020", "2021"])
+        pd = server._pockets["2020"]
+        self.assertIsNotNone(pd._summary)
+        self.assertIsNotNone(pd._lazy_category_cache)
+        self.assertEqual(pd.recurrent_cache_stats()["size"], 1)
+        server.run("stop")
+
+    def assert_restored(self, storage_engine):
+        server = self.create_server(storage_engine, snapshot_dir=self.snapshot_dir)
+        self.fill(server)
+        expected = server.run("list", pocket="2020")
+        summary = server.run("summary", pocket="2020")
+        server.run("stop")
+        self.assertEqual(
+            sorted(os.listdir(self.snapshot_dir)),
+            ["2020.snapshot", "2021.snapshot"],
+        )
+
+        server = self.create_server(storage_engine, snapshot_dir=self.snapshot_dir)
+        pd = server._get_pocket("2020")
+        self.assertIsNotNone(pd._summary)
+        self.assertIsNotNone(pd._lazy_category_cache)
+        self.assertEqual(server.run("list", pocket="2020"), expected)
+        self.assertEqual(server.run("summary", pocket="2020"), summary)
+        self.assertEqual(
+            server.run("stats")["recurrent_cache"], {"hits": 1, "misses": 0, "size": 1}
+        )
+
+        # Modifications are taken into account
+        server.run("add", pocket="2020", name="bread", value=-1)
+        response = server.run("summary", pocket="2020")
+        self.assertEqual(response["summary"]["standard"]["count"], 2)
+        server.run("stop")
+
+        # Outdated snapshots are ignored
+        server = self.create_server(storage_engine)
+        server.run("remove", pocket="2020", eid=1)
+        server.run("stop")
+        server = self.create_server(storage_engine, snapshot_dir=self.snapshot_dir)
+        pd = server._get_pocket("2020")
+        self.assertIsNone(pd._summary)
+        response = server.run("list", pocket="2020")
+        self.assertEqual(list(response["elements"]["standard"]), [2])
+        server.run("stop")
+
+    def test_json_snapshots(self):
+        self.assert_restored(JSON_ENGINE)
+
+    def test_sqlite_snapshots(self):
+        self.assert_restored(SQLITE_ENGINE)
+
+    def test_invalid_snapshot(self):
+        os.makedirs(self.snapshot_dir)
+        with open(os.path.join(self.snapshot_dir, "2020.snapshot"), "w") as file:
+            file.write("foo")
+
+        server = self.create_server(JSON_ENGINE, snapshot_dir=self.snapshot_dir)
+        response = server.run("list", pocket="2020")
+        self.assertEqual(response["elements"]["standard"], {})
+        server.run("stop")
+
+
+if __name__ == "__main__":
+    unittest.main()
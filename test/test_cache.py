@@ -0,0 +1,69 @@
+import os.path
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from tinydb import storages
+
+from financeager_flask.cache import CachingStorage, Flusher
+
+
+class CachingStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.filepath = os.path.join(tempfile.mkdtemp(), "2020.json")
+
+    def storage(self, **kwargs):
+        return CachingStorage(storages.JSONStorage(self.filepath), **kwargs)
+
+    def stored(self):
+        storage = storages.JSONStorage(self.filepath)
+        try:
+            return storage.read()
+        finally:
+            storage.close()
+
+    def test_write_through(self):
+        storage = self.storage()
+        storage.write({"standard": {}})
+        self.assertEqual(self.stored(), {"standard": {}})
+        self.assertEqual(storage.dirty_writes, 0)
+        self.assertGreater(storage.size, 0)
+
+        with mock.patch.object(storages.JSONStorage, "read") as mocked_read:
+            self.assertEqual(storage.read(), {"standard": {}})
+        mocked_read.assert_not_called()
+        storage.close()
+
+    def test_write_behind(self):
+        storage = self.storage(write_behind=True, flush_threshold=3)
+        storage.write({"standard": {"1": {}}})
+        storage.write({"standard": {"1": {}, "2": {}}})
+        self.assertIsNone(self.stored())
+        self.assertEqual(storage.dirty_writes, 2)
+
+        storage.write({"standard": {}})
+        self.assertEqual(self.stored(), {"standard": {}})
+
+        storage.write({"standard": {"1": {}}})
+        storage.flush()
+        self.assertEqual(self.stored(), {"standard": {"1": {}}})
+
+        storage.write({"standard": {}})
+        storage.close()
+        self.assertEqual(self.stored(), {"standard": {}})
+
+
+class FlusherTestCase(unittest.TestCase):
+    def test_flush_periodically(self):
+        flushed = threading.Event()
+        flusher = Flusher(flushed.set, 0.01)
+        flusher.start()
+        self.assertTrue(flushed.wait(1))
+        flusher.stop()
+        flusher.join(1)
+        self.assertFalse(flusher.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
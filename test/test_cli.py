@@ -1,4 +1,7 @@
+import json
 import os
+import subprocess
+import sys
 import tempfile
 import time
 import unittest
@@ -14,12 +17,13 @@ from financeager import (
     config,
     setup_log_file_handler,
 )
-from requests import RequestException, Response
+from requests import RequestException, Response, Session
 from requests import get as requests_get
 
 from financeager_flask import flask, main, version
 
 TEST_CONFIG_FILEPATH = "/tmp/financeager-test-config"
+requests_session_get = Session.get
 TEST_DATA_DIR = tempfile.mkdtemp(prefix="financeager-")
 setup_log_file_handler(log_dir=TEST_DATA_DIR)
 
@@ -133,8 +137,9 @@ date_format = %%m-%%d
 
 [SERVICE:FLASK]
 host = http://{}
+cache_dir = {}
 """.format(
-        HOST_IP
+        HOST_IP, os.path.join(TEST_DATA_DIR, "cache")
     )
 
     @staticmethod
@@ -293,7 +298,7 @@ host = http://{}
         self.assertIn("404", response)
 
     def test_communication_error(self):
-        with mock.patch("requests.get") as mocked_get:
+        with mock.patch("requests.Session.get") as mocked_get:
             response = Response()
             response.status_code = 500
             mocked_get.return_value = response
@@ -305,7 +310,7 @@ host = http://{}
         os.path.join(TEST_DATA_DIR, "financeager-test-offline.json"),
     )
     def test_offline_feature(self):
-        with mock.patch("requests.post") as mocked_post:
+        with mock.patch("requests.Session.post") as mocked_post:
             # Try do add an item but provoke CommunicationError
             mocked_post.side_effect = RequestException("did not work")
 
@@ -345,13 +350,67 @@ host = http://{}
             self.info.call_args_list[0][0][0],
         )
         # Output from recovered add command
-        self.assertEqual({"id": 1}, self.info.call_args_list[1][0][0])
+        self.assertEqual(
+            "Recovered 'add' request (element 1).", self.info.call_args_list[1][0][0]
+        )
         self.assertEqual("Recovered offline backup.", self.info.call_args_list[2][0][0])
 
+    def test_list_cached(self):
+        self.cli_run("add rent -500")
+        with mock.patch(
+            "requests.Session.get", autospec=True, side_effect=requests_session_get
+        ) as mocked_get:
+            response = self.cli_run("list")
+            self.assertEqual(len(response["elements"][DEFAULT_TABLE]), 1)
+            self.assertNotIn("headers", mocked_get.call_args[1])
+
+            # Response is revalidated
+            self.assertEqual(self.cli_run("list"), response)
+            self.assertIn("If-None-Match", mocked_get.call_args[1]["headers"])
+
+        self.cli_run("add bread -2")
+        response = self.cli_run("list")
+        self.assertEqual(len(response["elements"][DEFAULT_TABLE]), 2)
+
     def test_web_version(self):
         response = self.cli_run("web-version")
         self.assertIn(version(), response)
 
+    def test_import(self):
+        filepath = os.path.join(TEST_DATA_DIR, "import.csv")
+        with open(filepath, "w") as file:
+            file.write("name,value,date\nbread,-2,2020-01-01\nbeer,foo,\n")
+
+        response = self.cli_run("import {}", format_args=filepath)
+        self.assertEqual(
+            response,
+            "Imported 1 entries, 1 failed.\n"
+            "Row 2: value: could not convert string to float: 'foo'",
+        )
+        response = self.cli_run("list")
+        self.assertEqual(len(response["elements"][DEFAULT_TABLE]), 1)
+
+        response = self.cli_run("import {} --format ndjson", format_args=filepath)
+        self.assertIn("0 entries, 3 failed", response)
+
+        response = self.cli_run("import /nonexisting.csv", log_method="error")
+        self.assertIn("Error reading file", response)
+
+    def test_export(self):
+        self.cli_run("add bread -2 -d 2020-01-01")
+        filepath = os.path.join(TEST_DATA_DIR, "export.csv")
+
+        response = self.cli_run("export {}", format_args=filepath)
+        self.assertIn(filepath, response)
+        with open(filepath) as file:
+            self.assertEqual(
+                file.read().splitlines()[1], "standard,1,bread,-2.0,,2020-01-01,,,"
+            )
+
+        self.cli_run("export {} --format ndjson", format_args=filepath)
+        with open(filepath) as file:
+            self.assertEqual(json.loads(file.read())["name"], "bread")
+
     def test_list_recurrent_only(self):
         self.cli_run("add rent -500 -f monthly")
         response = self.cli_run("list --recurrent-only")
@@ -359,5 +418,35 @@ host = http://{}
         self.assertEqual(response["elements"][0]["frequency"], "monthly")
 
 
+class StartupTestCase(unittest.TestCase):
+    def test_http_libraries_imported_lazily(self):
+        # Run in a fresh interpreter since the test process imports requests
+        code = "\n".join(
+            [
+                "import sys",
+                "from financeager import clients, config",
+                "from financeager_flask import main",
+                "plugin = main.main()",
+                "configuration = config.Configuration(plugins=[plugin])",
+                "client = main._Client(configuration=configuration,",
+                "    sinks=clients.Client.Sinks(print, print))",
+                "client.shutdown()",
+                "print(sorted({'requests', 'urllib3'} & set(sys.modules)))",
+            ]
+        )
+        output = subprocess.check_output([sys.executable, "-c", code], text=True)
+        self.assertEqual(output.strip(), "[]")
+
+    def test_proxy_created_on_first_use(self):
+        client = main._Client(
+            configuration=config.Configuration(plugins=[main.main()]),
+            sinks=clients.Client.Sinks(print, print),
+        )
+        self.assertIsNone(client._proxy)
+        proxy = client.proxy
+        self.assertIs(client.proxy, proxy)
+        client.shutdown()
+
+
 if __name__ == "__main__":
     unittest.main()
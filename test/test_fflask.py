@@ -1,10 +1,15 @@
+import gzip
+import json
+import os.path
 import tempfile
 import unittest
+import zlib
 from os import environ
 from unittest import mock
 
 import financeager
 
+from financeager_flask import compression
 from financeager_flask.flask import create_app
 
 # Patch DATA_DIR to avoid having it created/interfering with logs on actual
@@ -47,6 +52,535 @@ class CreateAppNoDataDirTestCase(unittest.TestCase):
         # Expect Bad Request due to missing data (name and value)
         self.assertEqual(response.status_code, 400)
 
+    def test_batch(self):
+        app = create_app()
+        app.testing = True
+        operations = [
+            {"command": "add", "name": "bread", "value": -2},
+            {"command": "remove", "eid": 2},
+            5,
+        ]
+        with app.test_client() as client:
+            response = client.post(
+                "/pockets/2000/batch", json={"operations": operations}
+            )
+            self.assertEqual(response.status_code, 200)
+            results = response.json["results"]
+            self.assertEqual(
+                results[:2],
+                [{"id": 1}, {"error": "Entry not found.", "status": 404}],
+            )
+            self.assertEqual(results[2]["status"], 400)
+
+            response = client.post("/pockets/2000/batch", json={})
+            self.assertEqual(response.status_code, 400)
+
+            for operations in ["abc", {"command": "add"}, 5]:
+                response = client.post(
+                    "/pockets/2000/batch", json={"operations": operations}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.json["message"], {"operations": "Expected JSON array."}
+                )
+
+            response = client.post(
+                "/pockets/2000/batch",
+                json={"operations": [{"command": "update", "name": "foo"}]},
+            )
+            self.assertEqual(
+                response.json["results"],
+                [
+                    {
+                        "error": "Server: batch command 'update' requires field 'eid'",
+                        "status": 400,
+                    }
+                ],
+            )
+
+    def test_aggregate(self):
+        app = create_app()
+        app.testing = True
+        with app.test_client() as client:
+            client.post("/pockets/2000", json={"name": "bread", "value": -2})
+            client.post("/pockets/2001", json={"name": "beer", "value": -3})
+
+            response = client.post("/aggregate", json={"filters": {"name": "beer"}})
+            self.assertEqual(response.status_code, 200)
+            pockets = response.json["pockets"]
+            self.assertEqual(pockets["2000"]["standard"], {})
+            self.assertEqual(pockets["2001"]["standard"]["1"]["name"], "beer")
+
+            response = client.post("/aggregate", json={"pockets": ["2000"]})
+            self.assertEqual(list(response.json["pockets"]), ["2000"])
+
+            response = client.post("/aggregate", json={"pockets": ["1999"]})
+            self.assertEqual(response.status_code, 400)
+
+    def test_list_filters(self):
+        app = create_app()
+        app.testing = True
+        with app.test_client() as client:
+            client.post("/pockets/2000", json={"name": "bread", "value": -2})
+            client.post(
+                "/pockets/2000", json={"name": "beer", "value": -3, "category": "fun"}
+            )
+
+            response = client.get("/pockets/2000?filter_name=b&filter_category=")
+            self.assertEqual(list(response.json["elements"]["standard"]), ["1"])
+
+            response = client.get("/pockets/2000?recurrent_only=true")
+            self.assertEqual(response.json["elements"], [])
+
+            response = client.get("/pockets/2000?filter_value=foo")
+            self.assertEqual(response.status_code, 400)
+
+            # Filters sent by older clients as JSON-encoded request body
+            response = client.get(
+                "/pockets/2000", json=json.dumps({"filters": {"category": "fun"}})
+            )
+            self.assertEqual(list(response.json["elements"]["standard"]), ["2"])
+
+            for body in ["not json", "[1]", json.dumps({"filters": [1]})]:
+                response = client.get("/pockets/2000", json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("Invalid request body", response.json["message"])
+
+    def test_summary(self):
+        app = create_app()
+        app.testing = True
+        with app.test_client() as client:
+            client.post("/pockets/2000", json={"name": "bread", "value": -2})
+            response = client.get("/pockets/2000/summary")
+            self.assertEqual(response.status_code, 200)
+            summary = response.json["summary"]
+            self.assertEqual(summary["standard"]["count"], 1)
+            self.assertEqual(summary["standard"]["total"], -2)
+
+            response = client.get(
+                "/pockets/2000/summary",
+                headers={"If-None-Match": response.headers["ETag"]},
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_stats(self):
+        app = create_app()
+        app.testing = True
+        with app.test_client() as client:
+            client.post(
+                "/pockets/2000",
+                json={
+                    "name": "rent",
+                    "value": -500,
+                    "table_name": "recurrent",
+                    "frequency": "monthly",
+                    "start": "2000-01-01",
+                },
+            )
+            client.get("/pockets/2000")
+            client.get("/pockets/2000?filter_name=rent")
+
+            response = client.get("/stats")
+            self.assertEqual(
+                response.json["recurrent_cache"], {"hits": 1, "misses": 1, "size": 1}
+            )
+
+    def test_conditional_get(self):
+        app = create_app()
+        app.testing = True
+        with app.test_client() as client:
+            response = client.get("/pockets/2000")
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+
+            response = client.get("/pockets/2000", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+
+            client.post("/pockets/2000", json={"name": "bread", "value": -2})
+            response = client.get("/pockets/2000", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+            response = client.get("/pockets/2000/standard/1")
+            self.assertEqual(response.status_code, 200)
+            response = client.get(
+                "/pockets/2000/standard/1",
+                headers={"If-None-Match": response.headers["ETag"]},
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_list_pages_and_stream(self):
+        app = create_app()
+        app.testing = True
+        operations = [{"command": "add", "name": "bread", "value": -2}] * 3
+        with app.test_client() as client:
+            client.post("/pockets/2000/batch", json={"operations": operations})
+
+            response = client.get("/pockets/2000?limit=2")
+            self.assertEqual(len(response.json["elements"]["standard"]), 2)
+            self.assertEqual(response.json["next_cursor"], "standard:2")
+
+            response = client.get("/pockets/2000?limit=0")
+            self.assertEqual(response.status_code, 400)
+            response = client.get("/pockets/2000?cursor=foo")
+            self.assertEqual(response.status_code, 400)
+
+            response = client.get(
+                "/pockets/2000?cursor=standard:1",
+                headers={"Accept": "application/x-ndjson"},
+            )
+            self.assertEqual(response.mimetype, "application/x-ndjson")
+            self.assertIn("ETag", response.headers)
+            lines = [json.loads(line) for line in response.data.splitlines()]
+            self.assertEqual([line["eid"] for line in lines], [2, 3])
+            self.assertEqual(lines[0]["table"], "standard")
+            self.assertEqual(lines[0]["element"]["name"], "bread")
+
+            response = client.get(
+                "/pockets/2000?cursor=foo", headers={"Accept": "application/x-ndjson"}
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+@mock.patch("financeager.DATA_DIR", TEST_DATA_DIR)
+class ImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.testing = True
+        self.client = self.app.test_client()
+
+    def test_import_csv(self):
+        data = (
+            "\ufeffName,Value,Category,Date,Comment\n"
+            "bread,-2,food,2020-01-01,\n"
+            '"beer, dark",-3.5,,2020-01-02,nice\n'
+            "rent,foo,,,\n"
+            "salary,1000,,2020-13-01,\n"
+            ",5,,,\n"
+        ).encode()
+        with mock.patch(
+            "financeager_flask.bulk.IMPORT_CHUNK_SIZE", 2
+        ), mock.patch.object(
+            self.app._server, "run", wraps=self.app._server.run
+        ) as mocked_run:
+            response = self.client.post(
+                "/pockets/2000/import", data=data, content_type="text/csv"
+            )
+        # One command per chunk of valid rows
+        self.assertEqual(mocked_run.call_count, 2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["imported"], 2)
+        self.assertEqual(response.json["failed"], 3)
+        errors = response.json["errors"]
+        self.assertEqual([e["row"] for e in errors], [3, 4, 5])
+        self.assertEqual(
+            errors[0]["error"], {"value": "could not convert string to float: 'foo'"}
+        )
+        self.assertEqual(errors[1]["status"], 400)
+        self.assertIn("date", errors[1]["error"])
+        self.assertIn("name", errors[2]["error"])
+
+        elements = self.client.get("/pockets/2000").json["elements"]["standard"]
+        self.assertEqual(
+            sorted((e["name"], e["category"]) for e in elements.values()),
+            [("beer, dark", None), ("bread", "food")],
+        )
+
+    def test_import_latin1(self):
+        for content_type, lines in [
+            ("text/csv", ["name,value", "bread,-2", "caf\xe9,-3", "beer,-1"]),
+            (
+                "application/x-ndjson",
+                [
+                    json.dumps({"name": "bread", "value": -2}),
+                    '{"name": "caf\xe9", "value": -3}',
+                    json.dumps({"name": "beer", "value": -1}),
+                ],
+            ),
+        ]:
+            with self.subTest(content_type):
+                response = self.client.post(
+                    "/pockets/2000/import",
+                    data="\n".join(lines).encode("latin-1"),
+                    content_type=content_type,
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json["imported"], 2)
+                self.assertEqual(
+                    response.json["errors"],
+                    [{"row": 2, "error": "Invalid UTF-8 encoding.", "status": 400}],
+                )
+
+    def test_import_ndjson(self):
+        lines = [
+            json.dumps({"name": "rent", "value": -500, "frequency": "monthly"}),
+            json.dumps(
+                {
+                    "name": "rent",
+                    "value": -500,
+                    "frequency": "monthly",
+                    "table_name": "recurrent",
+                }
+            ),
+            "",
+            "{",
+            "[1]",
+        ]
+        with mock.patch("financeager_flask.bulk.MAX_REPORTED_ERRORS", 1):
+            response = self.client.post(
+                "/pockets/2000/import",
+                data=gzip.compress("\n".join(lines).encode()),
+                headers={
+                    "Content-Type": "application/x-ndjson",
+                    "Content-Encoding": "gzip",
+                },
+            )
+        self.assertEqual(response.json["imported"], 2)
+        self.assertEqual(response.json["failed"], 2)
+        self.assertEqual(
+            response.json["errors"],
+            [{"row": 3, "error": "Invalid JSON.", "status": 400}],
+        )
+
+        response = self.client.get("/pockets/2000?recurrent_only=true")
+        self.assertEqual(len(response.json["elements"]), 1)
+
+    def test_export(self):
+        self.client.post(
+            "/pockets/2000/batch",
+            json={
+                "operations": [
+                    {
+                        "command": "add",
+                        "name": "bread",
+                        "value": -2,
+                        "date": "2020-01-01",
+                    },
+                    {
+                        "command": "add",
+                        "name": "rent",
+                        "value": -500,
+                        "category": "home",
+                        "frequency": "monthly",
+                        "start": "2020-01-01",
+                        "table_name": "recurrent",
+                    },
+                ]
+            },
+        )
+
+        with mock.patch("financeager_flask.bulk.EXPORT_CHUNK_SIZE", 1):
+            response = self.client.get("/pockets/2000/export")
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(
+            response.headers["Content-Disposition"], "attachment; filename=2000.ndjson"
+        )
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(
+            lines,
+            [
+                {
+                    "table_name": "standard",
+                    "eid": 1,
+                    "name": "bread",
+                    "value": -2.0,
+                    "category": None,
+                    "date": "2020-01-01",
+                },
+                {
+                    "table_name": "recurrent",
+                    "eid": 1,
+                    "name": "rent",
+                    "value": -500.0,
+                    "category": "home",
+                    "frequency": "monthly",
+                    "start": "2020-01-01",
+                    "end": None,
+                },
+            ],
+        )
+
+        response = self.client.get(
+            "/pockets/2000/export", headers={"If-None-Match": response.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            "/pockets/2000/export", headers={"Accept": "text/csv"}
+        )
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertEqual(
+            response.data.decode().splitlines(),
+            [
+                "table_name,eid,name,value,category,date,frequency,start,end",
+                "standard,1,bread,-2.0,,2020-01-01,,,",
+                "recurrent,1,rent,-500.0,home,,monthly,2020-01-01,",
+            ],
+        )
+
+        # Exported files can be imported again
+        response = self.client.post(
+            "/pockets/2001/import", data=response.data, content_type="text/csv"
+        )
+        self.assertEqual(response.json["imported"], 2)
+        self.assertEqual(
+            self.client.get("/pockets/2001").json, self.client.get("/pockets/2000").json
+        )
+
+    def test_export_import_ndjson(self):
+        operations = [
+            {"command": "add", "name": "bread", "value": -2, "category": "food"},
+            {"command": "add", "name": "bread", "value": -3},
+            {"command": "update", "eid": 2, "category": "-"},
+            {
+                "command": "add",
+                "name": "rent",
+                "value": -500,
+                "frequency": "monthly",
+                "start": "2020-01-01",
+                "table_name": "recurrent",
+            },
+        ]
+        self.client.post("/pockets/2000/batch", json={"operations": operations})
+        exported = self.client.get("/pockets/2000/export").data
+
+        response = self.client.post(
+            "/pockets/2001/import", data=exported, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.json["imported"], 3)
+        # Entry without category is not assigned the category of the other one
+        self.assertEqual(self.client.get("/pockets/2001/export").data, exported)
+        self.assertEqual(
+            self.client.get("/pockets/2001").json, self.client.get("/pockets/2000").json
+        )
+
+    def test_unsupported_format(self):
+        response = self.client.post(
+            "/pockets/2000/import", json={"name": "bread", "value": -2}
+        )
+        self.assertEqual(response.status_code, 415)
+
+
+@mock.patch("financeager.DATA_DIR", TEST_DATA_DIR)
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(config={"COMPRESS_MIN_SIZE": 100})
+        self.app.testing = True
+        self.client = self.app.test_client()
+
+        operations = [{"command": "add", "name": "bread", "value": -2}] * 10
+        self.client.post("/pockets/2000/batch", json={"operations": operations})
+
+    def test_compressed_response(self):
+        response = self.client.get("/pockets/2000", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        elements = json.loads(gzip.decompress(response.data))["elements"]
+        self.assertEqual(len(elements["standard"]), 10)
+
+        response = self.client.get(
+            "/pockets/2000", headers={"Accept-Encoding": "deflate"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "deflate")
+        self.assertIn("elements", json.loads(zlib.decompress(response.data)))
+
+    def test_uncompressed_response(self):
+        response = self.client.get("/pockets/2000")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+        # Body too small
+        response = self.client.get(
+            "/pockets/2000/standard/1", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.json["element"]["name"], "bread")
+
+    def test_compressed_request(self):
+        operations = [{"command": "add", "name": "beer", "value": -3}] * 2
+        response = self.client.post(
+            "/pockets/2000/batch",
+            data=gzip.compress(json.dumps({"operations": operations}).encode()),
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["results"], [{"id": 11}, {"id": 12}])
+
+    def test_invalid_compressed_request(self):
+        response = self.client.post(
+            "/pockets/2000/batch",
+            data=b"not compressed",
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_compressed_request_too_large(self):
+        self.app.wsgi_app.max_size = 100
+        response = self.client.post(
+            "/pockets/2000/batch",
+            data=gzip.compress(b" " * 1000 + b"{}"),
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+        )
+        self.assertEqual(response.status_code, 413)
+
+    def test_decompressed_size_limited_by_default(self):
+        # MAX_CONTENT_LENGTH is not set by default
+        self.assertIsNone(self.app.config["MAX_CONTENT_LENGTH"])
+        self.assertEqual(
+            self.app.wsgi_app.max_size, compression.DEFAULT_MAX_DECOMPRESSED_SIZE
+        )
+
+        app = create_app(config={"MAX_DECOMPRESSED_SIZE": 1000})
+        response = app.test_client().post(
+            "/pockets/2000/import",
+            data=gzip.compress(b"\n" * 10000),
+            headers={"Content-Encoding": "gzip", "Content-Type": "text/csv"},
+        )
+        self.assertEqual(response.status_code, 413)
+
+
+@mock.patch("financeager.DATA_DIR", TEST_DATA_DIR)
+class PocketLoadingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+        app = create_app(data_dir=self.data_dir)
+        app.test_client().post("/pockets/2020", json={"name": "bread", "value": -2})
+        app._server.run("stop")
+
+    def test_lazy_loading(self):
+        app = create_app(data_dir=self.data_dir)
+        self.assertEqual(app._server._pockets, {})
+
+    def test_preload(self):
+        app = create_app(data_dir=self.data_dir, config={"POCKET_PRELOAD": True})
+        self.assertEqual(list(app._server._pockets), ["2020"])
+
+    @mock.patch("financeager_flask.flask.logger.warning")
+    def test_snapshots_without_data_dir(self, mocked_warning):
+        app = create_app(config={"POCKET_SNAPSHOTS": True})
+        mocked_warning.assert_called_with(
+            "Snapshots disabled since no 'data_dir' given."
+        )
+        self.assertIsNone(app._server._snapshot_dir)
+
+    @mock.patch("financeager_flask.cache.install_shutdown_hook")
+    def test_snapshots(self, mocked_install):
+        app = create_app(data_dir=self.data_dir, config={"POCKET_SNAPSHOTS": True})
+        mocked_install.assert_called_once_with(app._server.save_snapshots)
+
+        result = app.test_cli_runner().invoke(args=["snapshot-pockets"])
+        self.assertEqual(result.exit_code, 0)
+        snapshot_dir = os.path.join(self.data_dir, "snapshots")
+        self.assertIn(f"Saved snapshots into '{snapshot_dir}'.", result.output)
+        self.assertTrue(os.path.exists(os.path.join(snapshot_dir, "2020.snapshot")))
+
+        app = create_app(data_dir=self.data_dir, config={"POCKET_SNAPSHOTS": True})
+        response = app.test_client().get("/pockets/2020/summary")
+        self.assertEqual(response.json["summary"]["standard"]["count"], 1)
+        self.assertIsNotNone(app._server._pockets["2020"]._lazy_category_cache)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,19 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch
 
-from financeager.exceptions import CommunicationError
+from financeager.exceptions import CommunicationError, InvalidRequest
+from requests import RequestException, Response
 
 from financeager_flask import DEFAULT_HOST, POCKETS_TAIL
+from financeager_flask.httprequests import AsyncProxy
 from financeager_flask.httprequests import Proxy as HttpProxy
 
 
@@ -13,9 +23,9 @@ class HttpRequestProxyTestCase(unittest.TestCase):
 
         class MockResponse:
             ok = True
-
-            def json(self):
-                return {}
+            status_code = 200
+            headers = {}
+            content = b"{}"
 
         return MockResponse()
 
@@ -32,7 +42,8 @@ class HttpRequestProxyTestCase(unittest.TestCase):
         )
 
         with patch(
-            "financeager_flask.httprequests.requests.post", side_effect=self.mock_post
+            "financeager_flask.httprequests.requests.Session.post",
+            side_effect=self.mock_post,
         ) as post_patch:
             proxy.run("pockets")
 
@@ -44,6 +55,264 @@ class HttpRequestProxyTestCase(unittest.TestCase):
             }
             post_patch.assert_called_once_with(url, **kwargs)
 
+    def test_session_reused(self):
+        proxy = HttpProxy({"pool_size": 3, "retries": 5})
+        session = proxy.session
+        self.assertIs(proxy.session, session)
+
+        adapter = session.get_adapter(DEFAULT_HOST)
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertEqual(session.headers["Connection"], "keep-alive")
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.post",
+            side_effect=self.mock_post,
+        ):
+            proxy.run("pockets")
+            proxy.run("pockets")
+        self.assertIs(proxy.session, session)
+
+    def test_no_keep_alive(self):
+        proxy = HttpProxy({"keep_alive": False})
+        self.assertEqual(proxy.session.headers["Connection"], "close")
+
+    def test_context_manager(self):
+        proxy = HttpProxy()
+        with proxy:
+            with proxy:
+                session = proxy.session
+            # Session is kept open until leaving outermost block
+            self.assertIs(proxy._session, session)
+        self.assertIsNone(proxy._session)
+
+    def test_run_batch(self):
+        proxy = HttpProxy({"timeout": 1})
+        operations = [{"command": "remove", "eid": 1}]
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.post",
+            side_effect=self.mock_post,
+        ) as post_patch:
+            proxy.run_batch(operations, pocket=2000)
+
+            url = "{}{}/2000/batch".format(DEFAULT_HOST, POCKETS_TAIL)
+            post_patch.assert_called_once_with(
+                url, json={"operations": operations}, auth=None, timeout=1
+            )
+
+    def test_aggregate(self):
+        proxy = HttpProxy({"timeout": 1})
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.post",
+            side_effect=self.mock_post,
+        ) as post_patch:
+            proxy.run("aggregate", pockets=["2000", "2001"], filters={"name": "a"})
+
+            post_patch.assert_called_once_with(
+                "{}/aggregate".format(DEFAULT_HOST),
+                json={"pockets": ["2000", "2001"], "filters": {"name": "a"}},
+                auth=None,
+                timeout=1,
+            )
+
+    def test_response_cache(self):
+        cache_dir = tempfile.mkdtemp(prefix="financeager-")
+        proxy = HttpProxy({"cache_dir": cache_dir})
+
+        response = Response()
+        response.status_code = 200
+        response.headers["ETag"] = '"abc"'
+        response._content = b'{"elements": {}}'
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            return_value=response,
+        ) as get_patch:
+            self.assertEqual(proxy.run("list"), {"elements": {}})
+            self.assertNotIn("headers", get_patch.call_args[1])
+
+            response.status_code = 304
+            response._content = b""
+            self.assertEqual(proxy.run("list"), {"elements": {}})
+            self.assertEqual(
+                get_patch.call_args[1]["headers"], {"If-None-Match": '"abc"'}
+            )
+
+            # Different filters are cached separately
+            response.status_code = 200
+            response._content = b'{"elements": []}'
+            self.assertEqual(proxy.run("list", recurrent_only=True), {"elements": []})
+            self.assertNotIn("headers", get_patch.call_args[1])
+
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_response_cache_size(self):
+        cache_dir = tempfile.mkdtemp(prefix="financeager-")
+        proxy = HttpProxy({"cache_dir": cache_dir, "cache_size": 2})
+
+        response = Response()
+        response.status_code = 200
+        response._content = b'{"element": {}}'
+
+        def get(eid):
+            response.headers["ETag"] = '"{}"'.format(eid)
+            proxy.run("get", eid=eid)
+            # Distinguish modification times
+            for i, entry in enumerate(
+                sorted(os.scandir(cache_dir), key=lambda e: e.stat().st_mtime)
+            ):
+                os.utime(entry.path, (i, i))
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            return_value=response,
+        ):
+            for eid in range(1, 4):
+                get(eid)
+
+            response.status_code = 304
+            get(2)
+            response.status_code = 200
+            get(4)
+
+        # Least recently used responses are removed
+        etags = {
+            proxy._load_cached(os.path.join(cache_dir, f))["etag"]
+            for f in os.listdir(cache_dir)
+        }
+        self.assertEqual(etags, {'"2"', '"4"'})
+
+    def test_compressed_request(self):
+        proxy = HttpProxy({"compress_min_size": 100})
+        operations = [{"command": "remove", "eid": 1}] * 10
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.post",
+            side_effect=self.mock_post,
+        ) as post_patch:
+            proxy.run_batch(operations[:1])
+            self.assertIn("json", post_patch.call_args[1])
+
+            proxy.run_batch(operations)
+            kwargs = post_patch.call_args[1]
+            self.assertNotIn("json", kwargs)
+            self.assertEqual(kwargs["headers"]["Content-Encoding"], "gzip")
+            self.assertEqual(
+                json.loads(gzip.decompress(kwargs["data"])),
+                {"operations": operations},
+            )
+
+    def test_iter_entries(self):
+        proxy = HttpProxy()
+
+        response = Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(
+            b'{"table": "standard", "eid": 1, "element": {}}\n'
+            b'{"table": "standard", "eid": 2, "element": {}}\n'
+            b'{"error": "unexpected error"}\n'
+        )
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            return_value=response,
+        ) as get_patch:
+            entries = proxy.iter_entries(pocket=2000, limit=5)
+            self.assertEqual(next(entries)["eid"], 1)
+
+            kwargs = get_patch.call_args[1]
+            self.assertTrue(kwargs["stream"])
+            self.assertEqual(kwargs["params"], {"limit": 5})
+            self.assertEqual(kwargs["headers"], {"Accept": "application/x-ndjson"})
+
+            self.assertEqual(next(entries)["eid"], 2)
+            self.assertRaises(CommunicationError, next, entries)
+
+    def test_export_entries(self):
+        proxy = HttpProxy()
+        filepath = os.path.join(tempfile.mkdtemp(prefix="financeager-"), "out.csv")
+
+        class IncompleteStream(io.BytesIO):
+            def read(self, *args, **kwargs):
+                if self.tell():
+                    raise RequestException("connection closed")
+                return super().read(*args, **kwargs)
+
+        for raw, expected_size in [
+            (io.BytesIO(b"table_name,eid\nstandard,1\n"), 26),
+            (IncompleteStream(b"table_name,eid\n"), None),
+        ]:
+            response = Response()
+            response.status_code = 200
+            response.raw = raw
+
+            with patch(
+                "financeager_flask.httprequests.requests.Session.get",
+                return_value=response,
+            ) as get_patch:
+                if expected_size is None:
+                    self.assertRaises(
+                        CommunicationError, proxy.export_entries, filepath
+                    )
+                else:
+                    self.assertEqual(
+                        proxy.export_entries(filepath, pocket=2000), expected_size
+                    )
+
+            kwargs = get_patch.call_args[1]
+            self.assertTrue(kwargs["stream"])
+            self.assertEqual(kwargs["headers"], {"Accept": "text/csv"})
+
+        # The file of the complete download is kept
+        with open(filepath) as file:
+            self.assertEqual(file.read(), "table_name,eid\nstandard,1\n")
+        self.assertEqual(os.listdir(os.path.dirname(filepath)), ["out.csv"])
+
+    def test_list_page(self):
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            side_effect=self.mock_post,
+        ) as get_patch:
+            HttpProxy().run("list", limit=5, cursor="standard:1", recurrent_only=False)
+            kwargs = get_patch.call_args[1]
+            self.assertEqual(kwargs["params"], {"cursor": "standard:1", "limit": 5})
+            self.assertNotIn("json", kwargs)
+
+    def test_list_filters_in_query(self):
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            side_effect=self.mock_post,
+        ) as get_patch:
+            HttpProxy().run(
+                "list",
+                pocket=2000,
+                filters={"name": "beer", "category": None},
+                recurrent_only=True,
+            )
+            self.assertEqual(
+                get_patch.call_args[1]["params"],
+                {
+                    "filter_category": "",
+                    "filter_name": "beer",
+                    "recurrent_only": "true",
+                },
+            )
+
+    def test_summary(self):
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            side_effect=self.mock_post,
+        ) as get_patch:
+            HttpProxy({"timeout": 1, "cache_dir": ""}).run("summary", pocket=2000)
+            get_patch.assert_called_once_with(
+                "{}/pockets/2000/summary".format(DEFAULT_HOST),
+                json=None,
+                auth=None,
+                timeout=1,
+            )
+
     def test_unknown_command(self):
         self.assertRaises(ValueError, HttpProxy({"timeout": 1}).run, "derp")
 
@@ -58,5 +327,88 @@ class HttpRequestProxyTestCase(unittest.TestCase):
         self.assertIn("NewConnectionError", error_message)
 
 
+class AsyncProxyTestCase(unittest.TestCase):
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def get(url, **kwargs):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(url)
+            return HttpRequestProxyTestCase.mock_post()
+
+        async def run_all(proxy):
+            return await asyncio.gather(
+                *[proxy.run("list", pocket=p) for p in range(8)]
+            )
+
+        proxy = AsyncProxy({"pool_size": 2}, max_concurrency=3)
+        self.assertEqual(proxy.proxy.http_config["pool_size"], 3)
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get", side_effect=get
+        ) as get_patch:
+            responses = asyncio.run(run_all(proxy))
+            proxy.close()
+
+        self.assertEqual(responses, [{}] * 8)
+        self.assertEqual(get_patch.call_count, 8)
+        self.assertEqual(max(peak), 3)
+
+    def test_aclose_does_not_block(self):
+        release = threading.Event()
+        released = []
+
+        def get(url, **kwargs):
+            # Released by the event loop unless it's blocked
+            released.append(release.wait(timeout=2))
+            return HttpRequestProxyTestCase.mock_post()
+
+        async def run(proxy):
+            async with proxy:
+                request = asyncio.ensure_future(proxy.run("list"))
+                await asyncio.sleep(0.01)
+
+                # The event loop keeps running while waiting for the request
+                loop = asyncio.get_running_loop()
+                loop.call_later(0.05, release.set)
+                await proxy.aclose()
+            return await request
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get", side_effect=get
+        ):
+            self.assertEqual(asyncio.run(run(AsyncProxy())), {})
+        self.assertEqual(released, [True])
+
+    def test_errors(self):
+        async def run(proxy):
+            async with proxy:
+                await proxy.run("get", pocket=2000, eid=1)
+
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            side_effect=RequestException("did not work"),
+        ):
+            with self.assertRaises(CommunicationError) as cm:
+                asyncio.run(run(AsyncProxy()))
+        self.assertEqual(str(cm.exception), "Error sending request: did not work")
+
+        response = Response()
+        response.status_code = 404
+        response._content = b'{"error": "Entry not found."}'
+        with patch(
+            "financeager_flask.httprequests.requests.Session.get",
+            return_value=response,
+        ):
+            with self.assertRaises(InvalidRequest):
+                asyncio.run(run(AsyncProxy()))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,28 @@
+import json
+import unittest
+
+from financeager_flask import jsonlib
+
+
+class JsonlibTestCase(unittest.TestCase):
+    def tearDown(self):
+        jsonlib.set_backend()
+
+    def test_roundtrip(self):
+        data = jsonlib.dumps({"elements": {1: {"name": "bread"}}})
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(jsonlib.loads(data), {"elements": {"1": {"name": "bread"}}})
+        self.assertRaises(ValueError, jsonlib.loads, b"{")
+
+    def test_set_backend(self):
+        jsonlib.set_backend(
+            dumps=lambda obj: json.dumps(obj, indent=2).encode(), loads=json.loads
+        )
+        self.assertEqual(jsonlib.dumps([1]), b"[\n  1\n]")
+
+        jsonlib.set_backend()
+        self.assertEqual(jsonlib.loads(jsonlib.dumps([1])), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import threading
+import time
+import unittest
+
+from financeager_flask.locking import RWLock, SynchronizedLRUCache
+
+
+class RWLockTestCase(unittest.TestCase):
+    def test_concurrent_readers(self):
+        lock = RWLock()
+        barrier = threading.Barrier(3, timeout=5)
+
+        def read():
+            with lock.read_locked():
+                # Fails with BrokenBarrierError unless all readers hold the lock
+                barrier.wait()
+
+        threads = [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(barrier.broken)
+
+    def test_exclusive_writer(self):
+        lock = RWLock()
+        events = []
+
+        def write():
+            with lock.write_locked():
+                events.append("write")
+
+        with lock.read_locked():
+            writer = threading.Thread(target=write)
+            writer.start()
+            time.sleep(0.05)
+            # Writer waits for the reader to release the lock
+            self.assertEqual(events, [])
+        writer.join()
+        self.assertEqual(events, ["write"])
+
+    def test_writer_preferred(self):
+        lock = RWLock()
+        events = []
+
+        def access(name, exclusive):
+            locked = lock.write_locked if exclusive else lock.read_locked
+            with locked():
+                events.append(name)
+
+        with lock.read_locked():
+            writer = threading.Thread(target=access, args=("write", True))
+            writer.start()
+            time.sleep(0.05)
+            # New reader waits for the waiting writer
+            reader = threading.Thread(target=access, args=("read", False))
+            reader.start()
+            time.sleep(0.05)
+            self.assertEqual(events, [])
+        writer.join()
+        reader.join()
+        self.assertEqual(events, ["write", "read"])
+
+
+class SynchronizedLRUCacheTestCase(unittest.TestCase):
+    def test_cache(self):
+        cache = SynchronizedLRUCache(capacity=1)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache["b"], 2)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+
+from financeager_flask.flask import create_app
+from financeager_flask.metrics import Counter, Histogram
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_counter(self):
+        counter = Counter("requests_total", "Number of requests.", ("path",))
+        counter.inc('/a"b')
+        counter.inc('/a"b', amount=2)
+        self.assertEqual(counter.value('/a"b'), 3)
+        self.assertEqual(
+            counter.render(),
+            [
+                "# HELP requests_total Number of requests.",
+                "# TYPE requests_total counter",
+                'requests_total{path="/a\\"b"} 3',
+            ],
+        )
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_histogram(self):
+        histogram = Histogram("duration_seconds", "Duration.", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(histogram.count(), 3)
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'duration_seconds_bucket{le="0.1"} 1',
+                'duration_seconds_bucket{le="1"} 2',
+                'duration_seconds_bucket{le="+Inf"} 3',
+                "duration_seconds_sum 5.55",
+                "duration_seconds_count 3",
+            ],
+        )
+
+
+class MetricsResourceTestCase(unittest.TestCase):
+    def test_disabled(self):
+        app = create_app()
+        with app.test_client() as client:
+            self.assertEqual(client.get("/metrics").status_code, 404)
+
+    def test_metrics(self):
+        app = create_app(
+            data_dir=tempfile.mkdtemp(prefix="financeager-"),
+            config={"METRICS": True},
+        )
+        with app.test_client() as client:
+            client.post("/pockets/2000", json={"name": "bread", "value": -2})
+            client.post("/pockets/2000", json={"name": "bread"})
+            client.get("/pockets/2000/standard/2")
+            client.get("/pockets/2000")
+
+            response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+
+        lines = response.get_data(as_text=True).splitlines()
+        prefix = "financeager_flask_"
+        for line in [
+            prefix + 'http_requests_total{resource="/pockets/<pocket_name>",'
+            'method="POST",status="200"} 1',
+            prefix + 'http_requests_total{resource="/pockets/<pocket_name>",'
+            'method="POST",status="400"} 1',
+            prefix + 'http_requests_total{resource="/pockets/<pocket_name>/'
+            '<table_name>/<eid>",method="GET",status="404"} 1',
+            prefix + 'command_duration_seconds_count{command="add",pocket="2000"} 1',
+            prefix + 'command_errors_total{command="get"} 1',
+            prefix + 'recurrent_cache_total{result="miss"} 0',
+        ]:
+            self.assertIn(line, lines)
+
+        storage_reads = [
+            line
+            for line in lines
+            if line.startswith(
+                prefix + 'storage_operation_duration_seconds_count{operation="read"}'
+            )
+        ]
+        self.assertEqual(storage_reads, [storage_reads[0]])
+        self.assertTrue(
+            any(
+                line.startswith(prefix + "http_request_size_bytes_count")
+                for line in lines
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
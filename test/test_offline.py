@@ -1,8 +1,12 @@
+import json
 import os.path
 import unittest
+from unittest import mock
+
+from financeager.exceptions import CommunicationError, InvalidRequest
 
 from financeager_flask import exceptions
-from financeager_flask.offline import _load, add, recover
+from financeager_flask.offline import _read, add, compact, recover
 
 from . import utils
 
@@ -12,12 +16,15 @@ class AddTestCase(unittest.TestCase):
     def setUpClass(cls):
         cls.filepath = os.path.join(os.path.expanduser("~"), "offline_test.json")
 
+    def load(self):
+        return [item for item, _ in _read(self.filepath)]
+
     def test_add_recover(self):
         pocket_name = "123"
         kwargs = dict(name="money", value=111, date="2019-01-31", pocket=pocket_name)
         self.assertTrue(add("add", offline_filepath=self.filepath, **kwargs))
 
-        content = _load(self.filepath)
+        content = self.load()
 
         self.assertIsInstance(content, list)
         self.assertEqual(len(content), 1)
@@ -45,13 +52,13 @@ class AddTestCase(unittest.TestCase):
         self.assertTrue(add(command, offline_filepath=self.filepath, **kwargs))
         self.assertTrue(add(command, offline_filepath=self.filepath, **kwargs))
 
-        # Create client, and fake the run method
+        # Create client, and fake the run_batch method
         client = utils.Client()
 
-        def run(command, **kwargs):
-            raise Exception
+        def run_batch(operations, pocket=None):
+            raise CommunicationError
 
-        client.proxy.run = run
+        client.proxy.run_batch = run_batch
 
         self.assertRaises(
             exceptions.OfflineRecoveryError,
@@ -60,14 +67,159 @@ class AddTestCase(unittest.TestCase):
             offline_filepath=self.filepath,
         )
 
-        content = _load(self.filepath)
+        content = self.load()
         kwargs["command"] = command
         self.assertDictEqual(content[0], kwargs)
         self.assertDictEqual(content[1], kwargs)
 
+    def test_recover_in_order(self):
+        add("add", offline_filepath=self.filepath, name="a", value=1, pocket="1")
+        add("add", offline_filepath=self.filepath, name="b", value=2, pocket="1")
+        add("update", offline_filepath=self.filepath, eid=1, name="c", pocket="1")
+        add("remove", offline_filepath=self.filepath, eid=9, pocket="1")
+
+        client = utils.Client()
+        client.sinks = mock.MagicMock()
+        with mock.patch.object(
+            client.proxy, "run_batch", wraps=client.proxy.run_batch
+        ) as run_batch:
+            self.assertTrue(recover(client, offline_filepath=self.filepath))
+        # All items are sent in a single request
+        run_batch.assert_called_once()
+
+        elements = client.proxy.run("list", pocket="1")["elements"]["standard"]
+        self.assertEqual([e["name"] for e in elements.values()], ["c", "b"])
+        self.assertEqual(client.sinks.info.call_count, 3)
+        # Invalid item is reported but not kept
+        client.sinks.error.assert_called_once_with(
+            "Failed to recover 'remove' request: Entry not found."
+        )
+        self.assertFalse(os.path.exists(self.filepath))
+
+    def test_partially_failed_recover(self):
+        for pocket in ["1", "1", "2", "3"]:
+            add("add", offline_filepath=self.filepath, name="a", value=1, pocket=pocket)
+
+        client = utils.Client()
+        run_batch = client.proxy.run_batch
+
+        def failing_run_batch(operations, pocket=None):
+            if pocket == "2":
+                raise CommunicationError
+            return run_batch(operations, pocket=pocket)
+
+        client.proxy.run_batch = failing_run_batch
+
+        with mock.patch("financeager_flask.offline.RECOVERY_CHUNK_SIZE", 1):
+            self.assertRaises(
+                exceptions.OfflineRecoveryError,
+                recover,
+                client,
+                offline_filepath=self.filepath,
+            )
+
+        # Items of the failed chunk and after are kept
+        content = self.load()
+        self.assertEqual([c["pocket"] for c in content], ["2", "3"])
+        self.assertEqual(
+            len(client.proxy.run("list", pocket="1")["elements"]["standard"]), 2
+        )
+
+    def test_recover_without_batch_endpoint(self):
+        add("add", offline_filepath=self.filepath, name="a", value=1, pocket="1")
+        add("remove", offline_filepath=self.filepath, eid=9, pocket="1")
+        add("add", offline_filepath=self.filepath, name="b", value=2, pocket="1")
+
+        client = utils.Client()
+        client.sinks = mock.MagicMock()
+
+        def run_batch(operations, pocket=None):
+            error = InvalidRequest("Not Found")
+            error.status_code = 404
+            raise error
+
+        client.proxy.run_batch = run_batch
+        run = client.proxy.run
+
+        def failing_run(command, **data):
+            if data.get("name") == "b":
+                raise CommunicationError
+            return run(command, **data)
+
+        # Items are sent one by one; recovered items are not sent again
+        with mock.patch.object(client.proxy, "run", side_effect=failing_run):
+            self.assertRaises(
+                exceptions.OfflineRecoveryError,
+                recover,
+                client,
+                offline_filepath=self.filepath,
+            )
+        self.assertEqual([c["name"] for c in self.load()], ["b"])
+        client.sinks.info.assert_called_once()
+        client.sinks.error.assert_called_once()
+
+        self.assertTrue(recover(client, offline_filepath=self.filepath))
+        elements = client.proxy.run("list", pocket="1")["elements"]["standard"]
+        self.assertEqual(sorted(e["name"] for e in elements.values()), ["a", "b"])
+        self.assertFalse(os.path.exists(self.filepath))
+
+    def test_recover_unexpected_error(self):
+        add("add", offline_filepath=self.filepath, name="a", value=1, pocket="1")
+
+        client = utils.Client()
+        client.proxy.run_batch = mock.Mock(side_effect=KeyError)
+        # Programming errors are not hidden
+        self.assertRaises(KeyError, recover, client, offline_filepath=self.filepath)
+
+    def test_add_appends(self):
+        add("remove", offline_filepath=self.filepath, eid=1, fsync=False)
+        with open(self.filepath, "a") as file:
+            # Simulate crash while writing
+            file.write('{"command": "rem')
+        add("remove", offline_filepath=self.filepath, eid=2)
+
+        with open(self.filepath) as file:
+            self.assertEqual(len(file.readlines()), 3)
+        # Corrupt line is skipped
+        self.assertEqual([c["eid"] for c in self.load()], [1, 2])
+
+    def test_migrate_legacy_format(self):
+        with open(self.filepath, "w") as file:
+            json.dump([{"command": "remove", "eid": 1}], file)
+        add("remove", offline_filepath=self.filepath, eid=2)
+
+        self.assertEqual([c["eid"] for c in self.load()], [1, 2])
+
+    def test_compact(self):
+        for eid in range(3):
+            add("remove", offline_filepath=self.filepath, eid=eid)
+        # Checkpoint after first item
+        offset = next(_read(self.filepath))[1]
+        with open(self.filepath + ".checkpoint", "w") as file:
+            file.write(str(offset))
+
+        compact(self.filepath)
+        self.assertEqual([c["eid"] for c in self.load()], [1, 2])
+        self.assertFalse(os.path.exists(self.filepath + ".checkpoint"))
+
+    def test_recover_from_checkpoint(self):
+        add("add", offline_filepath=self.filepath, name="a", value=1, pocket="1")
+        add("add", offline_filepath=self.filepath, name="b", value=2, pocket="1")
+        offset = next(_read(self.filepath))[1]
+        with open(self.filepath + ".checkpoint", "w") as file:
+            file.write(str(offset))
+
+        client = utils.Client()
+        self.assertTrue(recover(client, offline_filepath=self.filepath))
+
+        elements = client.proxy.run("list", pocket="1")["elements"]["standard"]
+        self.assertEqual([e["name"] for e in elements.values()], ["b"])
+        self.assertFalse(os.path.exists(self.filepath + ".checkpoint"))
+
     def tearDown(self):
-        if os.path.exists(self.filepath):
-            os.remove(self.filepath)
+        for path in [self.filepath, self.filepath + ".checkpoint"]:
+            if os.path.exists(path):
+                os.remove(path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+import os
+import pstats
+import tempfile
+import unittest
+from unittest import mock
+
+from financeager_flask import profiling
+from financeager_flask.flask import create_app
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+        self.profile_dir = os.path.join(self.data_dir, "profiles")
+
+    def test_disabled(self):
+        with mock.patch.object(profiling, "profiled") as mocked_profiled:
+            create_app(data_dir=self.data_dir)
+        mocked_profiled.assert_not_called()
+
+    @mock.patch.object(profiling.logger, "info")
+    def test_profile_on_request(self, mocked_info):
+        app = create_app(data_dir=self.data_dir, config={"PROFILE": True})
+        with app.test_client() as client:
+            client.get("/pockets/2000")
+            self.assertEqual(os.listdir(self.profile_dir), [])
+            mocked_info.assert_not_called()
+
+            response = client.get(
+                "/pockets/2000?filter_name=a",
+                headers={profiling.PROFILE_HEADER: "1"},
+            )
+        self.assertEqual(response.status_code, 200)
+
+        filenames = os.listdir(self.profile_dir)
+        self.assertEqual(len(filenames), 1)
+        self.assertIn("-GET-pockets_2000-", filenames[0])
+        stats = pstats.Stats(os.path.join(self.profile_dir, filenames[0]))
+        self.assertGreater(stats.total_calls, 0)
+
+        message = mocked_info.call_args[0][0]
+        self.assertTrue(message.startswith("Profiled GET /pockets/2000?filter_name=a"))
+        self.assertEqual(message.count(" ms"), profiling.DEFAULT_TOP)
+
+    def test_sample_rate(self):
+        app = create_app(
+            config={
+                "PROFILE": True,
+                "PROFILE_SAMPLE_RATE": 1,
+                "PROFILE_DIR": self.profile_dir,
+                "PROFILE_TOP": 3,
+            }
+        )
+        with app.test_client() as client:
+            client.get("/version")
+            client.post("/pockets/2000", json={"name": "bread", "value": -2})
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from datetime import date
+from unittest import mock
+
+from financeager.pocket import TinyDbPocket
+
+from financeager_flask.backend import ServerTinyDbPocket
+
+
+class RecurrentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.entry = {
+            "name": "rent",
+            "value": -500,
+            "frequency": "monthly",
+            "start": "2020-01-01",
+            "end": "2020-06-30",
+        }
+        self.pocket = ServerTinyDbPocket("2020")
+        self.eid = self.pocket.add_entry(table_name="recurrent", **self.entry)
+
+    def stats(self):
+        stats = self.pocket.recurrent_cache_stats()
+        return stats["hits"], stats["misses"]
+
+    def test_cached(self):
+        pocket = TinyDbPocket("2020")
+        pocket.add_entry(table_name="recurrent", **self.entry)
+        expected = pocket.get_entries()
+
+        self.assertEqual(self.pocket.get_entries(), expected)
+        self.assertEqual(self.stats(), (0, 1))
+
+        with mock.patch.object(
+            TinyDbPocket, "_create_recurrent_elements"
+        ) as mocked_create:
+            self.assertEqual(self.pocket.get_entries(), expected)
+        mocked_create.assert_not_called()
+        self.assertEqual(self.stats(), (1, 1))
+
+        # Modifying the generated elements doesn't affect the cache
+        expected["recurrent"][self.eid][0]["name"] = "foo"
+        self.assertEqual(
+            self.pocket.get_entries()["recurrent"][self.eid][0]["name"],
+            "rent, january",
+        )
+
+    def test_invalidated(self):
+        self.pocket.get_entries()
+
+        # Modifying the standard table keeps the cache
+        self.pocket.add_entry(name="bread", value=-2)
+        self.pocket.get_entries()
+        self.assertEqual(self.stats(), (1, 1))
+
+        self.pocket.update_entry(self.eid, table_name="recurrent", end="2020-03-31")
+        elements = self.pocket.get_entries()["recurrent"][self.eid]
+        self.assertEqual(len(elements), 3)
+        self.assertEqual(self.stats(), (1, 2))
+
+        with mock.patch("financeager_flask.recurrent.date") as mocked_date:
+            mocked_date.today.return_value = date(2100, 1, 1)
+            self.pocket.get_entries()
+        self.assertEqual(self.stats(), (1, 3))
+
+    def test_outdated_snapshot(self):
+        snapshot = self.pocket.get_entry(self.eid, table_name="recurrent")
+        self.pocket.update_entry(self.eid, table_name="recurrent", value=-600)
+        self.pocket.get_entries()
+
+        elements = list(self.pocket._create_recurrent_elements(snapshot))
+        self.assertEqual(elements[0]["value"], -500)
+        self.assertEqual(self.stats(), (0, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
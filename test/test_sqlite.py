@@ -0,0 +1,264 @@
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+
+from financeager import UNSET_INDICATOR, exceptions
+from financeager.pocket import TinyDbPocket
+
+from financeager_flask.backend import SQLITE_ENGINE, Server
+from financeager_flask.flask import create_app
+from financeager_flask.sqlite import (
+    FILE_EXTENSION,
+    SqlitePocket,
+    filter_clause,
+    migrate,
+)
+
+ENTRIES = [
+    {"name": "bread", "value": -2, "date": "2020-01-01"},
+    {"name": "Beer", "value": -5, "date": "2020-02-14", "category": "drinks"},
+    {"name": "salary", "value": 1000, "date": "2021-01-31", "category": "income"},
+    {"name": "pizza", "value": -8.5, "date": "2020-12-24"},
+]
+RECURRENT_ENTRIES = [
+    {"name": "rent", "value": -500, "frequency": "monthly", "start": "2020-01-01"},
+    {
+        "name": "insurance",
+        "value": -100,
+        "category": "fees",
+        "frequency": "quarter-yearly",
+        "start": "2020-01-01",
+        "end": "2020-12-31",
+    },
+]
+
+
+def fill(pocket):
+    for entry in ENTRIES:
+        pocket.add_entry(**entry)
+    for entry in RECURRENT_ENTRIES:
+        pocket.add_entry(table_name="recurrent", **entry)
+
+
+class SqlitePocketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.pocket = SqlitePocket("2020", data_dir=self.data_dir)
+
+    def tearDown(self):
+        self.pocket.close()
+
+    def test_crud(self):
+        eid = self.pocket.add_entry(name="Bread", value=-2, date="2020-01-01")
+        self.assertEqual(eid, 1)
+        element = self.pocket.get_entry(eid)
+        self.assertEqual(element.doc_id, 1)
+        self.assertEqual(
+            element,
+            {"name": "bread", "value": -2.0, "category": None, "date": "2020-01-01"},
+        )
+
+        self.assertEqual(self.pocket.update_entry(eid, category="food"), 1)
+        self.assertEqual(self.pocket.get_entry(eid)["category"], "food")
+
+        # Category is derived from previous entries of the same name
+        eid = self.pocket.add_entry(name="bread", value=-3)
+        self.assertEqual(self.pocket.get_entry(eid)["category"], "food")
+
+        self.assertEqual(self.pocket.remove_entry(eid), 2)
+        with self.assertRaises(exceptions.PocketEntryNotFound):
+            self.pocket.get_entry(eid)
+        with self.assertRaises(exceptions.PocketEntryNotFound):
+            self.pocket.update_entry(eid, name="foo")
+        with self.assertRaises(exceptions.PocketValidationFailure):
+            self.pocket.add_entry(name="", value=1)
+
+        eid = self.pocket.add_entry(
+            table_name="recurrent", end="2020-03-01", **RECURRENT_ENTRIES[0]
+        )
+        self.pocket.update_entry(eid, table_name="recurrent", end=UNSET_INDICATOR)
+        self.assertIsNone(self.pocket.get_entry(eid, table_name="recurrent")["end"])
+
+    def test_persisted(self):
+        fill(self.pocket)
+        self.pocket.close()
+
+        pocket = SqlitePocket("2020", data_dir=self.data_dir)
+        self.assertEqual(pocket.get_entry(2)["name"], "beer")
+        self.assertEqual(pocket._category_cache["beer"]["drinks"], 1)
+        pocket.close()
+
+    def test_filters_like_tinydb(self):
+        tinydb_pocket = TinyDbPocket("2020")
+        fill(tinydb_pocket)
+        fill(self.pocket)
+
+        for filters in [
+            None,
+            {"name": "b"},
+            {"name": "^b.*r$"},
+            {"category": None},
+            {"category": "in"},
+            {"value": "-5"},
+            {"date": "2020"},
+            {"date": "2020-0"},
+            {"date": "2020-"},
+            {"date": "020"},
+            {"date": "020-12"},
+            {"date": "1-31"},
+            {"date": "-12-"},
+            {"date": "20(20|21)-01"},
+            {"end": None},
+            {"frequency": "month"},
+            {"name": "rent", "date": "2020-1"},
+        ]:
+            for recurrent_only in [False, True]:
+                with self.subTest(filters=filters, recurrent_only=recurrent_only):
+                    self.assertEqual(
+                        self.pocket.get_entries(
+                            filters=filters, recurrent_only=recurrent_only
+                        ),
+                        tinydb_pocket.get_entries(
+                            filters=filters, recurrent_only=recurrent_only
+                        ),
+                    )
+
+    def test_transaction(self):
+        with self.pocket.transaction():
+            fill(self.pocket)
+            self.assertTrue(self.pocket._connection.in_transaction)
+        self.assertFalse(self.pocket._connection.in_transaction)
+        self.assertEqual(len(self.pocket.documents("standard")), len(ENTRIES))
+
+    def test_date_filter_uses_index(self):
+        clause, parameters = filter_clause("standard", {"date": "2020-0"})
+        plan = self.pocket._connection.execute(
+            f"EXPLAIN QUERY PLAN SELECT * FROM standard WHERE {clause}", parameters
+        ).fetchall()
+        self.assertIn("standard_date", plan[0]["detail"])
+
+
+class SqliteServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+        self.server = Server(data_dir=self.data_dir, storage_engine=SQLITE_ENGINE)
+
+    def tearDown(self):
+        self.server.run("stop")
+
+    def test_invalid_config(self):
+        with self.assertRaises(ValueError):
+            Server(storage_engine="csv")
+        with self.assertRaises(ValueError):
+            Server(storage_engine=SQLITE_ENGINE, cache_mode="write-behind")
+
+    def test_commands(self):
+        response = self.server.run(
+            "batch",
+            pocket="2020",
+            operations=[{"command": "add", **e} for e in ENTRIES]
+            + [{"command": "remove", "eid": 5}],
+        )
+        self.assertEqual([r.get("id") for r in response["results"]], [1, 2, 3, 4, None])
+        self.assertEqual(self.server.run("pockets"), {"pockets": ["2020"]})
+
+        response = self.server.run("list", pocket="2020", filters={"date": "2020"})
+        self.assertEqual(sorted(response["elements"]["standard"]), [1, 2, 4])
+
+        response = self.server.run("summary", pocket="2020")
+        self.assertEqual(response["summary"]["standard"]["count"], 4)
+        self.assertEqual(response["summary"]["standard"]["total"], 984.5)
+
+        response = self.server.run("list", pocket="2020", limit=2)
+        self.assertEqual(response["next_cursor"], "standard:2")
+
+        response = self.server.run(
+            "copy", source_pocket="2020", destination_pocket="2021", eid=3
+        )
+        self.assertEqual(response, {"id": 1})
+
+        response = self.server.run("list", pocket="2020", filters={"value": "foo"})
+        self.assertIn("error", response)
+
+    def test_import(self):
+        response = self.server.run(
+            "import", pocket="2020", entries=ENTRIES + [{"name": "", "value": 1}]
+        )
+        self.assertEqual([r.get("id") for r in response["results"]], [1, 2, 3, 4, None])
+
+        response = self.server.run("list", pocket="2020", filters={"date": "2020"})
+        self.assertEqual(sorted(response["elements"]["standard"]), [1, 2, 4])
+
+        # Category given as None is kept
+        entries = [
+            {"name": "beer", "value": -3},
+            {"name": "beer", "category": None, "value": -4},
+        ]
+        response = self.server.run("import", pocket="2020", entries=entries)
+        categories = [
+            self.server.run("get", pocket="2020", eid=r["id"])["element"]["category"]
+            for r in response["results"]
+        ]
+        self.assertEqual(categories, ["drinks", None])
+
+
+class MigrateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix="financeager-")
+        pocket = TinyDbPocket("2020", data_dir=self.data_dir)
+        fill(pocket)
+        pocket.remove_entry(1)
+        self.expected = pocket.get_entries()
+        pocket.close()
+
+    def test_migrate(self):
+        self.assertEqual(migrate(self.data_dir), ["2020"])
+        self.assertEqual(migrate(self.data_dir), [])
+
+        pocket = SqlitePocket("2020", data_dir=self.data_dir)
+        self.assertEqual(pocket.get_entries(), self.expected)
+        # IDs continue after the highest migrated ID
+        self.assertEqual(pocket.add_entry(name="foo", value=1), len(ENTRIES) + 1)
+        pocket.close()
+
+        self.assertEqual(migrate(self.data_dir, overwrite=True), ["2020"])
+
+    def test_migrate_removes_stale_log(self):
+        migrate(self.data_dir)
+        target = os.path.join(self.data_dir, f"2020{FILE_EXTENSION}")
+        for suffix in ["-wal", "-shm"]:
+            with open(target + suffix, "wb") as file:
+                file.write(b"stale")
+
+        existing = []
+
+        def create_pocket(*args, **kwargs):
+            existing.extend(
+                s for s in ["", "-wal", "-shm"] if os.path.exists(target + s)
+            )
+            return SqlitePocket(*args, **kwargs)
+
+        with mock.patch(
+            "financeager_flask.sqlite.SqlitePocket", side_effect=create_pocket
+        ):
+            self.assertEqual(migrate(self.data_dir, overwrite=True), ["2020"])
+        self.assertEqual(existing, [])
+
+    def test_cli(self):
+        app = create_app(
+            data_dir=self.data_dir, config={"POCKET_STORAGE_ENGINE": SQLITE_ENGINE}
+        )
+        result = app.test_cli_runner().invoke(args=["migrate-pockets"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Migrated pocket '2020'.", result.output)
+
+        response = app.test_client().get("/pockets/2020")
+        self.assertEqual(
+            sorted(response.json["elements"]["standard"]),
+            [str(eid) for eid in self.expected["standard"]],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import random
+import unittest
+
+from financeager import exceptions
+
+from financeager_flask.backend import ServerTinyDbPocket
+from financeager_flask.summary import Summary
+
+
+class SummaryTestCase(unittest.TestCase):
+    def test_add_remove(self):
+        summary = Summary()
+        summary.add("standard", {"value": -2, "category": None, "date": "2020-01-01"})
+        summary.add("standard", {"value": -3, "category": "food", "date": "2020-01-31"})
+        summary.add("recurrent", {"value": -500, "category": None, "end": None})
+        self.assertEqual(
+            summary.as_dict(),
+            {
+                "standard": {
+                    "count": 2,
+                    "total": -5,
+                    "categories": [
+                        {"category": None, "count": 1, "total": -2},
+                        {"category": "food", "count": 1, "total": -3},
+                    ],
+                    "months": [{"month": "2020-01", "count": 2, "total": -5}],
+                },
+                "recurrent": {
+                    "templates": {
+                        "count": 1,
+                        "total": -500,
+                        "categories": [{"category": None, "count": 1, "total": -500}],
+                    },
+                },
+            },
+        )
+
+        summary.remove(
+            "standard", {"value": -2, "category": None, "date": "2020-01-01"}
+        )
+        self.assertEqual(
+            summary.as_dict()["standard"]["categories"],
+            [{"category": "food", "count": 1, "total": -3}],
+        )
+
+
+class SummaryMixinTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pocket = ServerTinyDbPocket("2020")
+
+    def recomputed(self):
+        pocket = ServerTinyDbPocket("2020")
+        pocket._db = self.pocket._db
+        return pocket.summary()
+
+    def test_maintained_incrementally(self):
+        self.pocket.add_entry(name="bread", value=-2, date="2020-01-01")
+        self.assertEqual(self.pocket.summary()["standard"]["count"], 1)
+
+        rng = random.Random(42)
+        categories = [None, "food", "fun"]
+        for _ in range(200):
+            eids = [e.doc_id for e in self.pocket._db.table("standard").all()]
+            operation = rng.choice(["add", "add", "update", "remove"])
+            if operation == "add" or not eids:
+                self.pocket.add_entry(
+                    name=rng.choice(["bread", "beer", "rent"]),
+                    value=rng.randint(-100, 100) / 4,
+                    category=rng.choice(categories),
+                    date="2020-{:02d}-01".format(rng.randint(1, 12)),
+                )
+            elif operation == "update":
+                self.pocket.update_entry(
+                    rng.choice(eids),
+                    value=rng.randint(-100, 100) / 4,
+                    category=rng.choice(categories[1:]),
+                    date="2020-{:02d}-15".format(rng.randint(1, 12)),
+                )
+            else:
+                self.pocket.remove_entry(rng.choice(eids))
+
+        eid = self.pocket.add_entry(
+            table_name="recurrent", name="rent", value=-500, frequency="monthly"
+        )
+        self.pocket.update_entry(eid, table_name="recurrent", value=-600)
+
+        self.assertEqual(self.pocket.summary(), self.recomputed())
+        self.assertEqual(self.pocket.summary()["recurrent"]["templates"]["total"], -600)
+
+    def test_errors(self):
+        self.pocket.summary()
+        with self.assertRaises(exceptions.PocketEntryNotFound):
+            self.pocket.update_entry(1, name="foo")
+        with self.assertRaises(exceptions.PocketValidationFailure):
+            self.pocket.update_entry(1, value="foo")
+        with self.assertRaises(exceptions.PocketEntryNotFound):
+            self.pocket.remove_entry(1)
+        self.assertEqual(self.pocket.summary()["standard"]["count"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from flask import Flask
+from flask_restful import reqparse
+from werkzeug.exceptions import HTTPException
+
+from financeager_flask.validation import RequestSchema
+
+
+def parse(parser, app, **request_kwargs):
+    with app.test_request_context("/", method="POST", **request_kwargs):
+        try:
+            return dict(parser.parse_args())
+        except HTTPException as e:
+            return e.code, getattr(e, "data", None)
+
+
+class RequestSchemaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.schema = RequestSchema()
+        self.parser = reqparse.RequestParser()
+        for parser in [self.schema, self.parser]:
+            parser.add_argument("name", required=True)
+            parser.add_argument("value", required=True, type=float)
+            parser.add_argument("eid", type=int)
+            parser.add_argument("category")
+
+    def test_same_as_reqparse(self):
+        for request_kwargs in [
+            {},
+            {"json": {"name": "bread", "value": -2}},
+            {"json": {"name": "bread", "value": "-2.5", "eid": "3"}},
+            {"json": {"name": 42, "value": True, "category": None}},
+            {"json": {"name": "bread"}},
+            {"json": {"name": "bread", "value": "foo"}},
+            {"json": {"name": "bread", "value": {}}},
+            {"json": {"name": "bread", "value": 1, "eid": "1.5"}},
+            {"json": {"name": ["a", "b"], "value": [1, 2]}},
+            {"json": {"name": "bread", "value": []}},
+            {"json": {"name": "bread", "value": [1, "foo"]}},
+            {"json": {"name": "bread", "value": 1}, "query_string": {"value": "2"}},
+            {"data": {"name": "bread", "value": "3"}},
+            {"query_string": {"name": "bread", "value": "3", "eid": "x"}},
+            {"data": "{", "content_type": "application/json"},
+        ]:
+            with self.subTest(request_kwargs=request_kwargs):
+                self.assertEqual(
+                    parse(self.schema, self.app, **request_kwargs),
+                    parse(self.parser, self.app, **request_kwargs),
+                )
+
+    def test_json_body_not_an_object(self):
+        self.assertEqual(
+            parse(self.schema, self.app, json=[1, 2]),
+            (400, {"message": "JSON body must be an object."}),
+        )
+
+    def test_parse_dict(self):
+        self.assertEqual(
+            dict(self.schema.parse({"name": "bread", "value": "-2", "foo": 1})),
+            {"name": "bread", "value": -2.0, "eid": None, "category": None},
+        )
+        with self.assertRaises(HTTPException) as context:
+            self.schema.parse({"name": "bread", "value": "foo"})
+        self.assertEqual(
+            context.exception.data,
+            {"message": {"value": "could not convert string to float: 'foo'"}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,21 @@
 """Utiliary classes for testing."""
-from financeager import clients
+from financeager import clients, localserver
 
-from financeager_flask import main
+from financeager_flask import backend, main
+
+
+class LocalProxy(localserver.Proxy, backend.Server):
+    """Local server proxy that supports sending batches of operations like
+    httprequests.Proxy does.
+    """
+
+    def run_batch(self, operations, pocket=None):
+        return self.run("batch", pocket=pocket, operations=operations)
 
 
 class Client(clients.LocalServerClient):
     """Implementation that assigns dummy sinks to consume the client's output.
-    The underlying Proxy is patched to store data in memory instead of in
+    The underlying Proxy stores data in memory instead of in
     financeager.DATA_DIR.
     """
 
@@ -16,4 +25,4 @@ class Client(clients.LocalServerClient):
             configuration=main._Configuration(), sinks=clients.Client.Sinks(f, f)
         )
 
-        self.proxy._pocket_kwargs["data_dir"] = None
+        self.proxy = LocalProxy(data_dir=None)